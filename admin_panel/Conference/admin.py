@@ -1,23 +1,254 @@
-from django.contrib import admin
+import io
+import os
+import threading
+
+from django import forms
+from django.contrib import admin, messages
 from django.contrib.auth.models import User, Group
-from .models import Speaker, Conference, Performance
+from django.core.paginator import Paginator
+from django.db import connection
+from django.db.models import Max
+from django.http import HttpResponse
+from django.utils.functional import cached_property
+from django.shortcuts import redirect
+from django.template.response import TemplateResponse
+from django.urls import path
+from telegram import Bot
+
+from .broadcast import run_broadcast_in_thread
+from .models import (
+    Speaker,
+    Conference,
+    Performance,
+    Question,
+    BotUser,
+    Broadcast
+)
+from .schedule_io import (
+    FORMATS,
+    ScheduleImportError,
+    export_schedule,
+    guess_format,
+    import_schedule
+)
+
+
+class EstimatedCountPaginator(Paginator):
+    """Пагинатор, который не считает COUNT(*) по всей большой таблице.
+
+    Без фильтров число строк берётся из статистики PostgreSQL или, для
+    SQLite, из наибольшего первичного ключа. С фильтрами считается
+    точно: индексы по фильтруемым полям делают это быстрым.
+    """
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if queryset.query.where:
+            return super().count
+
+        table = queryset.model._meta.db_table
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'SELECT reltuples FROM pg_class WHERE relname = %s',
+                    [table]
+                )
+                row = cursor.fetchone()
+            if row and row[0] > 0:
+                return int(row[0])
+            return super().count
+
+        # Удалённые строки оставляют пропуски, поэтому это оценка сверху
+        return queryset.aggregate(last_pk=Max('pk'))['last_pk'] or 0
 
 
 # Register your models here.
 @admin.register(Speaker)
 class SpeakerAdmin(admin.ModelAdmin):
     list_display = ['telegram_id', 'fullname']
+    search_fields = ['fullname', '=telegram_id']
+
+
+class ScheduleImportForm(forms.Form):
+    file = forms.FileField(
+        label='Файл программы',
+        help_text='CSV, JSON или JSON Lines с колонками: '
+                  'conference, date, time, performance, description, '
+                  'speaker_telegram_id, speaker_fullname, speaker_speciality'
+    )
 
 
 @admin.register(Conference)
 class ConferenceAdmin(admin.ModelAdmin):
     list_display = ['name', 'date']
+    search_fields = ['name']
+    ordering = ['date', 'name']
+    change_list_template = 'admin/Conference/conference/change_list.html'
+    actions = ['export_schedule']
+
+    def get_urls(self):
+        return [
+            path(
+                'import/',
+                self.admin_site.admin_view(self.import_schedule_view),
+                name='Conference_conference_import'
+            ),
+        ] + super().get_urls()
+
+    def import_schedule_view(self, request):
+        if not self.has_add_permission(request):
+            return redirect('admin:Conference_conference_changelist')
+
+        form = ScheduleImportForm(request.POST or None, request.FILES or None)
+        if request.method == 'POST' and form.is_valid():
+            upload = form.cleaned_data['file']
+            try:
+                report = import_schedule(
+                    io.TextIOWrapper(upload.file, encoding='utf-8-sig',
+                                     newline=''),
+                    file_format=guess_format(upload.name)
+                )
+            except (ScheduleImportError, ValueError) as error:
+                self.message_user(
+                    request,
+                    f'Программа не загружена: {error}',
+                    level=messages.ERROR
+                )
+            else:
+                self.message_user(
+                    request,
+                    f'Загружено строк: {report.rows} за '
+                    f'{report.seconds:.1f} с '
+                    f'({report.rows_per_second:.0f} строк/с). '
+                    f'{"; ".join(report.summary())}.'
+                )
+                return redirect('admin:Conference_conference_changelist')
+
+        return TemplateResponse(
+            request,
+            'admin/Conference/conference/import_schedule.html',
+            {
+                **self.admin_site.each_context(request),
+                'opts': self.model._meta,
+                'title': 'Загрузка программы',
+                'form': form,
+                'formats': ', '.join(FORMATS),
+            }
+        )
+
+    @admin.action(description='Выгрузить программу в CSV')
+    def export_schedule(self, request, queryset):
+        response = HttpResponse(content_type='text/csv; charset=utf-8')
+        response['Content-Disposition'] = 'attachment; filename="schedule.csv"'
+        export_schedule(response, file_format='csv', conferences=queryset)
+        return response
 
 
 @admin.register(Performance)
 class PerformanceAdmin(admin.ModelAdmin):
     list_display = ['name', 'time', 'speaker', 'conference']
     list_filter = ['conference']
+    list_select_related = ['speaker', 'conference']
+    search_fields = ['name', 'speaker__fullname']
+    autocomplete_fields = ['speaker', 'conference']
+    # Совпадает с уникальным индексом (conference, time)
+    ordering = ['conference', 'time']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+
+class AnsweredFilter(admin.SimpleListFilter):
+    title = 'ответ спикера'
+    parameter_name = 'answered'
+
+    def lookups(self, request, model_admin):
+        return [('yes', 'Есть ответ'), ('no', 'Без ответа')]
+
+    def queryset(self, request, queryset):
+        if self.value() == 'yes':
+            return queryset.filter(answered_at__isnull=False)
+        if self.value() == 'no':
+            return queryset.filter(answered_at__isnull=True)
+        return queryset
+
+
+@admin.register(Question)
+class QuestionAdmin(admin.ModelAdmin):
+    list_display = ['pk', 'short_question', 'speaker', 'status',
+                    'is_answered', 'created_at']
+    list_display_links = ['pk', 'short_question']
+    list_filter = ['status', AnsweredFilter, 'speaker']
+    list_select_related = ['speaker']
+    list_per_page = 50
+    search_fields = ['=telegram_user_id', 'question']
+    autocomplete_fields = ['speaker']
+    readonly_fields = ['telegram_user_id', 'forwarded_message_id', 'status',
+                       'duplicate_of', 'created_at', 'delivered_at',
+                       'answered_at', 'answer_message_id',
+                       'answer_delivered_at', 'answer_error']
+    ordering = ['-pk']
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+
+    @admin.display(description='Вопрос')
+    def short_question(self, question):
+        if len(question.question) <= 80:
+            return question.question
+        return f'{question.question[:80]}…'
+
+    @admin.display(description='Есть ответ', boolean=True,
+                   ordering='answered_at')
+    def is_answered(self, question):
+        return question.answered_at is not None
+
+
+@admin.register(BotUser)
+class BotUserAdmin(admin.ModelAdmin):
+    list_display = ['telegram_id', 'first_name', 'username', 'created_at',
+                    'is_blocked']
+    list_filter = ['is_blocked']
+    search_fields = ['=telegram_id', 'username']
+
+
+@admin.register(Broadcast)
+class BroadcastAdmin(admin.ModelAdmin):
+    list_display = ['__str__', 'status', 'sent_count', 'failed_count',
+                    'messages_per_second', 'created_at']
+    readonly_fields = ['status', 'started_at', 'finished_at', 'sent_count',
+                       'failed_count', 'sending_seconds']
+    actions = ['send']
+
+    @admin.action(description='Отправить выбранные рассылки')
+    def send(self, request, queryset):
+        bot = Bot(os.environ['TELEGRAM_BOT_TOKEN'])
+        started = 0
+        for broadcast in queryset.filter(status=Broadcast.NEW):
+            # Рассылку забирает тот, чей UPDATE сменил статус: повторное
+            # нажатие или второй администратор её уже не запустят
+            claimed = Broadcast.objects.filter(
+                pk=broadcast.pk,
+                status=Broadcast.NEW
+            ).update(status=Broadcast.RUNNING)
+            if not claimed:
+                continue
+            broadcast.status = Broadcast.RUNNING
+            threading.Thread(
+                target=run_broadcast_in_thread,
+                args=(broadcast, bot),
+                daemon=True
+            ).start()
+            started += 1
+        self.message_user(
+            request,
+            f'Запущено рассылок: {started}. '
+            f'Прогресс виден в списке рассылок, прерванную рассылку '
+            f'можно продолжить командой send_broadcast --id.'
+        )
+
+    @admin.display(description='Сообщений в секунду')
+    def messages_per_second(self, broadcast):
+        return f'{broadcast.messages_per_second:.1f}'
 
 
 admin.site.unregister(User)
@@ -9,3 +9,6 @@ class ConferenceConfig(AppConfig):
         name = 'admin_panel.Conference'
     else:
         name = "Conference"
+
+    def ready(self):
+        from . import signals  # noqa: F401
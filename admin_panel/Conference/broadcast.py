@@ -0,0 +1,100 @@
+import logging
+import time
+
+from django.db import connection
+from django.utils import timezone
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+from .models import BotUser, Broadcast
+from .ratelimit import GLOBAL_MESSAGES_PER_SECOND, TokenBucket
+
+
+logger = logging.getLogger(__name__)
+
+MAX_RETRIES = 5
+BATCH_SIZE = 100
+
+
+def deliver(bot, chat_id: int, text: str, sleep=time.sleep) -> bool:
+    for attempt in range(MAX_RETRIES):
+        try:
+            bot.send_message(chat_id=chat_id, text=text)
+            return True
+        except RetryAfter as error:
+            sleep(error.retry_after)
+        except (Unauthorized, BadRequest):
+            raise
+        except NetworkError:
+            sleep(2 ** attempt)
+    return False
+
+
+def run_broadcast(broadcast: Broadcast, bot,
+                  rate: float = GLOBAL_MESSAGES_PER_SECOND,
+                  batch_size: int = BATCH_SIZE,
+                  clock=time.monotonic, sleep=time.sleep) -> Broadcast:
+    """Рассылает сообщение всем пользователям бота.
+
+    Прогресс сохраняется после каждой пачки пользователей, поэтому
+    прерванная рассылка продолжается с места остановки. В каждый чат
+    уходит одно сообщение, так что ограничивать нужно только общий темп.
+    """
+    bucket = TokenBucket(rate=rate, capacity=1, clock=clock, sleep=sleep)
+
+    broadcast.status = Broadcast.RUNNING
+    broadcast.started_at = broadcast.started_at or timezone.now()
+    broadcast.save(update_fields=['status', 'started_at'])
+
+    while True:
+        users = list(
+            BotUser.objects.filter(
+                pk__gt=broadcast.last_user_pk,
+                is_blocked=False
+            ).order_by('pk')[:batch_size]
+        )
+        if not users:
+            break
+
+        batch_started_at = clock()
+        blocked_user_pks = []
+        for user in users:
+            bucket.acquire()
+            try:
+                delivered = deliver(
+                    bot,
+                    chat_id=user.telegram_id,
+                    text=broadcast.text,
+                    sleep=sleep
+                )
+            except Unauthorized:
+                blocked_user_pks.append(user.pk)
+                delivered = False
+            except BadRequest:
+                logger.warning('Broadcast to %s rejected', user.telegram_id)
+                delivered = False
+
+            if delivered:
+                broadcast.sent_count += 1
+            else:
+                broadcast.failed_count += 1
+
+        BotUser.objects.filter(pk__in=blocked_user_pks).update(is_blocked=True)
+        broadcast.last_user_pk = users[-1].pk
+        broadcast.sending_seconds += clock() - batch_started_at
+        broadcast.save(update_fields=[
+            'last_user_pk', 'sent_count', 'failed_count', 'sending_seconds'
+        ])
+
+    broadcast.status = Broadcast.FINISHED
+    broadcast.finished_at = timezone.now()
+    broadcast.save(update_fields=['status', 'finished_at'])
+    return broadcast
+
+
+def run_broadcast_in_thread(broadcast: Broadcast, bot) -> None:
+    try:
+        run_broadcast(broadcast, bot)
+    except Exception:
+        logger.exception('Broadcast %s failed', broadcast.pk)
+    finally:
+        connection.close()
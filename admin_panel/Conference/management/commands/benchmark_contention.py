@@ -0,0 +1,181 @@
+import datetime
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import DatabaseError, connection, transaction
+
+from Conference.models import Conference, Performance, Question, Speaker
+
+
+BENCHMARK_SPEAKER_ID = 3_000_000_000
+
+
+def percentile(values, percent):
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+class Command(BaseCommand):
+    help = 'Замеряет скорость записи вопросов ботом, пока в админке ' \
+           'параллельно сохраняют выступления. Замер идёт на временной ' \
+           'базе с теми же настройками, что и рабочая.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--writers',
+            type=int,
+            default=4,
+            help='Потоков, сохраняющих вопросы, как пул ORM_WORKERS бота'
+        )
+        parser.add_argument(
+            '--admins',
+            type=int,
+            default=2,
+            help='Потоков, сохраняющих выступления, как админка'
+        )
+        parser.add_argument('--seconds', type=float, default=5)
+
+    def handle(self, *args, **options):
+        # Вопросы замера не должны попасть в подборки работающего бота,
+        # а сохранения выступлений - сбрасывать его кэш программы
+        directory = tempfile.mkdtemp(prefix='meetup_contention_')
+        if connection.vendor == 'sqlite':
+            connection.settings_dict['TEST']['NAME'] = os.path.join(
+                directory,
+                'db.sqlite3'
+            )
+        old_name = connection.creation.create_test_db(
+            verbosity=0,
+            autoclobber=True,
+            serialize=False
+        )
+        try:
+            self.measure(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            shutil.rmtree(directory, ignore_errors=True)
+
+    def measure(self, options):
+        self.stdout.write(self.describe_database())
+
+        conference = Conference.objects.create(
+            name='Конференция для замера блокировок',
+            date=datetime.date.today()
+        )
+        speaker = Speaker.objects.create(
+            telegram_id=BENCHMARK_SPEAKER_ID,
+            fullname='Спикер для замера блокировок',
+            speciality='Python'
+        )
+        performance = Performance.objects.create(
+            name='Выступление для замера блокировок',
+            description='Описание',
+            time=datetime.time(0, 0),
+            speaker=speaker,
+            conference=conference
+        )
+        for admins in (0, options['admins']):
+            self.run_round(
+                speaker,
+                performance,
+                options['writers'],
+                admins,
+                options['seconds']
+            )
+
+    @staticmethod
+    def describe_database():
+        if connection.vendor != 'sqlite':
+            return f'База: {connection.vendor}'
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA journal_mode')
+            journal_mode = cursor.fetchone()[0]
+            cursor.execute('PRAGMA busy_timeout')
+            busy_timeout = cursor.fetchone()[0]
+        return f'База: sqlite, journal_mode={journal_mode}, ' \
+               f'busy_timeout={busy_timeout} мс'
+
+    def run_round(self, speaker, performance, writers, admins, seconds):
+        deadline = time.monotonic() + seconds
+        latencies = []
+        errors = []
+        admin_saves = []
+        lock = threading.Lock()
+
+        def write_questions(writer):
+            number = 0
+            while time.monotonic() < deadline:
+                number += 1
+                started_at = time.perf_counter()
+                try:
+                    Question.objects.create(
+                        telegram_user_id=writer,
+                        speaker=speaker,
+                        question=f'Вопрос {writer}-{number}'
+                    )
+                except DatabaseError as error:
+                    with lock:
+                        errors.append(error)
+                    continue
+                with lock:
+                    latencies.append(time.perf_counter() - started_at)
+            connection.close()
+
+        def save_performance():
+            saves = 0
+            while time.monotonic() < deadline:
+                # Админка сохраняет объект и запись журнала в одной
+                # транзакции, а сигнал поднимает версию программы
+                try:
+                    with transaction.atomic():
+                        performance.description = f'Описание {saves}'
+                        performance.save()
+                        Performance.objects.filter(
+                            conference=performance.conference
+                        ).count()
+                except DatabaseError as error:
+                    with lock:
+                        errors.append(error)
+                    continue
+                saves += 1
+            with lock:
+                admin_saves.append(saves)
+            connection.close()
+
+        threads = [
+            threading.Thread(target=write_questions, args=(writer,))
+            for writer in range(writers)
+        ] + [
+            threading.Thread(target=save_performance)
+            for _ in range(admins)
+        ]
+        started_at = time.perf_counter()
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        elapsed = time.perf_counter() - started_at
+
+        self.stdout.write(
+            f'\nПотоков бота: {writers}, потоков админки: {admins}'
+        )
+        if latencies:
+            self.stdout.write(
+                f'Вопросы: {len(latencies) / elapsed:.0f} в секунду, '
+                f'p50 {percentile(latencies, 50) * 1000:.2f} мс, '
+                f'p95 {percentile(latencies, 95) * 1000:.2f} мс, '
+                f'p99 {percentile(latencies, 99) * 1000:.2f} мс'
+            )
+        if admins:
+            self.stdout.write(
+                f'Сохранений в админке: {sum(admin_saves) / elapsed:.0f} '
+                f'в секунду'
+            )
+        self.stdout.write(f'Ошибок записи: {len(errors)}')
+        if errors:
+            self.stdout.write(f'    {errors[0]}')
@@ -0,0 +1,115 @@
+import datetime
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from Conference.models import Conference, Performance, Question, Speaker
+
+
+class Command(BaseCommand):
+    help = 'Замеряет время поисковых запросов бота на синтетических данных. ' \
+           'Все созданные записи откатываются после замера.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--questions', type=int, default=100_000)
+        parser.add_argument('--performances', type=int, default=10_000)
+        parser.add_argument('--conferences', type=int, default=10)
+        parser.add_argument('--speakers', type=int, default=1_000)
+        parser.add_argument('--repeat', type=int, default=1_000)
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            self.fill(options)
+            self.measure(options)
+            transaction.set_rollback(True)
+
+    def fill(self, options):
+        started_at = time.perf_counter()
+        conferences = Conference.objects.bulk_create(
+            Conference(name=f'Конференция {number}', date=datetime.date.today())
+            for number in range(options['conferences'])
+        )
+        speakers = Speaker.objects.bulk_create(
+            Speaker(
+                telegram_id=10_000_000 + number,
+                fullname=f'Спикер {number}',
+                speciality='Python'
+            )
+            for number in range(options['speakers'])
+        )
+        Performance.objects.bulk_create(
+            (
+                Performance(
+                    name=f'Выступление {number}',
+                    description='Описание',
+                    time=self.time_for(number // len(conferences)),
+                    speaker=speakers[number % len(speakers)],
+                    conference=conferences[number % len(conferences)]
+                )
+                for number in range(options['performances'])
+            ),
+            batch_size=1_000
+        )
+        Question.objects.bulk_create(
+            (
+                Question(
+                    telegram_user_id=number,
+                    speaker=speakers[number % len(speakers)],
+                    question=f'Вопрос номер {number}',
+                    question_hash=Question.hash_text(f'Вопрос номер {number}')
+                )
+                for number in range(options['questions'])
+            ),
+            batch_size=1_000
+        )
+        self.stdout.write(
+            f'Данные созданы за {time.perf_counter() - started_at:.2f} с'
+        )
+
+    @staticmethod
+    def time_for(number):
+        return (datetime.datetime.min + datetime.timedelta(seconds=number)).time()
+
+    def measure(self, options):
+        repeat = options['repeat']
+        last_performance = options['performances'] - 1
+        last_question = options['questions'] - 1
+        last_speaker = Speaker.objects.get(fullname=f'Спикер {options["speakers"] - 1}')
+        question_text = f'Вопрос номер {last_question}'
+        question_speaker = Speaker.objects.get(
+            fullname=f'Спикер {last_question % options["speakers"]}'
+        )
+
+        lookups = {
+            'Conference.name': lambda: Conference.objects.filter(
+                name=f'Конференция {options["conferences"] - 1}'
+            ),
+            'Performance.name': lambda: Performance.objects.filter(
+                name=f'Выступление {last_performance}'
+            ),
+            'Performance.conference + time': lambda: Performance.objects.filter(
+                conference__name=f'Конференция {last_performance % options["conferences"]}',
+                time=self.time_for(last_performance // options['conferences'])
+            ),
+            'Speaker.fullname': lambda: Speaker.objects.filter(
+                fullname=last_speaker.fullname
+            ),
+            'Speaker.telegram_id': lambda: Speaker.objects.filter(
+                telegram_id=last_speaker.telegram_id
+            ),
+            'Question.speaker + question': lambda: Question.objects.filter(
+                speaker=question_speaker,
+                question_hash=Question.hash_text(question_text),
+                question=question_text
+            ),
+        }
+
+        for name, lookup in lookups.items():
+            plan = lookup().explain()
+            started_at = time.perf_counter()
+            for _ in range(repeat):
+                list(lookup())
+            elapsed = (time.perf_counter() - started_at) / repeat
+            self.stdout.write(f'{name}: {elapsed * 1_000_000:.0f} мкс')
+            self.stdout.write(f'    {plan}')
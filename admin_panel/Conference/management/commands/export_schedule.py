@@ -0,0 +1,36 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+
+from Conference.schedule_io import FORMATS, export_schedule, guess_format
+
+
+class Command(BaseCommand):
+    help = 'Выгружает программу в CSV, JSON или JSON Lines файл ' \
+           'в формате, который принимает import_schedule.'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path',
+            nargs='?',
+            default='-',
+            help='Путь к файлу, по умолчанию программа выводится в консоль'
+        )
+        parser.add_argument('--format', choices=FORMATS)
+
+    def handle(self, *args, **options):
+        path = options['path']
+        file_format = options['format'] or guess_format(path)
+        if path == '-':
+            export_schedule(sys.stdout, file_format=file_format)
+            return
+
+        started_at = time.perf_counter()
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            rows = export_schedule(file, file_format=file_format)
+        elapsed = time.perf_counter() - started_at
+        self.stdout.write(
+            f'Выгружено строк: {rows} за {elapsed:.2f} с, '
+            f'{rows / elapsed if elapsed else 0:.0f} строк/с'
+        )
@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from Conference.schedule_io import (
+    BATCH_SIZE,
+    FORMATS,
+    ScheduleImportError,
+    guess_format,
+    import_schedule
+)
+
+
+class Command(BaseCommand):
+    help = 'Загружает программу из CSV, JSON или JSON Lines файла. ' \
+           'Существующие спикеры, программы и выступления обновляются.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу программы')
+        parser.add_argument(
+            '--format',
+            choices=FORMATS,
+            help='Формат файла, по умолчанию определяется по расширению'
+        )
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        file_format = options['format'] or guess_format(options['path'])
+        try:
+            with open(options['path'], encoding='utf-8', newline='') as file:
+                report = import_schedule(
+                    file,
+                    file_format=file_format,
+                    batch_size=options['batch_size']
+                )
+        except OSError as error:
+            raise CommandError(error)
+        except ScheduleImportError as error:
+            raise CommandError(f'Программа не загружена:\n{error}')
+        except ValueError as error:
+            # Битый JSON, файл не в UTF-8 или неизвестный формат
+            raise CommandError(f'Программа не загружена: {error}')
+
+        self.stdout.write(
+            f'Загружено строк: {report.rows} за {report.seconds:.2f} с, '
+            f'{report.rows_per_second:.0f} строк/с'
+        )
+        for line in report.summary():
+            self.stdout.write(line)
@@ -0,0 +1,64 @@
+import os
+
+from django.core.management.base import BaseCommand, CommandError
+from telegram import Bot
+
+from Conference.broadcast import run_broadcast
+from Conference.models import Broadcast
+from Conference.ratelimit import GLOBAL_MESSAGES_PER_SECOND
+
+
+class Command(BaseCommand):
+    help = 'Отправляет рассылку всем пользователям бота. ' \
+           'Прерванную рассылку можно продолжить, передав её --id ' \
+           'и --resume.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('text', nargs='?', help='Текст новой рассылки')
+        parser.add_argument('--id', type=int, help='ID созданной рассылки')
+        parser.add_argument(
+            '--resume',
+            action='store_true',
+            help='Продолжить прерванную рассылку, которая числится '
+                 'отправляемой'
+        )
+        parser.add_argument(
+            '--rate',
+            type=float,
+            default=GLOBAL_MESSAGES_PER_SECOND,
+            help='Сообщений в секунду'
+        )
+
+    def handle(self, *args, **options):
+        if options['id']:
+            try:
+                broadcast = Broadcast.objects.get(pk=options['id'])
+            except Broadcast.DoesNotExist:
+                raise CommandError(f'Рассылка {options["id"]} не найдена')
+        elif options['text']:
+            broadcast = Broadcast.objects.create(text=options['text'])
+        else:
+            raise CommandError('Укажите текст рассылки или --id')
+
+        if broadcast.status == Broadcast.FINISHED:
+            raise CommandError(f'Рассылка {broadcast.pk} уже отправлена')
+        # Рассылку могли одновременно запустить из админки: отправляет
+        # её тот, кто первым переведёт её из новых в отправляемые
+        claimed = Broadcast.objects.filter(
+            pk=broadcast.pk,
+            status=Broadcast.NEW
+        ).update(status=Broadcast.RUNNING)
+        if not claimed and not options['resume']:
+            raise CommandError(
+                f'Рассылка {broadcast.pk} уже отправляется. Если отправка '
+                f'прервалась, продолжите её с --resume'
+            )
+
+        bot = Bot(os.environ['TELEGRAM_BOT_TOKEN'])
+        broadcast = run_broadcast(broadcast, bot, rate=options['rate'])
+        self.stdout.write(
+            f'Рассылка {broadcast.pk}: отправлено {broadcast.sent_count}, '
+            f'не доставлено {broadcast.failed_count}, '
+            f'{broadcast.sending_seconds:.1f} с, '
+            f'{broadcast.messages_per_second:.1f} сообщ/с'
+        )
@@ -0,0 +1,26 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:19
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScheduleVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('version', models.PositiveIntegerField(default=0, verbose_name='Версия программы')),
+                ('updated_at', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Время последнего изменения')),
+            ],
+            options={
+                'verbose_name': 'версию программы',
+                'verbose_name_plural': 'Версии программы',
+            },
+        ),
+    ]
@@ -0,0 +1,128 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:22
+
+import hashlib
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+
+def fill_question_hashes(apps, schema_editor):
+    Question = apps.get_model('Conference', 'Question')
+    questions = list(Question.objects.only('id', 'question'))
+    for question in questions:
+        question.question_hash = hashlib.sha1(
+            question.question.encode('utf-8')
+        ).hexdigest()
+    Question.objects.bulk_update(questions, ['question_hash'], batch_size=500)
+
+
+def duplicate_groups(queryset, fields):
+    """Значения ``fields``, которые встречаются больше одного раза,
+    вместе с наименьшим pk строки, которая останется."""
+    return queryset.values(*fields).annotate(
+        rows=Count('pk'),
+        keep_pk=Min('pk')
+    ).filter(rows__gt=1).order_by()
+
+
+def merge_duplicates(apps, schema_editor):
+    # Уникальные ограничения ниже не создадутся, пока в таблицах есть
+    # повторы: остаётся самая ранняя запись, ссылки переводятся на неё
+    Conference = apps.get_model('Conference', 'Conference')
+    Performance = apps.get_model('Conference', 'Performance')
+    Question = apps.get_model('Conference', 'Question')
+    Speaker = apps.get_model('Conference', 'Speaker')
+
+    if schema_editor.connection.vendor == 'postgresql':
+        # Иначе отложенные проверки внешних ключей не дадут изменить
+        # таблицы в той же транзакции
+        schema_editor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+
+    for group in duplicate_groups(Speaker.objects, ['telegram_id']):
+        duplicates = Speaker.objects.filter(
+            telegram_id=group['telegram_id']
+        ).exclude(pk=group['keep_pk'])
+        Performance.objects.filter(speaker__in=duplicates).update(
+            speaker_id=group['keep_pk']
+        )
+        Question.objects.filter(speaker__in=duplicates).update(
+            speaker_id=group['keep_pk']
+        )
+        duplicates.delete()
+
+    for group in duplicate_groups(Conference.objects, ['name']):
+        duplicates = Conference.objects.filter(
+            name=group['name']
+        ).exclude(pk=group['keep_pk'])
+        Performance.objects.filter(conference__in=duplicates).update(
+            conference_id=group['keep_pk']
+        )
+        duplicates.delete()
+
+    # Выступления в одно время одной программы - это разные доклады,
+    # какой из них лишний, решают организаторы, а не миграция
+    performances = Performance.objects.filter(conference__isnull=False)
+    conflicts = []
+    for group in duplicate_groups(performances, ['conference', 'time']):
+        rows = Performance.objects.filter(
+            conference_id=group['conference'],
+            time=group['time']
+        ).select_related('conference').order_by('pk')
+        conflicts.append(
+            f'программа «{rows[0].conference.name}», {group["time"]}: '
+            + ', '.join(f'#{row.pk} «{row.name}»' for row in rows)
+        )
+    if conflicts:
+        raise ValueError(
+            'В одной программе несколько выступлений в одно время. '
+            'Измените время или удалите лишние выступления и повторите '
+            'migrate:\n' + '\n'.join(conflicts)
+        )
+
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('SET CONSTRAINTS ALL DEFERRED')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0002_scheduleversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='question_hash',
+            field=models.CharField(default='', editable=False, max_length=40, verbose_name='Хэш текста вопроса'),
+        ),
+        migrations.RunPython(fill_question_hashes, migrations.RunPython.noop),
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='conference',
+            name='name',
+            field=models.CharField(help_text='Название конференции', max_length=500, unique=True, verbose_name='Название конференции'),
+        ),
+        migrations.AlterField(
+            model_name='performance',
+            name='name',
+            field=models.CharField(db_index=True, max_length=100, verbose_name='Название выступления'),
+        ),
+        migrations.AlterField(
+            model_name='speaker',
+            name='fullname',
+            field=models.CharField(db_index=True, help_text='Введите имя и фамилию докладчика', max_length=100, verbose_name='Имя и фамилия выступающего'),
+        ),
+        migrations.AlterField(
+            model_name='speaker',
+            name='telegram_id',
+            field=models.IntegerField(unique=True, verbose_name='Телеграм-ID докладчика'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['speaker', 'question_hash'], name='question_speaker_hash_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='performance',
+            constraint=models.UniqueConstraint(fields=('conference', 'time'), name='unique_performance_time_in_conference'),
+        ),
+    ]
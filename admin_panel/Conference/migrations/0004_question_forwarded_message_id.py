@@ -0,0 +1,22 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:23
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0003_lookup_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='forwarded_message_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='ID пересланного спикеру сообщения'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['speaker', 'forwarded_message_id'], name='question_speaker_message_idx'),
+        ),
+    ]
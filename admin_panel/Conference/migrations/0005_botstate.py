@@ -0,0 +1,30 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0004_question_forwarded_message_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotState',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('namespace', models.CharField(max_length=100, verbose_name='Раздел')),
+                ('key', models.CharField(max_length=255, verbose_name='Ключ')),
+                ('value', models.TextField(verbose_name='Значение')),
+            ],
+            options={
+                'verbose_name': 'состояние бота',
+                'verbose_name_plural': 'Состояния бота',
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='botstate',
+            constraint=models.UniqueConstraint(fields=('namespace', 'key'), name='unique_bot_state_key'),
+        ),
+    ]
@@ -0,0 +1,47 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0005_botstate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='BotUser',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('telegram_id', models.BigIntegerField(unique=True, verbose_name='Телеграм-ID пользователя')),
+                ('first_name', models.CharField(blank=True, max_length=255, verbose_name='Имя')),
+                ('username', models.CharField(blank=True, max_length=255, verbose_name='Имя пользователя')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Впервые написал боту')),
+                ('is_blocked', models.BooleanField(default=False, verbose_name='Заблокировал бота')),
+            ],
+            options={
+                'verbose_name': 'пользователя бота',
+                'verbose_name_plural': 'Пользователи бота',
+            },
+        ),
+        migrations.CreateModel(
+            name='Broadcast',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text', models.TextField(verbose_name='Текст рассылки')),
+                ('status', models.CharField(choices=[('new', 'Новая'), ('running', 'Отправляется'), ('finished', 'Отправлена')], default='new', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Создана')),
+                ('started_at', models.DateTimeField(blank=True, null=True, verbose_name='Начало отправки')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Конец отправки')),
+                ('last_user_pk', models.BigIntegerField(default=0, editable=False, verbose_name='Последний обработанный пользователь')),
+                ('sent_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='Отправлено')),
+                ('failed_count', models.PositiveIntegerField(default=0, editable=False, verbose_name='Не доставлено')),
+                ('sending_seconds', models.FloatField(default=0, editable=False, verbose_name='Время отправки, с')),
+            ],
+            options={
+                'verbose_name': 'рассылку',
+                'verbose_name_plural': 'Рассылки',
+            },
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:28
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_existing_questions_delivered(apps, schema_editor):
+    # До появления очереди каждый вопрос пересылался спикеру сразу
+    Question = apps.get_model('Conference', 'Question')
+    Question.objects.update(status='delivered')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0006_botuser_broadcast'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='created_at',
+            field=models.DateTimeField(default=django.utils.timezone.now, verbose_name='Задан'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='delivered_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Доставлен'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает отправки'), ('delivered', 'Доставлен спикеру'), ('failed', 'Не доставлен')], default='pending', max_length=20, verbose_name='Статус доставки'),
+        ),
+        migrations.RunPython(
+            mark_existing_questions_delivered,
+            migrations.RunPython.noop
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['status'], name='question_status_idx'),
+        ),
+    ]
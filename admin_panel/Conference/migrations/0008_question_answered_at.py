@@ -0,0 +1,22 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0007_question_delivery_status'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answered_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Спикер ответил'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['speaker', 'answered_at'], name='question_speaker_answered_idx'),
+        ),
+    ]
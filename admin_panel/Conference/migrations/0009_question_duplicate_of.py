@@ -0,0 +1,24 @@
+# Generated by Django 4.0.6 on 2026-10-18 08:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0008_question_answered_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='duplicates', to='Conference.question', verbose_name='Похож на вопрос'),
+        ),
+        migrations.AlterField(
+            model_name='question',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидает отправки'), ('delivered', 'Доставлен спикеру'), ('failed', 'Не доставлен'), ('merged', 'Объединён с похожим')], default='pending', max_length=20, verbose_name='Статус доставки'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0009_question_duplicate_of'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='answer_delivered_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Ответ доставлен'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_error',
+            field=models.CharField(blank=True, max_length=255, verbose_name='Ошибка доставки ответа'),
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='answer_message_id',
+            field=models.BigIntegerField(blank=True, null=True, verbose_name='ID ответа в чате слушателя'),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.0.6 on 2026-10-18 09:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('Conference', '0010_question_answer_receipt'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='question',
+            name='telegram_user_id',
+            field=models.BigIntegerField(verbose_name='Телеграм-ID задающего вопрос'),
+        ),
+        migrations.AlterField(
+            model_name='speaker',
+            name='telegram_id',
+            field=models.BigIntegerField(unique=True, verbose_name='Телеграм-ID докладчика'),
+        ),
+    ]
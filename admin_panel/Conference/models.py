@@ -1,13 +1,19 @@
+import hashlib
+
 from django.db import models
+from django.db.models import F
+from django.utils import timezone
 
 
 # Create your models here.
 class Speaker(models.Model):
-    telegram_id = models.IntegerField(
+    telegram_id = models.BigIntegerField(
+        unique=True,
         verbose_name='Телеграм-ID докладчика'
     )
     fullname = models.CharField(
         max_length=100,
+        db_index=True,
         help_text='Введите имя и фамилию докладчика',
         verbose_name='Имя и фамилия выступающего'
     )
@@ -28,6 +34,7 @@ class Speaker(models.Model):
 class Conference(models.Model):
     name = models.CharField(
         max_length=500,
+        unique=True,
         help_text='Название конференции',
         verbose_name='Название конференции',
     )
@@ -47,6 +54,7 @@ class Conference(models.Model):
 class Performance(models.Model):
     name = models.CharField(
         max_length=100,
+        db_index=True,
         verbose_name='Название выступления'
     )
     description = models.TextField(
@@ -78,10 +86,27 @@ class Performance(models.Model):
     class Meta:
         verbose_name = 'выступление'
         verbose_name_plural = 'Выступления'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['conference', 'time'],
+                name='unique_performance_time_in_conference'
+            ),
+        ]
 
 
 class Question(models.Model):
-    telegram_user_id = models.IntegerField(
+    PENDING = 'pending'
+    DELIVERED = 'delivered'
+    FAILED = 'failed'
+    MERGED = 'merged'
+    STATUS_CHOICES = [
+        (PENDING, 'Ожидает отправки'),
+        (DELIVERED, 'Доставлен спикеру'),
+        (FAILED, 'Не доставлен'),
+        (MERGED, 'Объединён с похожим'),
+    ]
+
+    telegram_user_id = models.BigIntegerField(
         verbose_name='Телеграм-ID задающего вопрос'
     )
     speaker = models.ForeignKey(
@@ -92,7 +117,258 @@ class Question(models.Model):
     question = models.TextField(
         verbose_name='Вопрос'
     )
+    question_hash = models.CharField(
+        max_length=40,
+        default='',
+        editable=False,
+        verbose_name='Хэш текста вопроса'
+    )
+    forwarded_message_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='ID пересланного спикеру сообщения'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=PENDING,
+        verbose_name='Статус доставки'
+    )
+    created_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Задан'
+    )
+    delivered_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Доставлен'
+    )
+    answered_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Спикер ответил'
+    )
+    # Похожие вопросы спикеру не пересылаются: он видит один вопрос
+    # с числом спросивших, а ответ получают все
+    duplicate_of = models.ForeignKey(
+        to='self',
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='duplicates',
+        verbose_name='Похож на вопрос'
+    )
+    # Квитанция о доставке ответа спикера автору вопроса
+    answer_message_id = models.BigIntegerField(
+        null=True,
+        blank=True,
+        verbose_name='ID ответа в чате слушателя'
+    )
+    answer_delivered_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Ответ доставлен'
+    )
+    answer_error = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name='Ошибка доставки ответа'
+    )
+
+    @staticmethod
+    def hash_text(text: str) -> str:
+        return hashlib.sha1(text.encode('utf-8')).hexdigest()
+
+    @classmethod
+    def bulk_create_questions(cls, questions: list) -> list:
+        # bulk_create не вызывает save(), поэтому хэш считаем здесь
+        for question in questions:
+            question.question_hash = cls.hash_text(question.question)
+        return cls.objects.bulk_create(questions, batch_size=500)
+
+    def save(self, *args, **kwargs):
+        self.question_hash = self.hash_text(self.question)
+        super().save(*args, **kwargs)
 
     class Meta:
         verbose_name = 'вопрос'
         verbose_name_plural = 'Вопросы'
+        indexes = [
+            models.Index(
+                fields=['speaker', 'question_hash'],
+                name='question_speaker_hash_idx'
+            ),
+            models.Index(
+                fields=['speaker', 'forwarded_message_id'],
+                name='question_speaker_message_idx'
+            ),
+            models.Index(
+                fields=['status'],
+                name='question_status_idx'
+            ),
+            models.Index(
+                fields=['speaker', 'answered_at'],
+                name='question_speaker_answered_idx'
+            ),
+        ]
+
+
+class ScheduleVersion(models.Model):
+    version = models.PositiveIntegerField(
+        default=0,
+        verbose_name='Версия программы'
+    )
+    updated_at = models.DateTimeField(
+        default=timezone.now,
+        verbose_name='Время последнего изменения'
+    )
+
+    def __str__(self):
+        return f'{self.version}'
+
+    @classmethod
+    def get_version(cls) -> int:
+        version = cls.objects.filter(pk=1).values_list(
+            'version', flat=True
+        ).first()
+        return version or 0
+
+    @classmethod
+    def bump(cls) -> None:
+        updated = cls.objects.filter(pk=1).update(
+            version=F('version') + 1,
+            updated_at=timezone.now()
+        )
+        if not updated:
+            cls.objects.get_or_create(pk=1, defaults={'version': 1})
+
+    class Meta:
+        verbose_name = 'версию программы'
+        verbose_name_plural = 'Версии программы'
+
+
+class BotState(models.Model):
+    namespace = models.CharField(
+        max_length=100,
+        verbose_name='Раздел'
+    )
+    key = models.CharField(
+        max_length=255,
+        verbose_name='Ключ'
+    )
+    value = models.TextField(
+        verbose_name='Значение'
+    )
+
+    def __str__(self):
+        return f'{self.namespace}:{self.key}'
+
+    class Meta:
+        verbose_name = 'состояние бота'
+        verbose_name_plural = 'Состояния бота'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['namespace', 'key'],
+                name='unique_bot_state_key'
+            ),
+        ]
+
+
+class BotUser(models.Model):
+    telegram_id = models.BigIntegerField(
+        unique=True,
+        verbose_name='Телеграм-ID пользователя'
+    )
+    first_name = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name='Имя'
+    )
+    username = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name='Имя пользователя'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Впервые написал боту'
+    )
+    is_blocked = models.BooleanField(
+        default=False,
+        verbose_name='Заблокировал бота'
+    )
+
+    def __str__(self):
+        return f'{self.first_name} ({self.telegram_id})'
+
+    class Meta:
+        verbose_name = 'пользователя бота'
+        verbose_name_plural = 'Пользователи бота'
+
+
+class Broadcast(models.Model):
+    NEW = 'new'
+    RUNNING = 'running'
+    FINISHED = 'finished'
+    STATUS_CHOICES = [
+        (NEW, 'Новая'),
+        (RUNNING, 'Отправляется'),
+        (FINISHED, 'Отправлена'),
+    ]
+
+    text = models.TextField(
+        verbose_name='Текст рассылки'
+    )
+    status = models.CharField(
+        max_length=20,
+        choices=STATUS_CHOICES,
+        default=NEW,
+        verbose_name='Статус'
+    )
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Создана'
+    )
+    started_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Начало отправки'
+    )
+    finished_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        verbose_name='Конец отправки'
+    )
+    last_user_pk = models.BigIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Последний обработанный пользователь'
+    )
+    sent_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Отправлено'
+    )
+    failed_count = models.PositiveIntegerField(
+        default=0,
+        editable=False,
+        verbose_name='Не доставлено'
+    )
+    sending_seconds = models.FloatField(
+        default=0,
+        editable=False,
+        verbose_name='Время отправки, с'
+    )
+
+    def __str__(self):
+        return f'{self.text[:50]}'
+
+    @property
+    def messages_per_second(self) -> float:
+        if not self.sending_seconds:
+            return 0.0
+        return (self.sent_count + self.failed_count) / self.sending_seconds
+
+    class Meta:
+        verbose_name = 'рассылку'
+        verbose_name_plural = 'Рассылки'
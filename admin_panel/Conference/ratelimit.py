@@ -0,0 +1,54 @@
+import threading
+import time
+
+
+# Ограничения Bot API: около 30 сообщений в секунду на бота
+# и не больше одного сообщения в секунду в один чат
+GLOBAL_MESSAGES_PER_SECOND = 30
+CHAT_MESSAGES_PER_SECOND = 1
+
+
+class TokenBucket:
+    def __init__(self, rate: float, capacity: float = None,
+                 clock=time.monotonic, sleep=time.sleep):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self.clock = clock
+        self.sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """Забирает токены и возвращает 0 либо сколько секунд их ждать."""
+        with self._lock:
+            now = self.clock()
+            self._tokens = min(
+                self.capacity,
+                self._tokens + (now - self._updated_at) * self.rate
+            )
+            self._updated_at = now
+            if self._tokens >= tokens:
+                self._tokens -= tokens
+                return 0.0
+            return (tokens - self._tokens) / self.rate
+
+    def release(self, tokens: float = 1) -> None:
+        """Возвращает токены, которые забрали, но не использовали."""
+        with self._lock:
+            self._tokens = min(self.capacity, self._tokens + tokens)
+
+    def is_full(self) -> bool:
+        """Полное ведро ничем не отличается от нового, его можно забыть."""
+        with self._lock:
+            refilled = self._tokens + \
+                (self.clock() - self._updated_at) * self.rate
+            return refilled >= self.capacity
+
+    def acquire(self, tokens: float = 1) -> None:
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return
+            self.sleep(wait)
+
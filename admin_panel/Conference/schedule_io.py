@@ -0,0 +1,339 @@
+import csv
+import datetime
+import json
+import time
+
+from dataclasses import dataclass, field
+from typing import IO, Iterable, Iterator
+
+from django.db import transaction
+
+from .models import Conference, Performance, ScheduleVersion, Speaker
+
+
+BATCH_SIZE = 2_000
+MAX_REPORTED_ERRORS = 20
+# UPDATE с CASE по каждой строке быстро растёт, поэтому пачки меньше
+UPDATE_BATCH_SIZE = 500
+
+# Одна строка файла - одно выступление вместе с программой и спикером
+FIELDS = (
+    'conference',
+    'date',
+    'time',
+    'performance',
+    'description',
+    'speaker_telegram_id',
+    'speaker_fullname',
+    'speaker_speciality',
+)
+FORMATS = ('csv', 'json', 'jsonl')
+
+
+class ScheduleImportError(Exception):
+    def __init__(self, errors: list):
+        self.errors = errors
+        super().__init__('\n'.join(errors))
+
+
+@dataclass(frozen=True)
+class ScheduleRow:
+    conference: str
+    date: datetime.date
+    time: datetime.time
+    performance: str
+    description: str
+    speaker_telegram_id: int
+    speaker_fullname: str
+    speaker_speciality: str
+
+
+@dataclass
+class ImportReport:
+    rows: int = 0
+    created: dict = field(default_factory=dict)
+    updated: dict = field(default_factory=dict)
+    seconds: float = 0.0
+
+    @property
+    def rows_per_second(self) -> float:
+        return self.rows / self.seconds if self.seconds else 0.0
+
+    def summary(self) -> list:
+        return [
+            f'{name}: создано {created}, обновлено {self.updated.get(name, 0)}'
+            for name, created in self.created.items()
+        ]
+
+    def count(self, counter: dict, model, number: int) -> None:
+        name = model._meta.verbose_name_plural
+        counter[name] = counter.get(name, 0) + number
+
+
+def guess_format(path: str) -> str:
+    extension = path.rsplit('.', 1)[-1].lower()
+    return extension if extension in FORMATS else 'csv'
+
+
+def read_rows(file: IO, file_format: str) -> Iterator[dict]:
+    if file_format == 'csv':
+        yield from csv.DictReader(file)
+    elif file_format == 'jsonl':
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+    elif file_format == 'json':
+        yield from json.load(file)
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
+
+
+def _text(row: dict, name: str, model, model_field: str,
+          required: bool = True) -> str:
+    value = str(row.get(name) or '').strip()
+    if required and not value:
+        raise ValueError(f'не заполнено поле {name}')
+    max_length = model._meta.get_field(model_field).max_length
+    if max_length and len(value) > max_length:
+        raise ValueError(f'{name} длиннее {max_length} символов')
+    return value
+
+
+def parse_row(row: dict) -> ScheduleRow:
+    try:
+        date = datetime.date.fromisoformat(str(row.get('date', '')).strip())
+    except ValueError:
+        raise ValueError('дата должна быть в формате ГГГГ-ММ-ДД')
+    try:
+        performance_time = datetime.time.fromisoformat(
+            str(row.get('time', '')).strip()
+        )
+    except ValueError:
+        raise ValueError('время должно быть в формате ЧЧ:ММ')
+    try:
+        telegram_id = int(row.get('speaker_telegram_id'))
+    except (TypeError, ValueError):
+        raise ValueError('speaker_telegram_id должен быть числом')
+
+    return ScheduleRow(
+        conference=_text(row, 'conference', Conference, 'name'),
+        date=date,
+        time=performance_time,
+        performance=_text(row, 'performance', Performance, 'name'),
+        description=_text(row, 'description', Performance, 'description',
+                          required=False),
+        speaker_telegram_id=telegram_id,
+        speaker_fullname=_text(row, 'speaker_fullname', Speaker, 'fullname'),
+        speaker_speciality=_text(row, 'speaker_speciality', Speaker,
+                                 'speciality', required=False),
+    )
+
+
+def validate(rows: Iterable[dict], first_line: int = 1) -> list:
+    parsed = []
+    errors = []
+    for line, row in enumerate(rows, start=first_line):
+        try:
+            parsed.append(parse_row(row))
+        except (ValueError, AttributeError) as error:
+            errors.append(f'Строка {line}: {error}')
+            if len(errors) >= MAX_REPORTED_ERRORS:
+                break
+    if errors:
+        raise ScheduleImportError(errors)
+    return parsed
+
+
+def _upsert_speakers(rows: list, speakers: dict, report: ImportReport) -> None:
+    latest = {row.speaker_telegram_id: row for row in rows}
+    missing = [telegram_id for telegram_id in latest
+               if telegram_id not in speakers]
+    speakers.update(
+        (speaker.telegram_id, speaker)
+        for speaker in Speaker.objects.filter(telegram_id__in=missing)
+    )
+
+    new, changed = [], []
+    for telegram_id, row in latest.items():
+        speaker = speakers.get(telegram_id)
+        if speaker is None:
+            speaker = Speaker(
+                telegram_id=telegram_id,
+                fullname=row.speaker_fullname,
+                speciality=row.speaker_speciality
+            )
+            speakers[telegram_id] = speaker
+            new.append(speaker)
+        elif (speaker.fullname, speaker.speciality) != \
+                (row.speaker_fullname, row.speaker_speciality):
+            speaker.fullname = row.speaker_fullname
+            speaker.speciality = row.speaker_speciality
+            changed.append(speaker)
+
+    Speaker.objects.bulk_create(new)
+    Speaker.objects.bulk_update(
+        changed,
+        ['fullname', 'speciality'],
+        batch_size=UPDATE_BATCH_SIZE
+    )
+    report.count(report.created, Speaker, len(new))
+    report.count(report.updated, Speaker, len(changed))
+
+
+def _upsert_conferences(rows: list, conferences: dict,
+                        report: ImportReport) -> None:
+    latest = {row.conference: row for row in rows}
+    missing = [name for name in latest if name not in conferences]
+    conferences.update(
+        (conference.name, conference)
+        for conference in Conference.objects.filter(name__in=missing)
+    )
+
+    new, changed = [], []
+    for name, row in latest.items():
+        conference = conferences.get(name)
+        if conference is None:
+            conference = Conference(name=name, date=row.date)
+            conferences[name] = conference
+            new.append(conference)
+        elif conference.date != row.date:
+            conference.date = row.date
+            changed.append(conference)
+
+    Conference.objects.bulk_create(new)
+    Conference.objects.bulk_update(
+        changed,
+        ['date'],
+        batch_size=UPDATE_BATCH_SIZE
+    )
+    report.count(report.created, Conference, len(new))
+    report.count(report.updated, Conference, len(changed))
+
+
+def _upsert_performances(rows: list, speakers: dict, conferences: dict,
+                         report: ImportReport) -> None:
+    latest = {
+        (conferences[row.conference].pk, row.time): row for row in rows
+    }
+    existing = {
+        (performance.conference_id, performance.time): performance
+        for performance in Performance.objects.filter(
+            conference_id__in={conference_id for conference_id, _ in latest},
+            time__in={performance_time for _, performance_time in latest}
+        )
+    }
+
+    new, changed = [], []
+    for (conference_id, performance_time), row in latest.items():
+        speaker_id = speakers[row.speaker_telegram_id].pk
+        performance = existing.get((conference_id, performance_time))
+        if performance is None:
+            new.append(Performance(
+                name=row.performance,
+                description=row.description,
+                time=performance_time,
+                speaker_id=speaker_id,
+                conference_id=conference_id
+            ))
+        elif (performance.name, performance.description,
+              performance.speaker_id) != \
+                (row.performance, row.description, speaker_id):
+            performance.name = row.performance
+            performance.description = row.description
+            performance.speaker_id = speaker_id
+            changed.append(performance)
+
+    Performance.objects.bulk_create(new)
+    Performance.objects.bulk_update(
+        changed,
+        ['name', 'description', 'speaker'],
+        batch_size=UPDATE_BATCH_SIZE
+    )
+    report.count(report.created, Performance, len(new))
+    report.count(report.updated, Performance, len(changed))
+
+
+def import_schedule(file: IO, file_format: str = 'csv',
+                    batch_size: int = BATCH_SIZE) -> ImportReport:
+    """Загружает программу из файла, обновляя уже существующие записи.
+
+    Спикеры сопоставляются по телеграм-ID, программы - по названию,
+    выступления - по программе и времени. Файл сначала целиком
+    проверяется, и при ошибках ничего не записывается. Записи создаются
+    и обновляются пачками по ``batch_size`` строк, каждая пачка в своей
+    транзакции.
+    """
+    started_at = time.perf_counter()
+    # Первая строка CSV - заголовок, поэтому данные начинаются со второй
+    rows = validate(
+        read_rows(file, file_format),
+        first_line=2 if file_format == 'csv' else 1
+    )
+
+    report = ImportReport(rows=len(rows))
+    speakers = {}
+    conferences = {}
+    try:
+        for start in range(0, len(rows), batch_size):
+            batch = rows[start:start + batch_size]
+            with transaction.atomic():
+                _upsert_speakers(batch, speakers, report)
+                _upsert_conferences(batch, conferences, report)
+                _upsert_performances(batch, speakers, conferences, report)
+    finally:
+        # bulk_create и bulk_update не шлют сигналы, поэтому версию
+        # программы для бота поднимаем сами, даже если упала одна из
+        # пачек: предыдущие уже записаны
+        ScheduleVersion.bump()
+    report.seconds = time.perf_counter() - started_at
+    return report
+
+
+def export_rows(conferences=None) -> Iterator[dict]:
+    performances = Performance.objects.filter(
+        conference__isnull=False,
+        speaker__isnull=False
+    ).select_related('speaker', 'conference').order_by(
+        'conference__name',
+        'time'
+    )
+    if conferences is not None:
+        performances = performances.filter(conference__in=conferences)
+
+    for performance in performances.iterator(chunk_size=BATCH_SIZE):
+        yield {
+            'conference': performance.conference.name,
+            'date': performance.conference.date.isoformat(),
+            'time': performance.time.isoformat(),
+            'performance': performance.name,
+            'description': performance.description,
+            'speaker_telegram_id': performance.speaker.telegram_id,
+            'speaker_fullname': performance.speaker.fullname,
+            'speaker_speciality': performance.speaker.speciality,
+        }
+
+
+def export_schedule(file: IO, file_format: str = 'csv',
+                    conferences=None) -> int:
+    rows = 0
+    if file_format == 'csv':
+        writer = csv.DictWriter(file, fieldnames=FIELDS)
+        writer.writeheader()
+        for row in export_rows(conferences):
+            writer.writerow(row)
+            rows += 1
+    elif file_format == 'jsonl':
+        for row in export_rows(conferences):
+            file.write(json.dumps(row, ensure_ascii=False) + '\n')
+            rows += 1
+    elif file_format == 'json':
+        file.write('[')
+        for row in export_rows(conferences):
+            if rows:
+                file.write(',')
+            file.write('\n' + json.dumps(row, ensure_ascii=False))
+            rows += 1
+        file.write('\n]\n')
+    else:
+        raise ValueError(f'Unknown format: {file_format}')
+    return rows
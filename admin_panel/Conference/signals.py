@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import Conference, Performance, ScheduleVersion, Speaker
+
+
+# Бот держит программу в памяти и перечитывает её, только когда
+# меняется версия, поэтому любое изменение программы поднимает версию
+@receiver(post_save, sender=Conference)
+@receiver(post_delete, sender=Conference)
+@receiver(post_save, sender=Performance)
+@receiver(post_delete, sender=Performance)
+@receiver(post_save, sender=Speaker)
+@receiver(post_delete, sender=Speaker)
+def bump_schedule_version(sender, **kwargs):
+    ScheduleVersion.bump()
+
+
+@receiver(connection_created)
+def configure_sqlite(sender, connection, **kwargs):
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
@@ -1,3 +1,690 @@
-from django.test import TestCase
+import datetime
+import importlib.util
+import io
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
 
-# Create your tests here.
+from unittest import mock
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from telegram.error import RetryAfter, Unauthorized
+
+from .broadcast import run_broadcast
+from .models import (
+    BotUser,
+    Broadcast,
+    Conference,
+    Performance,
+    Question,
+    ScheduleVersion,
+    Speaker
+)
+from .ratelimit import TokenBucket
+from . import schedule_io
+from .schedule_io import ScheduleImportError, export_schedule, import_schedule
+
+
+BOT_DIR = settings.BASE_DIR.parent / 'bot'
+
+
+def load_bot_module(name: str):
+    # Модули бота без зависимостей от Django проверяются здесь же,
+    # но лежат в bot/, который не является пакетом
+    spec = importlib.util.spec_from_file_location(name, BOT_DIR / f'{name}.py')
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+cluster_questions = load_bot_module('question_clusters').cluster_questions
+UserRateLimiter = load_bot_module('user_rate_limiter').UserRateLimiter
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeBot:
+    def __init__(self, errors=None):
+        self.sent = []
+        self.errors = errors or {}
+
+    def send_message(self, chat_id, text):
+        errors = self.errors.get(chat_id)
+        if errors:
+            raise errors.pop(0)
+        self.sent.append((chat_id, text))
+
+
+class TokenBucketTests(TestCase):
+    def test_waits_when_bucket_is_empty(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=30, clock=clock, sleep=clock.sleep)
+
+        for _ in range(31):
+            bucket.acquire()
+
+        self.assertAlmostEqual(sum(clock.sleeps), 1 / 30)
+
+    def test_refills_to_capacity(self):
+        clock = FakeClock()
+        bucket = TokenBucket(rate=1, capacity=3, clock=clock)
+
+        bucket.try_acquire(2)
+        self.assertFalse(bucket.is_full())
+        clock.now += 2
+        self.assertTrue(bucket.is_full())
+
+
+class UserRateLimiterTests(SimpleTestCase):
+    def test_drops_updates_over_burst_until_refilled(self):
+        clock = FakeClock()
+        limiter = UserRateLimiter(rate=2, capacity=3, max_users=10,
+                                  clock=clock)
+
+        self.assertEqual([limiter.allow(1) for _ in range(4)],
+                         [True, True, True, False])
+        self.assertTrue(limiter.allow(2))
+        clock.now += 0.5
+        self.assertTrue(limiter.allow(1))
+        self.assertFalse(limiter.allow(1))
+
+    def test_evicts_least_recently_seen_user(self):
+        clock = FakeClock()
+        limiter = UserRateLimiter(rate=1, capacity=1, max_users=2,
+                                  clock=clock)
+
+        limiter.allow(1)
+        limiter.allow(2)
+        self.assertFalse(limiter.allow(1))
+        limiter.allow(3)
+
+        self.assertEqual(len(limiter), 2)
+        self.assertEqual(limiter.evicted, 1)
+        # Вытеснен пользователь 2, а пользователь 1 по-прежнему ограничен
+        self.assertFalse(limiter.allow(1))
+
+    def test_warns_each_user_once_per_series(self):
+        clock = FakeClock()
+        limiter = UserRateLimiter(rate=1, capacity=1, max_users=10,
+                                  clock=clock)
+
+        limiter.allow(1)
+        limiter.allow(2)
+        self.assertFalse(limiter.allow(1))
+        self.assertFalse(limiter.allow(2))
+        self.assertTrue(limiter.should_warn(1))
+        self.assertFalse(limiter.should_warn(1))
+        # Предупреждение одному не сбрасывает флаг другого
+        self.assertTrue(limiter.should_warn(2))
+
+        clock.now += 1
+        self.assertTrue(limiter.allow(1))
+        self.assertFalse(limiter.allow(1))
+        self.assertTrue(limiter.should_warn(1))
+
+
+class BroadcastTests(TestCase):
+    def setUp(self):
+        self.clock = FakeClock()
+        self.users = [
+            BotUser.objects.create(telegram_id=telegram_id)
+            for telegram_id in (101, 102, 103)
+        ]
+        self.broadcast = Broadcast.objects.create(text='Доклад перенесён')
+
+    def run_broadcast(self, bot, **kwargs):
+        return run_broadcast(
+            self.broadcast,
+            bot,
+            clock=self.clock,
+            sleep=self.clock.sleep,
+            **kwargs
+        )
+
+    def test_sends_to_every_user(self):
+        bot = FakeBot()
+
+        broadcast = self.run_broadcast(bot, batch_size=2)
+
+        self.assertEqual(
+            bot.sent,
+            [(101, 'Доклад перенесён'), (102, 'Доклад перенесён'),
+             (103, 'Доклад перенесён')]
+        )
+        broadcast.refresh_from_db()
+        self.assertEqual(broadcast.status, Broadcast.FINISHED)
+        self.assertEqual(broadcast.sent_count, 3)
+        self.assertEqual(broadcast.last_user_pk, self.users[-1].pk)
+
+    def test_retries_after_flood_limit(self):
+        bot = FakeBot(errors={102: [RetryAfter(5)]})
+
+        broadcast = self.run_broadcast(bot)
+
+        self.assertIn(5, self.clock.sleeps)
+        self.assertEqual(broadcast.sent_count, 3)
+        self.assertEqual(broadcast.failed_count, 0)
+
+    def test_marks_users_who_blocked_the_bot(self):
+        bot = FakeBot(errors={102: [Unauthorized('Forbidden')]})
+
+        broadcast = self.run_broadcast(bot)
+
+        self.assertEqual(broadcast.sent_count, 2)
+        self.assertEqual(broadcast.failed_count, 1)
+        self.assertTrue(BotUser.objects.get(telegram_id=102).is_blocked)
+
+    def test_resumes_after_last_processed_user(self):
+        self.broadcast.last_user_pk = self.users[0].pk
+        self.broadcast.sent_count = 1
+        self.broadcast.save()
+        bot = FakeBot()
+
+        broadcast = self.run_broadcast(bot)
+
+        self.assertEqual([chat_id for chat_id, _ in bot.sent], [102, 103])
+        self.assertEqual(broadcast.sent_count, 3)
+
+    def send_from_console(self, bot, **options):
+        with mock.patch.dict(os.environ, {'TELEGRAM_BOT_TOKEN': 'token'}), \
+                mock.patch(
+                    'Conference.management.commands.send_broadcast.Bot',
+                    return_value=bot
+                ):
+            call_command('send_broadcast', id=self.broadcast.pk,
+                         rate=1000, stdout=io.StringIO(), **options)
+
+    def test_console_does_not_send_running_broadcast_twice(self):
+        Broadcast.objects.filter(pk=self.broadcast.pk).update(
+            status=Broadcast.RUNNING
+        )
+        bot = FakeBot()
+
+        with self.assertRaises(CommandError):
+            self.send_from_console(bot)
+        self.assertEqual(bot.sent, [])
+
+        self.send_from_console(bot, resume=True)
+        self.assertEqual(len(bot.sent), 3)
+
+
+SCHEDULE_CSV = """conference,date,time,performance,description,speaker_telegram_id,speaker_fullname,speaker_speciality
+Python,2022-07-20,10:00,Асинхронность,Про asyncio,101,Иван Петров,Backend
+Python,2022-07-20,11:00,Типизация,Про mypy,102,Анна Смирнова,Backend
+Django,2022-07-21,10:00,ORM,Про запросы,101,Иван Петров,Backend
+"""
+
+
+class ScheduleImportTests(TestCase):
+    def import_csv(self, text, **kwargs):
+        return import_schedule(io.StringIO(text), file_format='csv', **kwargs)
+
+    def test_creates_schedule(self):
+        version = ScheduleVersion.get_version()
+
+        report = self.import_csv(SCHEDULE_CSV, batch_size=2)
+
+        self.assertEqual(report.rows, 3)
+        self.assertEqual(Speaker.objects.count(), 2)
+        self.assertEqual(Conference.objects.count(), 2)
+        performance = Performance.objects.get(
+            conference__name='Django',
+            time='10:00'
+        )
+        self.assertEqual(performance.speaker.telegram_id, 101)
+        self.assertGreater(ScheduleVersion.get_version(), version)
+
+    def test_updates_existing_rows(self):
+        self.import_csv(SCHEDULE_CSV)
+
+        report = self.import_csv(
+            SCHEDULE_CSV.replace('Про mypy', 'Про pyright')
+        )
+
+        self.assertEqual(Performance.objects.count(), 3)
+        self.assertEqual(
+            report.updated[Performance._meta.verbose_name_plural],
+            1
+        )
+        self.assertTrue(
+            Performance.objects.filter(description='Про pyright').exists()
+        )
+
+    def test_rejects_invalid_file_without_writing(self):
+        with self.assertRaises(ScheduleImportError) as error:
+            self.import_csv(SCHEDULE_CSV.replace('11:00', '25:00'))
+
+        self.assertIn('Строка 3', str(error.exception))
+        self.assertFalse(Performance.objects.exists())
+
+    def test_command_reports_malformed_file(self):
+        for name, content in (('program.json', b'{bad'),
+                              ('program.csv', b'\xff\xfe\x00')):
+            with tempfile.TemporaryDirectory() as directory:
+                path = os.path.join(directory, name)
+                with open(path, 'wb') as file:
+                    file.write(content)
+
+                with self.assertRaises(CommandError):
+                    call_command('import_schedule', path,
+                                 stdout=io.StringIO())
+
+    def test_failed_batch_still_bumps_version(self):
+        upsert_performances = schedule_io._upsert_performances
+        calls = []
+
+        def fail_second_batch(*args):
+            calls.append(args)
+            if len(calls) == 2:
+                raise RuntimeError('database went away')
+            upsert_performances(*args)
+
+        version = ScheduleVersion.get_version()
+        with mock.patch.object(schedule_io, '_upsert_performances',
+                               fail_second_batch):
+            with self.assertRaises(RuntimeError):
+                self.import_csv(SCHEDULE_CSV, batch_size=2)
+
+        self.assertEqual(Performance.objects.count(), 2)
+        self.assertGreater(ScheduleVersion.get_version(), version)
+
+    def test_export_can_be_imported_back(self):
+        self.import_csv(SCHEDULE_CSV)
+        exported = io.StringIO()
+
+        rows = export_schedule(exported, file_format='jsonl')
+        exported.seek(0)
+        report = import_schedule(exported, file_format='jsonl')
+
+        self.assertEqual(rows, 3)
+        self.assertEqual(sum(report.created.values()), 0)
+        self.assertEqual(sum(report.updated.values()), 0)
+
+
+class QuestionClusterTests(SimpleTestCase):
+    def make_questions(self, *texts):
+        return [
+            Question(pk=number, telegram_user_id=number, question=text)
+            for number, text in enumerate(texts, start=1)
+        ]
+
+    def test_groups_near_duplicates(self):
+        questions = self.make_questions(
+            'Как вы деплоите Django?',
+            'Будут ли слайды доклада?',
+            'как вы деплоите django',
+            'Как вы деплоите Django??? ',
+        )
+
+        clusters = cluster_questions(questions)
+
+        self.assertEqual(len(clusters), 2)
+        self.assertEqual(clusters[0].primary, questions[0])
+        self.assertEqual(clusters[0].duplicates, [questions[2], questions[3]])
+        self.assertEqual(clusters[0].askers, 3)
+        self.assertEqual(clusters[1].duplicates, [])
+
+    def test_keeps_questions_with_different_keyword_apart(self):
+        questions = self.make_questions(
+            'Что вы думаете про asyncio?',
+            'Что вы думаете про Rust?',
+            'Какую версию Python вы используете в продакшене?',
+            'Какую версию Django вы используете в продакшене?',
+        )
+
+        clusters = cluster_questions(questions)
+
+        self.assertEqual([cluster.primary for cluster in clusters], questions)
+        self.assertTrue(all(not cluster.duplicates for cluster in clusters))
+
+    def test_attaches_to_open_question(self):
+        delivered, first, second = self.make_questions(
+            'Будут ли слайды доклада?',
+            'будут ли слайды доклада',
+            'Что такое GIL?',
+        )
+
+        clusters = cluster_questions([first, second], [delivered])
+
+        self.assertEqual(
+            [(cluster.primary, cluster.duplicates) for cluster in clusters],
+            [(delivered, [first]), (second, [])]
+        )
+
+
+class AdminChangelistQueryTests(TestCase):
+    def setUp(self):
+        self.client.force_login(
+            User.objects.create_superuser('admin', 'admin@example.com', 'pw')
+        )
+
+    def add_rows(self, start, count):
+        for number in range(start, start + count):
+            speaker = Speaker.objects.create(
+                telegram_id=number,
+                fullname=f'Спикер {number}',
+                speciality='Python'
+            )
+            conference = Conference.objects.create(
+                name=f'Программа {number}',
+                date=datetime.date(2022, 7, 20)
+            )
+            Performance.objects.create(
+                name=f'Выступление {number}',
+                description='Описание',
+                time=datetime.time(10, 0),
+                speaker=speaker,
+                conference=conference
+            )
+            Question.objects.create(
+                telegram_user_id=number,
+                speaker=speaker,
+                question=f'Вопрос {number}'
+            )
+
+    def count_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def assert_constant_queries(self, url):
+        self.add_rows(0, 2)
+        few_rows = self.count_queries(url)
+
+        self.add_rows(2, 20)
+        many_rows = self.count_queries(url)
+
+        self.assertEqual(few_rows, many_rows)
+
+    def test_performance_changelist(self):
+        self.assert_constant_queries('/admin/Conference/performance/')
+
+    def test_question_changelist(self):
+        self.assert_constant_queries('/admin/Conference/question/')
+
+    def test_question_changelist_filtered_by_answer(self):
+        self.assert_constant_queries(
+            '/admin/Conference/question/?answered=no'
+        )
+
+
+class WebhookTests(SimpleTestCase):
+    # Бот принимает обновления вебхуком и отвечает фейковому Telegram
+    SCRIPT = (
+        'import http.client, json, time\n'
+        'from scratch_database import migrate_scratch_database, '
+        'use_scratch_database\n'
+        'use_scratch_database()\n'
+        'from bot import BOT_DEFAULTS, create_updater, start_webhook\n'
+        'from fake_telegram import create_fake_bot, message_update\n'
+        'migrate_scratch_database()\n'
+        'bot = create_fake_bot(defaults=BOT_DEFAULTS)\n'
+        'updater = create_updater(bot=bot)\n'
+        'start_webhook(updater)\n'
+        'connection = http.client.HTTPConnection('
+        '"127.0.0.1", int(sys.argv[1]))\n'
+        'statuses = []\n'
+        'for update_id in range(1, 6):\n'
+        '    body = json.dumps(message_update(update_id, update_id, "/start"))\n'
+        '    connection.request("POST", "/hook", body=body, '
+        'headers={"Content-Type": "application/json"})\n'
+        '    response = connection.getresponse()\n'
+        '    response.read()\n'
+        '    statuses.append(response.status)\n'
+        'deadline = time.monotonic() + 10\n'
+        'while bot.request.calls["sendMessage"] < 5 '
+        'and time.monotonic() < deadline:\n'
+        '    time.sleep(0.01)\n'
+        'updater.stop()\n'
+        'print(json.dumps([statuses, dict(bot.request.calls)]))\n'
+    )
+
+    def test_answers_updates_posted_to_webhook(self):
+        with socket.socket() as sock:
+            sock.bind(('127.0.0.1', 0))
+            port = sock.getsockname()[1]
+
+        result = subprocess.run(
+            [sys.executable, '-c', 'import sys\n' + self.SCRIPT, str(port)],
+            cwd=BOT_DIR,
+            env={
+                **os.environ,
+                'BOT_PERSISTENCE': 'memory',
+                'OUTBOX_RATE': '0',
+                'WEBHOOK_PORT': str(port),
+                'WEBHOOK_PATH': 'hook',
+                'WEBHOOK_URL': 'https://meetup.example.com/',
+            },
+            capture_output=True,
+            text=True,
+            timeout=60,
+            check=True
+        )
+        statuses, calls = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertEqual(statuses, [200] * 5)
+        # На каждый /start ровно один ответ, и вебхук зарегистрирован
+        self.assertEqual(calls['sendMessage'], 5)
+        self.assertEqual(calls['setWebhook'], 1)
+
+
+class QuestionDigestTests(SimpleTestCase):
+    # Подборки собирает бот, поэтому проверка идёт в его процессе
+    SCRIPT = (
+        'import json\n'
+        'from types import SimpleNamespace\n'
+        'from scratch_database import use_scratch_database\n'
+        'use_scratch_database()\n'
+        'from menu_blocks import split_question_digests\n'
+        'clusters = [\n'
+        '    SimpleNamespace(askers=1, primary=SimpleNamespace(\n'
+        '        pk=number, question=str(number) * length))\n'
+        '    for number, length in enumerate(\n'
+        '        [1500, 1500, 1500, 5000, 10, 10, 10], start=1)\n'
+        ']\n'
+        'print(json.dumps([\n'
+        '    [[cluster.primary.pk for cluster in digest], len(text)]\n'
+        '    for digest, text in split_question_digests(clusters, 2)\n'
+        ']))\n'
+    )
+
+    def test_splits_digests_by_size_and_length(self):
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT],
+            cwd=BOT_DIR,
+            env={**os.environ, 'BOT_PERSISTENCE': 'memory'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        digests = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertEqual(
+            [pks for pks, _ in digests],
+            [[1, 2], [3], [4, 5], [6, 7]]
+        )
+        # Вопрос длиннее сообщения обрезается, а не ломает подборку
+        self.assertTrue(all(length <= 4096 for _, length in digests))
+
+
+class WriteBehindPersistenceTests(SimpleTestCase):
+    SCRIPT = (
+        'import json\n'
+        'from scratch_database import use_scratch_database\n'
+        'use_scratch_database()\n'
+        'import orm_commands\n'
+        'from persistence import InMemoryStore, WriteBehindPersistence\n'
+        'class FlakyStore(InMemoryStore):\n'
+        '    failures = 1\n'
+        '    def hset(self, name, mapping):\n'
+        '        if self.failures:\n'
+        '            self.failures -= 1\n'
+        '            raise OSError("database is locked")\n'
+        '        super().hset(name, mapping=mapping)\n'
+        'store = FlakyStore()\n'
+        'persistence = WriteBehindPersistence(store, flush_interval=3600)\n'
+        'persistence.update_conversation("menu", (1, 1), 1)\n'
+        'persistence.update_user_data(1, {"speaker_id": 5})\n'
+        'try:\n'
+        '    persistence.flush()\n'
+        'except OSError:\n'
+        '    pass\n'
+        'persistence.update_conversation("menu", (1, 1), 2)\n'
+        'persistence.stop()\n'
+        'print(json.dumps([list(persistence.get_conversations("menu").items()), '
+        'persistence.get_user_data()[1]]))\n'
+    )
+
+    def test_keeps_batch_when_store_fails(self):
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT],
+            cwd=BOT_DIR,
+            env={**os.environ, 'BOT_PERSISTENCE': 'memory'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        conversations, user_data = json.loads(result.stdout.splitlines()[-1])
+
+        # Новое состояние, принятое после сбоя, не перетёрто старым
+        self.assertEqual(conversations, [[[1, 1], 2]])
+        self.assertEqual(user_data, {'speaker_id': 5})
+
+
+class UnblockedUserTests(SimpleTestCase):
+    SCRIPT = (
+        'import json\n'
+        'from scratch_database import migrate_scratch_database, '
+        'use_scratch_database\n'
+        'use_scratch_database()\n'
+        'from orm_commands import known_user_ids, load_known_user_ids, '
+        'register_user\n'
+        'from admin_panel.Conference.models import BotUser\n'
+        'migrate_scratch_database()\n'
+        'BotUser.objects.create(telegram_id=1)\n'
+        'BotUser.objects.create(telegram_id=2, is_blocked=True)\n'
+        'load_known_user_ids()\n'
+        'known = sorted(known_user_ids)\n'
+        'register_user(2, "Имя", None)\n'
+        'print(json.dumps([known, BotUser.objects.get(telegram_id=2)'
+        '.is_blocked]))\n'
+    )
+
+    def test_clears_block_when_user_writes_again(self):
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT],
+            cwd=BOT_DIR,
+            env={**os.environ, 'BOT_PERSISTENCE': 'memory'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        known, is_blocked = json.loads(result.stdout.splitlines()[-1])
+
+        # Обновление от заблокировавшего бота не пропускается как известное
+        self.assertEqual(known, [1])
+        self.assertFalse(is_blocked)
+
+
+class SpeakerlessPerformanceTests(SimpleTestCase):
+    SCRIPT = (
+        'import datetime, json\n'
+        'from scratch_database import migrate_scratch_database, '
+        'use_scratch_database\n'
+        'use_scratch_database()\n'
+        'from menu_blocks import render_performance, render_question_speaker, '
+        'render_question_times\n'
+        'from admin_panel.Conference.models import Conference, Performance, '
+        'ScheduleVersion, Speaker\n'
+        'migrate_scratch_database()\n'
+        'conference = Conference.objects.create(name="Python", '
+        'date=datetime.date(2022, 7, 20))\n'
+        'speaker = Speaker.objects.create(telegram_id=1, fullname="Иван", '
+        'speciality="Backend")\n'
+        'with_speaker, without_speaker = [\n'
+        '    Performance.objects.create(name=name, description="", '
+        'time=datetime.time(hour), speaker=performance_speaker, '
+        'conference=conference)\n'
+        '    for name, hour, performance_speaker '
+        'in [("A", 10, speaker), ("B", 11, None)]\n'
+        ']\n'
+        'ScheduleVersion.bump()\n'
+        'def labels(markup):\n'
+        '    return [button["text"] for row in '
+        'json.loads(markup)["inline_keyboard"] for button in row]\n'
+        'try:\n'
+        '    render_question_speaker(without_speaker.pk)\n'
+        'except KeyError:\n'
+        '    missing = True\n'
+        'print(json.dumps([\n'
+        '    labels(render_performance(with_speaker.pk)[1]),\n'
+        '    labels(render_performance(without_speaker.pk)[1]),\n'
+        '    labels(render_question_times(conference.pk)[1]),\n'
+        '    missing,\n'
+        ']))\n'
+    )
+
+    def test_does_not_offer_questions_without_speaker(self):
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT],
+            cwd=BOT_DIR,
+            env={**os.environ, 'BOT_PERSISTENCE': 'memory'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        with_speaker, without_speaker, times, missing = json.loads(
+            result.stdout.splitlines()[-1]
+        )
+
+        self.assertIn('❔Задать вопрос спикеру', with_speaker)
+        self.assertNotIn('❔Задать вопрос спикеру', without_speaker)
+        self.assertEqual(times, ['10:00:00', 'Назад'])
+        # Старая кнопка ведёт в обработку «программа изменилась»
+        self.assertTrue(missing)
+
+
+class BotStartupTests(SimpleTestCase):
+    # Бот перезапускают прямо во время митапа
+    IMPORT_BUDGET_SECONDS = 1.0
+    SCRIPT = (
+        'import json, sys, time\n'
+        'started_at = time.perf_counter()\n'
+        'import bot\n'
+        'print(json.dumps([time.perf_counter() - started_at, '
+        '"django.contrib.admin" in sys.modules]))\n'
+    )
+
+    def test_bot_imports_within_budget(self):
+        result = subprocess.run(
+            [sys.executable, '-c', self.SCRIPT],
+            cwd=BOT_DIR,
+            env={**os.environ, 'BOT_PERSISTENCE': 'memory'},
+            capture_output=True,
+            text=True,
+            check=True
+        )
+        seconds, admin_loaded = json.loads(result.stdout.splitlines()[-1])
+
+        self.assertFalse(admin_loaded)
+        self.assertLess(seconds, self.IMPORT_BUDGET_SECONDS)
@@ -80,11 +80,54 @@ WSGI_APPLICATION = 'Meetup.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/4.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# Бот и админка пишут в одну базу. По умолчанию это SQLite в режиме WAL:
+# читатели не блокируют запись, а писатели ждут блокировку до
+# SQLITE_BUSY_TIMEOUT секунд вместо немедленной ошибки "database is locked".
+# Для нагруженных митапов можно переключиться на PostgreSQL через DB_ENGINE.
+
+DB_ENGINE = os.getenv('DB_ENGINE', 'sqlite')
+
+if DB_ENGINE == 'postgres':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.getenv('POSTGRES_DB', 'meetup'),
+            'USER': os.getenv('POSTGRES_USER', 'meetup'),
+            'PASSWORD': os.getenv('POSTGRES_PASSWORD', ''),
+            'HOST': os.getenv('POSTGRES_HOST', 'localhost'),
+            'PORT': os.getenv('POSTGRES_PORT', '5432'),
+            # Каждый поток держит своё соединение открытым, так что пулы
+            # потоков бота работают как пул соединений
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 600)),
+            # PgBouncer в режиме transaction не поддерживает серверные курсоры
+            'DISABLE_SERVER_SIDE_CURSORS':
+                os.getenv('DB_PGBOUNCER', '0') == '1',
+            'OPTIONS': {
+                'connect_timeout': int(os.getenv('POSTGRES_CONNECT_TIMEOUT', 5)),
+            },
+        }
     }
+elif DB_ENGINE == 'sqlite':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.getenv('SQLITE_PATH', BASE_DIR / 'db.sqlite3'),
+            'CONN_MAX_AGE': int(os.getenv('DB_CONN_MAX_AGE', 0)),
+            'OPTIONS': {
+                'timeout': float(os.getenv('SQLITE_BUSY_TIMEOUT', 20)),
+            },
+        }
+    }
+else:
+    raise ValueError(f'Unknown DB_ENGINE: {DB_ENGINE}')
+
+# Применяются к каждому новому соединению с SQLite, см. Conference/signals.py
+SQLITE_PRAGMAS = {
+    'journal_mode': os.getenv('SQLITE_JOURNAL_MODE', 'wal'),
+    # В режиме WAL NORMAL не теряет целостность и не ждёт fsync на коммит
+    'synchronous': 'normal',
+    'temp_store': 'memory',
+    'cache_size': -32_000,
 }
 
 
@@ -0,0 +1,100 @@
+import threading
+import time
+
+from functools import partial
+
+from django.utils import timezone
+from telegram.error import Unauthorized
+
+from orm_commands import run_in_background, save_answer_receipts
+from metrics import registry
+from outbox import outbox
+
+
+class AnswerDelivery:
+    """Рассылка одного ответа спикера всем, кто задал вопрос.
+
+    Ответ копируется каждому слушателю через общую очередь отправки, так
+    что сотни копий уходят параллельно в пределах лимитов Telegram, а
+    обработчик не ждёт ни одной из них. Квитанции копятся в памяти и
+    сохраняются одним bulk_update, когда завершится последняя отправка.
+    """
+
+    def __init__(self, bot, chat_id: int, message_id: int, questions: list):
+        self.bot = bot
+        self.chat_id = chat_id
+        self.message_id = message_id
+        # Слушатель, задавший несколько похожих вопросов, получает
+        # ответ один раз, а квитанция ставится на все его вопросы
+        self.questions_by_user = {}
+        for question in questions:
+            self.questions_by_user.setdefault(
+                question.telegram_user_id, []
+            ).append(question)
+        self.receipts = []
+        self.blocked_user_ids = []
+        self._left = len(self.questions_by_user)
+        self._lock = threading.Lock()
+        self._started_at = None
+
+    def start(self) -> None:
+        self._started_at = time.perf_counter()
+        for user_id in self.questions_by_user:
+            outbox.submit(
+                user_id,
+                self.bot.copy_message,
+                chat_id=user_id,
+                from_chat_id=self.chat_id,
+                message_id=self.message_id
+            ).add_done_callback(partial(self._delivered, user_id))
+
+    def _delivered(self, user_id: int, future) -> None:
+        error = future.exception()
+        if error is None:
+            receipt = (self.questions_by_user[user_id],
+                       future.result().message_id, timezone.now(), '')
+        else:
+            receipt = (self.questions_by_user[user_id], None, None,
+                       str(error))
+
+        with self._lock:
+            self.receipts.append(receipt)
+            if isinstance(error, Unauthorized):
+                self.blocked_user_ids.append(user_id)
+            self._left -= 1
+            finished = not self._left
+        if finished:
+            self._finish()
+
+    def _finish(self) -> None:
+        delivered = sum(
+            message_id is not None for _, message_id, _, _ in self.receipts
+        )
+        if registry.enabled:
+            # Время от ответа спикера до последней доставленной копии
+            registry.observe(
+                'answer',
+                'fanout',
+                time.perf_counter() - self._started_at,
+                failed=delivered < len(self.receipts)
+            )
+        run_in_background(
+            save_answer_receipts,
+            self.receipts,
+            self.blocked_user_ids
+        )
+        if len(self.receipts) > 1:
+            outbox.submit(
+                self.chat_id,
+                self.bot.send_message,
+                chat_id=self.chat_id,
+                text=f'Ответ доставлен слушателям: {delivered} '
+                     f'из {len(self.receipts)}.'
+            )
+
+
+def deliver_answer(bot, chat_id: int, message_id: int,
+                   questions: list) -> AnswerDelivery:
+    delivery = AnswerDelivery(bot, chat_id, message_id, questions)
+    delivery.start()
+    return delivery
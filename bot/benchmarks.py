@@ -0,0 +1,546 @@
+import argparse
+import contextlib
+import datetime
+import http.client
+import itertools
+import json
+import logging
+import os
+import socket
+import statistics
+import threading
+import time
+
+from scratch_database import migrate_scratch_database, use_scratch_database
+
+# Бенчмарки создают и удаляют программу, вопросы и пользователей,
+# поэтому работают на временной базе, а не на рабочей
+use_scratch_database()
+# Бенчмарки меряют бота, а не лимиты Telegram
+os.environ.setdefault('OUTBOX_RATE', '0')
+os.environ.setdefault('OUTBOX_CHAT_RATE', '0')
+os.environ.setdefault('THROTTLE_RATE', '0')
+
+from django.db import transaction
+from telegram import Update
+
+from bot import BOT_DEFAULTS, create_updater
+from fake_telegram import (
+    BOT_USER,
+    callback_query_update,
+    create_fake_bot,
+    message_update
+)
+from menu_blocks import (
+    callback_data,
+    menu_screen,
+    render_conference,
+    CONFERENCE,
+    MAIN_MENU,
+    NOW,
+    PERFORMANCE,
+    PROGRAMS
+)
+from metrics import registry
+from orm_commands import get_conferences, known_user_ids
+from schedule_cache import schedule_cache
+from supervisor import Supervisor
+from user_rate_limiter import UserRateLimiter
+
+from admin_panel.Conference.models import (
+    BotUser,
+    Conference,
+    Performance,
+    Question,
+    ScheduleVersion,
+    Speaker
+)
+from admin_panel.Conference.ratelimit import GLOBAL_MESSAGES_PER_SECOND
+
+SAMPLE_SPEAKER_IDS = 2_000_000_000
+
+
+def percentile(values: list, percent: float) -> float:
+    values = sorted(values)
+    index = min(len(values) - 1, int(len(values) * percent / 100))
+    return values[index]
+
+
+def wait_for(predicate, timeout: float) -> bool:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if predicate():
+            return True
+        time.sleep(0.005)
+    return predicate()
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+@contextlib.contextmanager
+def sample_schedule(conferences: int, performances: int):
+    # Данные сохраняются, чтобы их видели все потоки бота,
+    # и удаляются после замера
+    speakers = Speaker.objects.bulk_create(
+        Speaker(
+            telegram_id=SAMPLE_SPEAKER_IDS + number,
+            fullname=f'Спикер {number}',
+            speciality='Python-разработчик'
+        )
+        for number in range(max(1, performances // 10))
+    )
+    conference_rows = Conference.objects.bulk_create(
+        Conference(
+            name=f'Программа {number}',
+            date=datetime.date.today()
+        )
+        for number in range(conferences)
+    )
+    try:
+        Performance.objects.bulk_create(
+            (
+                Performance(
+                    name=f'Выступление {number}',
+                    description=f'Доклад номер {number} о Python',
+                    time=(datetime.datetime.min + datetime.timedelta(
+                        minutes=number // conferences
+                    )).time(),
+                    speaker=speakers[number % len(speakers)],
+                    conference=conference_rows[number % conferences]
+                )
+                for number in range(performances)
+            ),
+            batch_size=1_000
+        )
+        ScheduleVersion.bump()  # bulk_create не шлёт сигналы
+        schedule_cache.invalidate()
+        yield
+    finally:
+        with transaction.atomic():
+            Performance.objects.filter(
+                conference__in=conference_rows
+            ).delete()
+            Question.objects.filter(speaker__in=speakers).delete()
+            Conference.objects.filter(
+                pk__in=[conference.pk for conference in conference_rows]
+            ).delete()
+            Speaker.objects.filter(
+                pk__in=[speaker.pk for speaker in speakers]
+            ).delete()
+
+
+def measure(func, repeat: int) -> float:
+    started_at = time.perf_counter()
+    for _ in range(repeat):
+        func()
+    return (time.perf_counter() - started_at) / repeat
+
+
+def benchmark_render(args) -> None:
+    with sample_schedule(args.conferences, args.performances):
+        conference_id = get_conferences()[0].pk
+        uncached = measure(
+            lambda: render_conference(conference_id),
+            args.repeat
+        )
+        cached = measure(
+            lambda: menu_screen(CONFERENCE, conference_id),
+            args.repeat
+        )
+
+    print(f'Программ: {args.conferences}, выступлений: {args.performances}')
+    print(f'Рендеринг на каждый запрос: {uncached * 1_000_000:.1f} мкс')
+    print(f'Из кэша: {cached * 1_000_000:.1f} мкс '
+          f'(в {uncached / cached:.0f} раз быстрее)')
+
+
+def benchmark_search(args) -> None:
+    queries = (
+        'python',
+        f'выступление {args.performances - 1}',
+        'спикер 42',
+        'докл разработ',
+        'несуществующее слово',
+    )
+    with sample_schedule(args.conferences, args.performances):
+        started_at = time.perf_counter()
+        snapshot = schedule_cache.get()
+        print(f'Выступлений: {args.performances}, снимок программы с '
+              f'индексом загружен за {time.perf_counter() - started_at:.2f} с')
+
+        for query in queries:
+            latencies = []
+            for _ in range(args.repeat):
+                started_at = time.perf_counter()
+                results = snapshot.search_index.search(query)
+                latencies.append(time.perf_counter() - started_at)
+            print(f'«{query}»: {len(results)} результатов, '
+                  f'p50 {statistics.median(latencies) * 1000:.2f} мс, '
+                  f'p99 {percentile(latencies, 99) * 1000:.2f} мс')
+
+
+def benchmark_metrics(args) -> None:
+    from loadtest import ATTENDEE_IDS, LoadTest
+
+    load_test = LoadTest(latency=0.0)
+    # Регистрация новых пользователей уходит в фоновые потоки и только
+    # добавляет шум в замер
+    known_user_ids.update(
+        range(ATTENDEE_IDS, ATTENDEE_IDS + args.rounds * 2 * args.attendees)
+    )
+    rounds = {False: [], True: []}
+    with sample_schedule(args.conferences, args.performances):
+        for round_number in range(args.rounds * 2):
+            registry.enabled = bool(round_number % 2)
+            first_attendee = round_number * args.attendees
+            started_at = time.perf_counter()
+            for number in range(first_attendee,
+                                first_attendee + args.attendees):
+                load_test.attendee(number, ask_question=False)
+            rounds[registry.enabled].append(time.perf_counter() - started_at)
+    registry.enabled = True
+    known_user_ids.clear()
+
+    plain = min(rounds[False])
+    instrumented = min(rounds[True])
+    updates = args.attendees * 5
+    print(f'Без метрик: {plain / updates * 1_000_000:.1f} мкс на обновление')
+    print(f'С метриками: {instrumented / updates * 1_000_000:.1f} мкс '
+          f'на обновление')
+    print(f'Накладные расходы: {(instrumented / plain - 1) * 100:.1f}%')
+
+
+def benchmark_webhook(args) -> None:
+    bot = create_fake_bot(defaults=BOT_DEFAULTS, latency=args.latency)
+    updater = create_updater(bot=bot)
+    port = free_port()
+    updater.start_webhook(listen='127.0.0.1', port=port, url_path='telegram')
+
+    ack_latencies = []
+    lock = threading.Lock()
+
+    def post_updates(first_update_id: int, count: int) -> None:
+        connection = http.client.HTTPConnection('127.0.0.1', port)
+        latencies = []
+        for update_id in range(first_update_id, first_update_id + count):
+            body = json.dumps(message_update(update_id, update_id, '/start'))
+            started_at = time.perf_counter()
+            connection.request(
+                'POST',
+                '/telegram',
+                body=body,
+                headers={'Content-Type': 'application/json'}
+            )
+            connection.getresponse().read()
+            latencies.append(time.perf_counter() - started_at)
+        connection.close()
+        with lock:
+            ack_latencies.extend(latencies)
+
+    per_client = args.updates // args.clients
+    total = per_client * args.clients
+    clients = [
+        threading.Thread(
+            target=post_updates,
+            args=(1 + number * per_client, per_client)
+        )
+        for number in range(args.clients)
+    ]
+
+    started_at = time.perf_counter()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    acked_in = time.perf_counter() - started_at
+    # На каждый /start бот отвечает ровно одним sendMessage
+    wait_for(lambda: bot.request.calls['sendMessage'] >= total, timeout=60)
+    processed_in = time.perf_counter() - started_at
+    updater.stop()
+
+    print(f'Обновлений: {total}, клиентов: {args.clients}, '
+          f'воркеров: {os.getenv("BOT_WORKERS", 16)}')
+    print(f'Подтверждение приёма: {total / acked_in:.0f} обн/с, '
+          f'p50 {statistics.median(ack_latencies) * 1000:.2f} мс, '
+          f'p95 {percentile(ack_latencies, 95) * 1000:.2f} мс')
+    print(f'Обработка: {bot.request.calls["sendMessage"]} ответов, '
+          f'{total / processed_in:.0f} обн/с')
+
+
+def benchmark_answers(args) -> None:
+    from loadtest import ATTENDEE_IDS, LoadTest
+
+    load_test = LoadTest(latency=args.latency)
+    calls = load_test.bot.request.calls
+    with sample_schedule(conferences=1, performances=1):
+        speaker = Speaker.objects.get(telegram_id=SAMPLE_SPEAKER_IDS)
+        question = Question.objects.create(
+            telegram_user_id=ATTENDEE_IDS,
+            speaker=speaker,
+            question='Будут ли слайды доклада?',
+            status=Question.DELIVERED,
+            forwarded_message_id=1
+        )
+        Question.bulk_create_questions([
+            Question(
+                telegram_user_id=ATTENDEE_IDS + number,
+                speaker=speaker,
+                question='будут ли слайды доклада',
+                status=Question.MERGED,
+                duplicate_of=question
+            )
+            for number in range(1, args.askers)
+        ])
+        copies_before = calls['copyMessage']
+
+        started_at = time.perf_counter()
+        load_test.send(
+            speaker.telegram_id,
+            'Да, выложим после митапа',
+            step='SPEAKER_ANSWER',
+            reply_to_message={
+                'message_id': 1,
+                'date': int(time.time()),
+                'chat': {'id': speaker.telegram_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': question.question,
+            }
+        )
+        handled_in = time.perf_counter() - started_at
+        wait_for(
+            lambda: calls['copyMessage'] - copies_before >= args.askers,
+            timeout=600
+        )
+        delivered_in = time.perf_counter() - started_at
+
+        def receipts() -> int:
+            return Question.objects.filter(
+                speaker=speaker,
+                answer_delivered_at__isnull=False
+            ).count()
+
+        wait_for(lambda: receipts() >= args.askers, timeout=60)
+        saved_in = time.perf_counter() - started_at
+        saved = receipts()
+
+    print(f'Слушателей: {args.askers}, задержка Bot API: '
+          f'{args.latency * 1000:.0f} мс, '
+          f'потоков отправки: {os.getenv("OUTBOX_WORKERS", 8)}')
+    print(f'Обработчик ответа: {handled_in * 1000:.2f} мс')
+    print(f'Все копии отправлены за {delivered_in:.2f} с, '
+          f'квитанций сохранено: {saved} за {saved_in:.2f} с')
+    print(f'При лимите Telegram {GLOBAL_MESSAGES_PER_SECOND} сообщений/с: '
+          f'не меньше {args.askers / GLOBAL_MESSAGES_PER_SECOND:.1f} с')
+
+
+def benchmark_throttle(args) -> None:
+    bot = create_fake_bot()
+    users = [
+        Update.de_json(message_update(number, number, 'Привет'), bot)
+        for number in range(1, args.users + 1)
+    ]
+
+    def run(limiter: UserRateLimiter, updates: list) -> float:
+        started_at = time.perf_counter()
+        for update in updates:
+            limiter.allow(update.effective_user.id)
+        return (time.perf_counter() - started_at) / len(updates)
+
+    rate, burst = args.rate, args.burst
+    scenarios = {
+        'Все пользователи помещаются в память': (
+            UserRateLimiter(rate, burst, max_users=args.users),
+            users * args.rounds
+        ),
+        'Вытеснение на каждом обновлении': (
+            UserRateLimiter(rate, burst, max_users=args.users // 10),
+            users * args.rounds
+        ),
+        'Флуд от одного пользователя': (
+            UserRateLimiter(rate, burst, max_users=args.users),
+            users[:1] * args.users * args.rounds
+        ),
+    }
+    for name, (limiter, updates) in scenarios.items():
+        per_update = run(limiter, updates)
+        print(f'{name}: {per_update * 1_000_000:.2f} мкс на обновление, '
+              f'вёдер в памяти: {len(limiter)}, вытеснено: {limiter.evicted}')
+
+
+def attendee_updates(attendees: int, first_user_id: int) -> list:
+    """Обновления слушателей вперемешку, как они приходят в перерыве."""
+    snapshot = schedule_cache.get()
+    update_ids = itertools.count(1)
+    sessions = []
+    for number in range(attendees):
+        user_id = first_user_id + number
+        conference = snapshot.conferences[number % len(snapshot.conferences)]
+        performances = snapshot.performances_by_conference[conference.pk]
+        performance = performances[number % len(performances)]
+        sessions.append([
+            message_update(next(update_ids), user_id, '/start'),
+            *(
+                callback_query_update(
+                    next(update_ids),
+                    user_id,
+                    callback_data(action, object_id)
+                )
+                for action, object_id in (
+                    (NOW, None),
+                    (PROGRAMS, None),
+                    (CONFERENCE, conference.pk),
+                    (PERFORMANCE, performance.pk),
+                    (MAIN_MENU, None),
+                )
+            ),
+        ])
+    return [
+        update
+        for step in itertools.zip_longest(*sessions)
+        for update in step if update is not None
+    ]
+
+
+def benchmark_processes(args) -> None:
+    from loadtest import ATTENDEE_IDS, attendee_id_range
+
+    # Состояния диалогов в этом замере не нужно сохранять в базу
+    os.environ.setdefault('BOT_PERSISTENCE', 'memory')
+    counts = sorted({
+        2 ** power for power in range(args.workers.bit_length())
+    } | {args.workers})
+
+    results = {}
+    with sample_schedule(args.conferences, args.performances):
+        updates = attendee_updates(args.attendees, ATTENDEE_IDS)
+        for workers in counts:
+            supervisor = Supervisor(workers=workers, fake_latency=args.latency)
+            supervisor.start()
+            try:
+                supervisor.wait_ready(timeout=60)
+                started_at = time.perf_counter()
+                for data in updates:
+                    supervisor.dispatch(data)
+                wait_for(
+                    lambda: supervisor.processed() >= len(updates),
+                    timeout=600
+                )
+                results[workers] = time.perf_counter() - started_at
+            finally:
+                supervisor.stop()
+                # Следующий прогон снова регистрирует тех же слушателей
+                BotUser.objects.filter(
+                    telegram_id__range=attendee_id_range(args.attendees)
+                ).delete()
+
+    print(f'Обновлений: {len(updates)}, ядер: {os.cpu_count()}')
+    for workers, elapsed in results.items():
+        print(f'Процессов: {workers:>3}: {len(updates) / elapsed:>8.0f} обн/с, '
+              f'ускорение {results[counts[0]] / elapsed:.1f}x')
+
+
+def main() -> None:
+    logging.getLogger().setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(
+        description='Бенчмарки бота на локальном фейковом Telegram'
+    )
+    subparsers = parser.add_subparsers(dest='benchmark', required=True)
+
+    webhook_parser = subparsers.add_parser(
+        'webhook',
+        help='Пропускная способность приёма обновлений через вебхук'
+    )
+    webhook_parser.add_argument('--updates', type=int, default=5_000)
+    webhook_parser.add_argument('--clients', type=int, default=8)
+    webhook_parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='Имитируемая задержка ответа Bot API в секундах'
+    )
+    webhook_parser.set_defaults(handler=benchmark_webhook)
+
+    render_parser = subparsers.add_parser(
+        'render',
+        help='Рендеринг меню программы на каждый запрос против кэша'
+    )
+    render_parser.add_argument('--conferences', type=int, default=5)
+    render_parser.add_argument('--performances', type=int, default=100)
+    render_parser.add_argument('--repeat', type=int, default=10_000)
+    render_parser.set_defaults(handler=benchmark_render)
+
+    search_parser = subparsers.add_parser(
+        'search',
+        help='Время поиска по выступлениям и спикерам'
+    )
+    search_parser.add_argument('--conferences', type=int, default=10)
+    search_parser.add_argument('--performances', type=int, default=10_000)
+    search_parser.add_argument('--repeat', type=int, default=200)
+    search_parser.set_defaults(handler=benchmark_search)
+
+    metrics_parser = subparsers.add_parser(
+        'metrics',
+        help='Накладные расходы метрик на обработку обновлений'
+    )
+    metrics_parser.add_argument('--attendees', type=int, default=200)
+    metrics_parser.add_argument('--rounds', type=int, default=10)
+    metrics_parser.add_argument('--conferences', type=int, default=5)
+    metrics_parser.add_argument('--performances', type=int, default=100)
+    metrics_parser.set_defaults(handler=benchmark_metrics)
+
+    answers_parser = subparsers.add_parser(
+        'answers',
+        help='Рассылка одного ответа спикера всем спросившим'
+    )
+    answers_parser.add_argument('--askers', type=int, default=500)
+    answers_parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.05,
+        help='Имитируемая задержка ответа Bot API в секундах'
+    )
+    answers_parser.set_defaults(handler=benchmark_answers)
+
+    throttle_parser = subparsers.add_parser(
+        'throttle',
+        help='Стоимость проверки лимита пользователя на обновление'
+    )
+    throttle_parser.add_argument('--users', type=int, default=10_000)
+    throttle_parser.add_argument('--rounds', type=int, default=20)
+    throttle_parser.add_argument('--rate', type=float, default=2)
+    throttle_parser.add_argument('--burst', type=float, default=20)
+    throttle_parser.set_defaults(handler=benchmark_throttle)
+
+    processes_parser = subparsers.add_parser(
+        'processes',
+        help='Масштабирование бота по процессам через supervisor.py'
+    )
+    processes_parser.add_argument(
+        '--workers',
+        type=int,
+        default=os.cpu_count() or 1,
+        help='Наибольшее число процессов; замер идёт для 1, 2, 4, ...'
+    )
+    processes_parser.add_argument('--attendees', type=int, default=2_000)
+    processes_parser.add_argument('--conferences', type=int, default=5)
+    processes_parser.add_argument('--performances', type=int, default=100)
+    processes_parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='Имитируемая задержка ответа Bot API в секундах'
+    )
+    processes_parser.set_defaults(handler=benchmark_processes)
+
+    args = parser.parse_args()
+    migrate_scratch_database()
+    args.handler(args)
+
+
+if __name__ == '__main__':
+    main()
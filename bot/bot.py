@@ -1,33 +1,58 @@
 import logging
 import os
+import time
+import warnings
 
 from enum import Enum
 
-from more_itertools import chunked
-
+from django.core.exceptions import ObjectDoesNotExist
 from dotenv import load_dotenv
-from telegram import ReplyKeyboardMarkup, ReplyKeyboardRemove, Update
+from telegram import Bot, ReplyKeyboardRemove, Update
 from telegram.ext import (
     Updater,
+    Dispatcher,
+    CallbackQueryHandler,
     CommandHandler,
     MessageHandler,
     Filters,
     ConversationHandler,
     CallbackContext,
+    Defaults,
+    InlineQueryHandler,
+    MessageFilter,
+    TypeHandler,
 )
 
-from menu_blocks import start_block, programs_block, performance_block
+from answer_delivery import deliver_answer
+from menu_blocks import (
+    start_block,
+    answer_query,
+    edit_screen,
+    get_performance_with_speaker,
+    inline_results_page,
+    menu_screen,
+    now_block,
+    parse_callback_data,
+    search_block,
+    warm_render_cache,
+    ASK_SPEAKER,
+    INLINE_CACHE_TIME,
+    MAIN_MENU
+)
 from orm_commands import (
-    get_performances_list,
-    get_performance,
-    get_programs_list,
-    get_performances_in_conference,
-    get_performance_by_time,
     get_speaker_telegram_id,
-    save_question,
-    get_user_answer_id,
-    get_speakers_ids
+    get_answered_question,
+    get_answer_recipients,
+    is_speaker,
+    load_known_user_ids,
+    remember_user,
+    run_in_background
 )
+from metrics import instrument, instrument_bot, start_exporters
+from outbox import OUTBOX_WORKERS, outbox
+from persistence import WriteBehindPersistence
+from question_inbox import DIGEST_INTERVAL, SAVE_INTERVAL, question_inbox
+from throttle import throttle_update
 
 logging.basicConfig(
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
@@ -37,309 +62,335 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 
 
+class SpeakerFilter(MessageFilter):
+    # Ответы слушателей отсекаются по множеству ID спикеров в памяти,
+    # ещё до вызова обработчика и без запросов к базе
+    def filter(self, message) -> bool:
+        return message.from_user is not None and \
+            is_speaker(message.from_user.id)
+
+
 class ConversationPoints(Enum):
+    # Состояния хранятся в persistence, поэтому значения не меняются.
+    # По меню пользователь ходит кнопками в состоянии MENU
     MENU = 0
-    PROGRAM_SCHEDULE = 1
-    PROGRAM_DESCRIPTION = 2
-    EXIT_FROM_DESCRIPTION = 3
-    CHOOSE_PROGRAM_FOR_QUESTION = 4
-    PERFORMANCE_SPEAKERS = 5
-    CHOOSE_PERFORMANCE_SPEAKER = 6
-    QUESTION_FOR_SPEAKER = 7
     SEND_QUESTION_TO_SPEAKER = 8
 
 
+def record_user(update: Update, context: CallbackContext) -> None:
+    user = update.effective_user
+    if user is None or user.is_bot:
+        return
+    remember_user(
+        telegram_id=user.id,
+        first_name=user.first_name,
+        username=user.username
+    )
+
+
+@instrument('handler')
 def start(update: Update, context: CallbackContext) -> int:
     start_block(update=update)
     return ConversationPoints.MENU.value
 
 
-def program(update: Update, context: CallbackContext) -> int:
-    programs_block(update=update)
-    return ConversationPoints.PROGRAM_SCHEDULE.value
+@instrument('handler')
+def navigate(update: Update, context: CallbackContext) -> int:
+    query = update.callback_query
+    try:
+        action, object_id = parse_callback_data(query.data)
+        if action == ASK_SPEAKER:
+            performance = get_performance_with_speaker(object_id)
+            context.user_data["speaker_id"] = performance.speaker.telegram_id
+            answer_query(query)
+            edit_screen(
+                query,
+                f"Задайте свой вопрос спикеру {performance.speaker}:",
+                reply_markup=None
+            )
+            return ConversationPoints.SEND_QUESTION_TO_SPEAKER.value
 
+        text, reply_markup = menu_screen(action, object_id)
+    except (KeyError, ValueError, ObjectDoesNotExist):
+        # Кнопка из старого сообщения, а программа с тех пор изменилась
+        answer_query(query, "Программа изменилась, откройте меню заново")
+        text, reply_markup = menu_screen(MAIN_MENU)
+    else:
+        answer_query(query)
 
-def schedules(update: Update, context: CallbackContext) -> int:
-    user_choice = update.message.text
+    edit_screen(query, text, reply_markup)
+    return ConversationPoints.MENU.value
 
-    if user_choice == "Главное меню":
-        start_block(update=update)
-        return ConversationPoints.MENU.value
 
-    if user_choice == "Назад":
-        performances_list = get_performances_list(context=context)
-        performances, text = performance_block(
-            context=context,
-            performances_list=performances_list,
-            user_is_back=True
+@instrument('handler')
+def forward_to_speaker(update: Update, context: CallbackContext):
+    speaker_chat_id = context.user_data.get("speaker_id")
+    if speaker_chat_id is None:
+        # Диалог, начатый до перехода на кнопки с ID
+        speaker_chat_id = get_speaker_telegram_id(
+            speaker_fullname=context.user_data["speaker"]
         )
+    question_inbox.put(
+        by_user=update.message.from_user.id,
+        question=update.message.text,
+        speaker_id=speaker_chat_id
+    )
 
-        reply_keyboard = list(chunked(performances, 2))
-        update.message.reply_text(
-            text=text,
-            reply_markup=ReplyKeyboardMarkup(
-                reply_keyboard,
-                one_time_keyboard=True,
-                resize_keyboard=True
-            )
-        )
-        return ConversationPoints.PROGRAM_DESCRIPTION.value
+    return ConversationHandler.END
 
-    performances_list = get_performances_list(
-        context=context,
-        user_choice=user_choice
-    )
 
-    performances, text = performance_block(
-        context=context,
-        performances_list=performances_list,
-        user_choice=user_choice
+@instrument('handler')
+def ask_for_text(update: Update, context: CallbackContext) -> None:
+    # Спикеру уходит только текст, а стикеры, фото и голосовые
+    # оставляют слушателя в том же состоянии
+    outbox.submit(
+        update.message.chat_id,
+        update.message.reply_text,
+        "Вопрос можно задать только текстом. Напишите его одним сообщением."
     )
 
-    reply_keyboard = list(chunked(performances, 2))
-    update.message.reply_text(
-        text=text,
-        reply_markup=ReplyKeyboardMarkup(
-            reply_keyboard,
-            one_time_keyboard=True,
-            resize_keyboard=True
+
+@instrument('handler')
+def forward_to_user(update: Update, context: CallbackContext):
+    speaker_id = update.effective_user.id
+    reply_to_message = update.message.reply_to_message
+
+    if reply_to_message.forward_from:
+        outbox.submit(
+            reply_to_message.forward_from.id,
+            context.bot.copy_message,
+            message_id=update.message.message_id,
+            chat_id=reply_to_message.forward_from.id,
+            from_chat_id=update.message.chat_id
         )
+        return
+
+    question = get_answered_question(
+        speaker_id=speaker_id,
+        message_id=reply_to_message.message_id,
+        answer_text=update.message.text,
+        question_text=reply_to_message.text
     )
-    context.user_data["performance"] = user_choice
-    return ConversationPoints.PROGRAM_DESCRIPTION.value
-
-
-def get_program_description(update: Update, context: CallbackContext) -> int:
-    user_choice = update.message.text
-
-    if user_choice == "Назад":
-        programs_block(update=update)
-        return ConversationPoints.PROGRAM_SCHEDULE.value
-
-    reply_keyboard = [["Главное меню", "Назад"]]
-    performance = get_performance(user_choice=user_choice)
-    update.message.reply_text(
-        f"Описание программы: {performance.description}\n\n"
-        f"Спикер программы: {performance.speaker}",
-        reply_markup=ReplyKeyboardMarkup(
-            reply_keyboard,
-            one_time_keyboard=True,
-            resize_keyboard=True
+    if question is None:
+        outbox.submit(
+            update.message.chat_id,
+            update.message.reply_text,
+            "В этом сообщении несколько вопросов. Начните ответ с номера "
+            "вопроса, например #12."
         )
-    )
-    return ConversationPoints.EXIT_FROM_DESCRIPTION.value
-
-
-def question_for_speaker(update: Update, context: CallbackContext) -> int:
-    programs = get_programs_list()
-    update.message.reply_text(
-        "Спикеру какой программы у вас есть вопрос?",
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=list(chunked(programs, 2)),
-            one_time_keyboard=True,
-            resize_keyboard=True
-        ),
-    )
-    return ConversationPoints.CHOOSE_PROGRAM_FOR_QUESTION.value
-
-
-def get_performance_times(update: Update, context: CallbackContext) -> int:
-    performances = get_performances_in_conference(update=update)
-    reply_keyboard = [str(performance.time) for performance
-                      in performances]
-    context.user_data["performance"] = update.message.text
-
-    update.message.reply_text(
-        "Когда было выступление?",
-         reply_markup=ReplyKeyboardMarkup(
-             keyboard=list(chunked(reply_keyboard, 2)),
-             one_time_keyboard=True,
-             resize_keyboard=True
-         )
-    )
-    return ConversationPoints.PERFORMANCE_SPEAKERS.value
+        return
 
-
-def get_performance_speakers(update: Update, context: CallbackContext) -> int:
-    context.user_data["time"] = update.message.text
-    performance = get_performance_by_time(
-        time=context.user_data['time'],
-        performance_name=context.user_data["performance"]
-    )
-    speaker = performance.speaker.fullname
-    reply_keyboard = [[speaker], ["Назад"]]
-    update.message.reply_text(
-        text=f"На программе «{context.user_data['performance']}» в "
-             f"{context.user_data['time']} выступал:\n\n",
-        reply_markup=ReplyKeyboardMarkup(
-             keyboard=reply_keyboard,
-             one_time_keyboard=True,
-             resize_keyboard=True
-         )
+    # Один ответ получают все, кто задал этот или похожий вопрос
+    deliver_answer(
+        context.bot,
+        chat_id=update.message.chat_id,
+        message_id=update.message.message_id,
+        questions=get_answer_recipients(question.pk)
     )
-    return ConversationPoints.QUESTION_FOR_SPEAKER.value
 
 
-def question(update: Update, context: CallbackContext) -> int:
-    if update.message.text == "Назад":
-        programs = get_programs_list()
-        programs.append("Главное меню")
+@instrument('handler')
+def find(update: Update, context: CallbackContext) -> int:
+    if context.args is not None:
+        query = ' '.join(context.args)
+    else:
+        query = update.message.text
+    search_block(update=update, query=query.strip())
+    return ConversationPoints.MENU.value
 
-        update.message.reply_text(
-            "Спикеру какой программы у вас есть вопрос?",
-            reply_markup=ReplyKeyboardMarkup(
-                keyboard=list(chunked(programs, 2)),
-                one_time_keyboard=True,
-                resize_keyboard=True
-            ),
-        )
-        return ConversationPoints.CHOOSE_PROGRAM_FOR_QUESTION.value
 
-    update.message.reply_text(
-        text=f"Задайте свой вопрос:"
-    )
-    context.user_data["speaker"] = update.message.text
-    return ConversationPoints.SEND_QUESTION_TO_SPEAKER.value
+@instrument('handler')
+def now(update: Update, context: CallbackContext) -> int:
+    now_block(update=update)
+    return ConversationPoints.MENU.value
 
 
-def forward_to_speaker(update: Update, context: CallbackContext):
-    speaker_chat_id = get_speaker_telegram_id(
-        speaker_fullname=context.user_data["speaker"]
+@instrument('handler')
+def inline_query(update: Update, context: CallbackContext) -> None:
+    query = update.inline_query
+    offset = int(query.offset) if query.offset.isdigit() else 0
+    results, next_offset = inline_results_page(query.query.strip(), offset)
+    outbox.submit(
+        query.from_user.id,
+        query.answer,
+        results,
+        cache_time=INLINE_CACHE_TIME,
+        is_personal=False,
+        next_offset=next_offset,
+        rate_limited=False
     )
-    update.message.forward(chat_id=speaker_chat_id)
-    user_id = update.message.from_user.id
-    question = update.message.text
 
-    save_question(
-        by_user=user_id,
-        question=question,
-        speaker_id=speaker_chat_id
+
+@instrument('handler')
+def cancel(update: Update, context: CallbackContext) -> int:
+    outbox.submit(
+        update.message.chat_id,
+        update.message.reply_text,
+        "Действие отменено",
+        reply_markup=ReplyKeyboardRemove()
     )
 
     return ConversationHandler.END
 
 
-def forward_to_user(update: Update, context: CallbackContext):
-    # Если в это состояние бота входит не спикер - функция не срабатывает
-    speaker_id = update.effective_user.id
-    speakers_ids = get_speakers_ids()
-    if speaker_id not in speakers_ids:
-        return None
-
-    question_text = update.message.reply_to_message.text
-
-    if update.message.reply_to_message.forward_from:
-        user_id = update.message.reply_to_message.forward_from.id
-    else:
-        answer_id = get_user_answer_id(
-            speaker_id=speaker_id,
-            question_text=question_text
+BOT_DEFAULTS = Defaults(run_async=True)
+
+
+def create_updater(bot: Bot = None, deliver_digests: bool = True) -> Updater:
+    # Каждый обработчик выполняется в пуле из BOT_WORKERS потоков,
+    # поэтому медленный ответ одному пользователю не задерживает других
+    workers = int(os.getenv('BOT_WORKERS', 16))
+    persistence = WriteBehindPersistence()
+    if bot is None:
+        # Соединения с Telegram держатся открытыми и переиспользуются:
+        # по одному на поток обработчиков, поток отправки и getUpdates
+        updater = Updater(
+            os.environ['TELEGRAM_BOT_TOKEN'],
+            workers=workers,
+            defaults=BOT_DEFAULTS,
+            persistence=persistence,
+            request_kwargs={
+                'con_pool_size': workers + OUTBOX_WORKERS + 4,
+                'read_timeout': float(os.getenv('TELEGRAM_READ_TIMEOUT', 10)),
+            }
         )
-        user_id = answer_id
-
-    context.bot.copy_message(
-        message_id=update.message.message_id,
-        chat_id=user_id,
-        from_chat_id=update.message.chat_id
+    else:
+        updater = Updater(bot=bot, workers=workers, persistence=persistence)
+
+    instrument_bot(updater.bot)
+    outbox.start()
+    setup_handlers(updater.dispatcher)
+    updater.job_queue.run_repeating(
+        question_inbox.save,
+        interval=SAVE_INTERVAL,
+        name='question_inbox'
     )
+    # В остальных процессах подборки не рассылаются, они только
+    # сохраняют принятые вопросы в базу
+    if deliver_digests:
+        updater.job_queue.run_repeating(
+            question_inbox.deliver,
+            interval=DIGEST_INTERVAL,
+            name='question_digests'
+        )
+    return updater
 
 
-def cancel(update: Update, context: CallbackContext) -> int:
-    update.message.reply_text(
-        "Действие отменено",
-        reply_markup=ReplyKeyboardRemove()
+def start_webhook(updater: Updater) -> None:
+    url_path = os.getenv('WEBHOOK_PATH', 'telegram')
+    updater.start_webhook(
+        listen=os.getenv('WEBHOOK_LISTEN', '127.0.0.1'),
+        port=int(os.getenv('WEBHOOK_PORT', 8443)),
+        url_path=url_path
     )
 
-    return ConversationHandler.END
-
+    # Без своего сертификата PTB не регистрирует вебхук сам: TLS в этом
+    # режиме завершает прокси перед ботом, его адрес задаётся в WEBHOOK_URL
+    webhook_url = os.getenv('WEBHOOK_URL')
+    if webhook_url:
+        updater.bot.set_webhook(
+            url=f'{webhook_url.rstrip("/")}/{url_path}',
+            max_connections=int(os.getenv('WEBHOOK_MAX_CONNECTIONS', 40))
+        )
 
-def main() -> None:
-    load_dotenv()
 
-    telegram_bot_token = os.environ['TELEGRAM_BOT_TOKEN']
-    updater = Updater(telegram_bot_token)
+def setup_handlers(dispatcher: Dispatcher) -> None:
+    # Флуд отсекается до всех остальных групп, включая conv_handler
+    dispatcher.add_handler(
+        TypeHandler(Update, throttle_update, run_async=False),
+        group=-2
+    )
+    dispatcher.add_handler(
+        TypeHandler(Update, record_user, run_async=False),
+        group=-1
+    )
 
-    dispatcher = updater.dispatcher
+    # Кнопки меню отслеживаются по пользователю, а не по сообщению,
+    # поэтому предупреждение PTB о per_message здесь не нужно
+    warnings.filterwarnings(
+        'ignore',
+        message="If 'per_message=False'",
+        category=UserWarning
+    )
+    search_text = Filters.text & ~Filters.command & ~Filters.reply \
+        & Filters.chat_type.private
 
     conv_handler = ConversationHandler(
         entry_points=[
-            CommandHandler('start', start)
+            CommandHandler('start', start),
+            CommandHandler('find', find),
+            CommandHandler('now', now),
+            # Нажатие кнопки в сообщении из завершённого диалога
+            CallbackQueryHandler(navigate),
+            # Свободный текст вне диалога - это поисковый запрос
+            MessageHandler(search_text, find),
         ],
         states={
             ConversationPoints.MENU.value: [
-                MessageHandler(
-                    Filters.regex('^(📆 Программа)$'),
-                    program
-                ),
-                MessageHandler(
-                    Filters.regex('^(❔Задать вопрос спикеру)$'),
-                    question_for_speaker
-                )
-            ],
-            ConversationPoints.PROGRAM_SCHEDULE.value: [
-                MessageHandler(
-                    Filters.text,
-                    schedules
-                )
-            ],
-            ConversationPoints.PROGRAM_DESCRIPTION.value: [
-                MessageHandler(
-                    Filters.text,
-                    get_program_description
-                )
-            ],
-            ConversationPoints.EXIT_FROM_DESCRIPTION.value: [
-                MessageHandler(
-                    Filters.regex('^(Главное меню)$'),
-                    start
-                ),
-                MessageHandler(
-                    Filters.regex('^(Назад)$'),
-                    schedules
-                ),
-            ],
-            ConversationPoints.CHOOSE_PROGRAM_FOR_QUESTION.value: [
-                MessageHandler(
-                    Filters.regex('^(Главное меню)$'),
-                    start
-                ),
-                MessageHandler(
-                    Filters.text,
-                    get_performance_times
-                ),
-            ],
-            ConversationPoints.PERFORMANCE_SPEAKERS.value: [
-                MessageHandler(
-                    Filters.text,
-                    get_performance_speakers
-                ),
-            ],
-            ConversationPoints.QUESTION_FOR_SPEAKER.value: [
-                MessageHandler(
-                    Filters.text,
-                    question
-                ),
+                CallbackQueryHandler(navigate),
+                MessageHandler(search_text, find),
             ],
             ConversationPoints.SEND_QUESTION_TO_SPEAKER.value: [
+                CallbackQueryHandler(navigate),
+                # Команды не становятся вопросами, а доходят до fallbacks
                 MessageHandler(
-                    Filters.chat_type.private,
+                    Filters.text & ~Filters.command
+                    & Filters.chat_type.private,
                     forward_to_speaker
                 ),
+                MessageHandler(
+                    ~Filters.text & Filters.chat_type.private,
+                    ask_for_text
+                ),
             ],
         },
-        fallbacks=[CommandHandler('cancel', cancel)],
+        fallbacks=[
+            CommandHandler('cancel', cancel),
+            CommandHandler('find', find),
+            CommandHandler('now', now),
+            CommandHandler('start', start),
+            # Пользователи, застрявшие в состояниях прежнего текстового
+            # меню, возвращаются в главное меню через кнопки
+            CallbackQueryHandler(navigate),
+            MessageHandler(search_text, find),
+        ],
+        name='meetup_conversation',
+        persistent=True,
     )
 
     dispatcher.add_handler(conv_handler)
+    dispatcher.add_handler(InlineQueryHandler(inline_query))
     dispatcher.add_handler(
         MessageHandler(
-            Filters.reply,
+            Filters.reply & Filters.chat_type.private & SpeakerFilter(),
             forward_to_user
         )
     )
 
-    updater.start_polling()
+
+@instrument('job')
+def warm_up() -> None:
+    started_at = time.perf_counter()
+    load_known_user_ids()
+    warm_render_cache()
+    logger.info('Caches warmed up in %.2f s', time.perf_counter() - started_at)
+
+
+def main() -> None:
+    load_dotenv()
+
+    updater = create_updater()
+    start_exporters()
+    if os.getenv('BOT_MODE', 'polling') == 'webhook':
+        start_webhook(updater)
+    else:
+        updater.start_polling()
+    # Обновления уже принимаются: кто придёт до конца прогрева, подождёт
+    # только загрузки программы, а /start отвечает сразу
+    run_in_background(warm_up)
     updater.idle()
+    question_inbox.stop()
+    outbox.stop(timeout=30)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,125 @@
+import itertools
+import threading
+import time
+
+from collections import Counter
+
+from telegram import Bot
+from telegram.ext import Defaults
+from telegram.utils.request import Request
+
+
+FAKE_TOKEN = '123456:fake-token'
+
+BOT_USER = {
+    'id': 123456,
+    'is_bot': True,
+    'first_name': 'PythonMeetup',
+    'username': 'python_meetup_bot',
+}
+
+
+class FakeRequest(Request):
+    """Отвечает на вызовы Bot API локально, без обращения к сети.
+
+    ``latency`` имитирует время ответа Telegram, а ``calls`` считает
+    вызовы по методам API, чтобы бенчмарки могли их сверить.
+    """
+
+    def __init__(self, latency: float = 0.0, **kwargs):
+        kwargs.setdefault('con_pool_size', 64)
+        super().__init__(**kwargs)
+        self.latency = latency
+        self.calls = Counter()
+        self._message_ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def post(self, url: str, data: dict, timeout: float = None):
+        method = url.rsplit('/', 1)[-1]
+        with self._lock:
+            self.calls[method] += 1
+            message_id = next(self._message_ids)
+        if self.latency:
+            time.sleep(self.latency)
+
+        if method == 'getMe':
+            return BOT_USER
+        if method == 'getUpdates':
+            return []
+        if method == 'copyMessage':
+            return {'message_id': message_id}
+        if method in ('sendMessage', 'forwardMessage', 'editMessageText'):
+            return {
+                'message_id': data.get('message_id', message_id),
+                'date': int(time.time()),
+                'chat': {'id': data.get('chat_id'), 'type': 'private'},
+                'from': BOT_USER,
+                'text': data.get('text', ''),
+            }
+        return True
+
+
+def create_fake_bot(defaults: Defaults = None, latency: float = 0.0) -> Bot:
+    return Bot(
+        FAKE_TOKEN,
+        request=FakeRequest(latency=latency),
+        defaults=defaults
+    )
+
+
+def message_update(update_id: int, user_id: int, text: str,
+                   reply_to_message: dict = None) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+    message = {
+        'message_id': update_id,
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private'},
+        'from': user,
+        'text': text,
+    }
+    if text.startswith('/'):
+        command = text.split()[0]
+        message['entities'] = [
+            {'type': 'bot_command', 'offset': 0, 'length': len(command)}
+        ]
+    if reply_to_message is not None:
+        message['reply_to_message'] = reply_to_message
+    return {'update_id': update_id, 'message': message}
+
+
+def inline_query_update(update_id: int, user_id: int, query: str,
+                        offset: str = '') -> dict:
+    return {
+        'update_id': update_id,
+        'inline_query': {
+            'id': str(update_id),
+            'from': {
+                'id': user_id,
+                'is_bot': False,
+                'first_name': f'User {user_id}',
+            },
+            'query': query,
+            'offset': offset,
+        },
+    }
+
+
+def callback_query_update(update_id: int, user_id: int, data: str,
+                          message_id: int = 1) -> dict:
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User {user_id}'}
+    return {
+        'update_id': update_id,
+        'callback_query': {
+            'id': str(update_id),
+            'from': user,
+            'chat_instance': str(user_id),
+            'data': data,
+            'message': {
+                'message_id': message_id,
+                'date': int(time.time()),
+                'chat': {'id': user_id, 'type': 'private'},
+                'from': BOT_USER,
+                'text': 'Меню',
+            },
+        },
+    }
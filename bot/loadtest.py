@@ -0,0 +1,280 @@
+import argparse
+import itertools
+import logging
+import os
+import threading
+import time
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from scratch_database import migrate_scratch_database, use_scratch_database
+
+# Тест пишет в базу пользователей, вопросы и программу, поэтому работает
+# на временной базе, а не на рабочей
+use_scratch_database()
+os.environ.setdefault('BOT_PERSISTENCE', 'memory')
+# Лимиты Telegram растянули бы тест на минуты, поэтому по умолчанию
+# очередь отправки их не соблюдает
+os.environ.setdefault('OUTBOX_RATE', '0')
+os.environ.setdefault('OUTBOX_CHAT_RATE', '0')
+# Слушатели теста жмут кнопки быстрее живого человека
+os.environ.setdefault('THROTTLE_RATE', '0')
+
+from django.db import connection
+from telegram import Update
+from telegram.ext import CallbackContext, Defaults
+
+from benchmarks import percentile, sample_schedule
+from bot import ConversationPoints, create_updater
+from fake_telegram import (
+    BOT_USER,
+    callback_query_update,
+    create_fake_bot,
+    message_update
+)
+from menu_blocks import (
+    callback_data,
+    ASK_SPEAKER,
+    CONFERENCE,
+    MAIN_MENU,
+    NOW,
+    PERFORMANCE,
+    PROGRAMS,
+    QUESTION_PROGRAMS,
+    QUESTION_SPEAKER,
+    QUESTION_TIMES
+)
+from orm_commands import known_user_ids, orm_executor
+from outbox import outbox
+from question_inbox import question_inbox
+from schedule_cache import schedule_cache
+
+from admin_panel.Conference.models import BotUser, Question
+
+
+ATTENDEE_IDS = 1_000_000_000
+
+
+def attendee_id_range(attendees: int) -> tuple:
+    return ATTENDEE_IDS, ATTENDEE_IDS + attendees - 1
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.queries = defaultdict(list)
+        self._lock = threading.Lock()
+
+    def add(self, step: str, latency: float, queries: int) -> None:
+        with self._lock:
+            self.latencies[step].append(latency)
+            self.queries[step].append(queries)
+
+    def report(self, elapsed: float) -> None:
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        print(f'Обновлений: {total} за {elapsed:.2f} с, '
+              f'{total / elapsed:.0f} обн/с\n')
+        print(f'{"Состояние":<30}{"кол-во":>8}{"p50, мс":>10}'
+              f'{"p95, мс":>10}{"p99, мс":>10}{"запросов":>10}')
+        all_latencies = []
+        for step, latencies in self.latencies.items():
+            all_latencies.extend(latencies)
+            queries = self.queries[step]
+            print(f'{step:<30}{len(latencies):>8}'
+                  f'{percentile(latencies, 50) * 1000:>10.2f}'
+                  f'{percentile(latencies, 95) * 1000:>10.2f}'
+                  f'{percentile(latencies, 99) * 1000:>10.2f}'
+                  f'{sum(queries) / len(queries):>10.2f}')
+        print(f'{"Все":<30}{len(all_latencies):>8}'
+              f'{percentile(all_latencies, 50) * 1000:>10.2f}'
+              f'{percentile(all_latencies, 95) * 1000:>10.2f}'
+              f'{percentile(all_latencies, 99) * 1000:>10.2f}')
+
+
+class QueryCounter:
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+class LoadTest:
+    """Прогоняет синтетических слушателей через диспетчер бота.
+
+    Обработчики выполняются синхронно в потоке слушателя, поэтому время
+    обработки обновления и число запросов к базе относятся к конкретному
+    состоянию диалога. Вызовы Bot API уходят в очередь отправки, и время
+    до её опустошения считается отдельно.
+    """
+
+    def __init__(self, latency: float):
+        self.bot = create_fake_bot(
+            defaults=Defaults(run_async=False),
+            latency=latency
+        )
+        self.updater = create_updater(bot=self.bot)
+        self.dispatcher = self.updater.dispatcher
+        self.conversation = self.dispatcher.handlers[0][0]
+        self.stats = Stats()
+        self._update_ids = itertools.count(1)
+
+    def step_name(self, user_id: int) -> str:
+        state = self.conversation.conversations.get((user_id, user_id))
+        if state is None:
+            return 'START'
+        return ConversationPoints(state).name
+
+    def send(self, user_id: int, text: str, step: str = None,
+             reply_to_message: dict = None) -> None:
+        self.process(
+            message_update(
+                next(self._update_ids),
+                user_id,
+                text,
+                reply_to_message=reply_to_message
+            ),
+            step or self.step_name(user_id)
+        )
+
+    def press(self, user_id: int, action: str, object_id: int = None) -> None:
+        self.process(
+            callback_query_update(
+                next(self._update_ids),
+                user_id,
+                callback_data(action, object_id)
+            ),
+            f'{self.step_name(user_id)} [{action}]'
+        )
+
+    def process(self, data: dict, step: str) -> None:
+        update = Update.de_json(data, self.bot)
+        counter = QueryCounter()
+        with connection.execute_wrapper(counter):
+            started_at = time.perf_counter()
+            self.dispatcher.process_update(update)
+            latency = time.perf_counter() - started_at
+        self.stats.add(step, latency, counter.count)
+
+    def attendee(self, number: int, ask_question: bool) -> None:
+        snapshot = schedule_cache.get()
+        user_id = ATTENDEE_IDS + number
+        conference = snapshot.conferences[number % len(snapshot.conferences)]
+        performances = snapshot.performances_by_conference[conference.pk]
+        performance = performances[number % len(performances)]
+
+        self.send(user_id, '/start')
+        self.press(user_id, NOW)
+        self.press(user_id, PROGRAMS)
+        self.press(user_id, CONFERENCE, conference.pk)
+        self.press(user_id, PERFORMANCE, performance.pk)
+        self.press(user_id, MAIN_MENU)
+
+        if ask_question:
+            self.press(user_id, QUESTION_PROGRAMS)
+            self.press(user_id, QUESTION_TIMES, conference.pk)
+            self.press(user_id, QUESTION_SPEAKER, performance.pk)
+            self.press(user_id, ASK_SPEAKER, performance.pk)
+            self.send(user_id, f'Вопрос слушателя {number}')
+        connection.close()
+
+    def drain_outbox(self) -> None:
+        started_at = time.perf_counter()
+        outbox.join()
+        self.stats.add('OUTBOX_DRAIN', time.perf_counter() - started_at, 0)
+
+    def deliver_questions(self) -> None:
+        started_at = time.perf_counter()
+        question_inbox.deliver(CallbackContext(self.dispatcher))
+        self.stats.add('QUESTION_DIGESTS',
+                       time.perf_counter() - started_at, 0)
+
+    def answer_questions(self, attendees: int) -> None:
+        questions = Question.objects.filter(
+            status=Question.DELIVERED,
+            telegram_user_id__range=attendee_id_range(attendees)
+        ).select_related('speaker')
+        for question in questions:
+            speaker_id = question.speaker.telegram_id
+            self.send(
+                speaker_id,
+                f'#{question.pk} Ответ спикера',
+                step='SPEAKER_ANSWER',
+                reply_to_message={
+                    'message_id': question.forwarded_message_id,
+                    'date': int(time.time()),
+                    'chat': {'id': speaker_id, 'type': 'private'},
+                    'from': BOT_USER,
+                    'text': 'Новые вопросы',
+                }
+            )
+
+
+def main() -> None:
+    logging.getLogger().setLevel(logging.WARNING)
+
+    parser = argparse.ArgumentParser(
+        description='Нагрузочный тест бота на локальном фейковом Telegram'
+    )
+    parser.add_argument('--attendees', type=int, default=1_000)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--conferences', type=int, default=5)
+    parser.add_argument('--performances', type=int, default=100)
+    parser.add_argument(
+        '--question-share',
+        type=float,
+        default=0.2,
+        help='Доля слушателей, которые задают вопрос'
+    )
+    parser.add_argument(
+        '--latency',
+        type=float,
+        default=0.0,
+        help='Имитируемая задержка ответа Bot API в секундах'
+    )
+    args = parser.parse_args()
+
+    migrate_scratch_database()
+    load_test = LoadTest(latency=args.latency)
+    question_every = round(1 / args.question_share) \
+        if args.question_share else 0
+
+    with sample_schedule(args.conferences, args.performances):
+        try:
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+                list(executor.map(
+                    lambda number: load_test.attendee(
+                        number,
+                        ask_question=bool(question_every)
+                        and number % question_every == 0
+                    ),
+                    range(args.attendees)
+                ))
+            load_test.drain_outbox()
+            load_test.deliver_questions()
+            load_test.answer_questions(args.attendees)
+            load_test.drain_outbox()
+            elapsed = time.perf_counter() - started_at
+        finally:
+            orm_executor.shutdown(wait=True)
+            # Квитанции о доставке ответов сохраняются в фоне
+            answers_delivered = Question.objects.filter(
+                telegram_user_id__range=attendee_id_range(args.attendees),
+                answer_delivered_at__isnull=False
+            ).count()
+            BotUser.objects.filter(
+                telegram_id__range=attendee_id_range(args.attendees)
+            ).delete()
+            known_user_ids.clear()
+
+    load_test.stats.report(elapsed)
+    print(f'\nВызовы Bot API: {dict(load_test.bot.request.calls)}')
+    print(f'Ответов доставлено слушателям: {answers_delivered}')
+    print(f'Кэш программы: {schedule_cache.stats()}')
+
+
+if __name__ == '__main__':
+    main()
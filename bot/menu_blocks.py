@@ -1,65 +1,461 @@
-from telegram import ReplyKeyboardMarkup
+import itertools
+import os
+import threading
+
+from telegram import (
+    InlineKeyboardButton,
+    InlineKeyboardMarkup,
+    InlineQueryResultArticle,
+    InputTextMessageContent
+)
+from telegram.constants import MAX_MESSAGE_LENGTH
+from django.utils import timezone
 from more_itertools import chunked
 
-from orm_commands import get_programs_list
+from orm_commands import (
+    get_all_performances,
+    get_conference,
+    get_conferences,
+    get_now_and_next,
+    get_performance,
+    get_performances_list,
+    get_schedule_version,
+    search_performances
+)
+from outbox import outbox
+
+
+# Кнопки меню передают в callback_data действие и первичный ключ
+# объекта, например «c:12», а обработчик берёт объект из кэша программы
+MAIN_MENU = 'm'
+PROGRAMS = 'p'
+CONFERENCE = 'c'
+PERFORMANCE = 'v'
+QUESTION_PROGRAMS = 'q'
+QUESTION_TIMES = 'qc'
+QUESTION_SPEAKER = 'qv'
+ASK_SPEAKER = 'a'
+NOW = 'n'
+
+# Вопрос длиной с целое сообщение не поместится в подборку вместе
+# с заголовком, поэтому в подборке его конец обрезается
+QUESTION_PREVIEW_LENGTH = MAX_MESSAGE_LENGTH - 500
+
+
+def callback_data(action: str, object_id: int = None) -> str:
+    if object_id is None:
+        return action
+    return f'{action}:{object_id}'
+
+
+def parse_callback_data(data: str) -> tuple:
+    action, _, object_id = data.partition(':')
+    return action, int(object_id) if object_id else None
+
+
+def inline_markup(buttons: list) -> str:
+    return InlineKeyboardMarkup([
+        [InlineKeyboardButton(text, callback_data=data) for text, data in row]
+        for row in buttons
+    ]).to_json()
+
+
+class RenderCache:
+    """Готовые тексты и клавиатуры меню для текущей версии программы.
+
+    Клавиатура хранится уже сериализованной в JSON, так что ответ
+    на нажатие кнопки - это поиск в словаре и один вызов Bot API.
+    """
+
+    def __init__(self):
+        self._version = None
+        self._rendered = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, render):
+        version = get_schedule_version()
+        if self._version != version:
+            with self._lock:
+                if self._version != version:
+                    self._rendered = {}
+                    self._version = version
+
+        rendered = self._rendered
+        if key not in rendered:
+            rendered[key] = render()
+        return rendered[key]
+
+
+render_cache = RenderCache()
+
+START_TEXT = 'Здравствуйте! Это официальный бот PythonMeetup.\n\n' \
+             'Здесь вы можете ознакомиться с сегодняшними программами, ' \
+             'их расписаниями, а также задать интересующий вопрос спикеру!'
+START_MARKUP = inline_markup([
+    [('📆 Программа', callback_data(PROGRAMS)),
+     ('❔Задать вопрос спикеру', callback_data(QUESTION_PROGRAMS))],
+    [('⏱ Сейчас / Далее', callback_data(NOW))],
+])
+MAIN_MENU_BUTTON = ('Главное меню', callback_data(MAIN_MENU))
 
 
 def start_block(update):
-    reply_keyboard = [['📆 Программа', '❔Задать вопрос спикеру']]
-
-    update.message.reply_text(
-        'Здравствуйте! Это официальный бот PythonMeetup.\n\n'
-        'Здесь вы можете ознакомиться с сегодняшними программами, '
-        'их расписаниями, а также задать интересующий вопрос спикеру!',
-        reply_markup=ReplyKeyboardMarkup(
-            reply_keyboard,
-            one_time_keyboard=True,
-            resize_keyboard=True
-        ),
+    outbox.submit(
+        update.message.chat_id,
+        update.message.reply_text,
+        START_TEXT,
+        reply_markup=START_MARKUP
     )
 
 
-def programs_block(update):
-    programs = get_programs_list()
-    programs_text = [f"{program_number}. {program}\n" for
-                     program_number, program in enumerate(programs, start=1)]
-    programs.append("Главное меню")
-
-    update.message.reply_text(
-        'Сегодня у нас проходят следующие программы:\n\n'
-        f'{"".join(programs_text)}\n\n'
-        f'Какая программа вас заинтересовала?',
-        reply_markup=ReplyKeyboardMarkup(
-            keyboard=list(chunked(programs, 2)),
-            one_time_keyboard=True,
-            resize_keyboard=True
-        ),
-    )
+def render_main_menu(object_id=None) -> tuple:
+    return START_TEXT, START_MARKUP
+
+
+def render_programs(object_id=None) -> tuple:
+    conferences = get_conferences()
+    programs_text = [f"{program_number}. {conference.name}\n" for
+                     program_number, conference
+                     in enumerate(conferences, start=1)]
+    buttons = [(conference.name, callback_data(CONFERENCE, conference.pk))
+               for conference in conferences]
 
+    text = 'Сегодня у нас проходят следующие программы:\n\n' \
+           f'{"".join(programs_text)}\n\n' \
+           f'Какая программа вас заинтересовала?'
+    return text, inline_markup([*chunked(buttons, 2), [MAIN_MENU_BUTTON]])
 
-def performance_block(performances_list, context,
-                      user_is_back=False, user_choice=None):
+
+def render_conference(conference_id: int) -> tuple:
+    conference = get_conference(conference_id)
+    performances_list = get_performances_list(conference_id)
     performances = []
     for perforamnce_id, performance in enumerate(performances_list,
                                                  start=1):
-        performance_name = performance.name
-        performance_time = performance.time
-        performance = f'{perforamnce_id}. {performance_name}\n' \
-                      f'Время: {performance_time}\n\n'
-        performances.append(performance)
-
-    if user_is_back:
-        text = f"У программы «{context.user_data['performance']}» " \
-               f"будут следующие выступления:\n\n" \
-               f"{''.join(performances)}\n" \
-               f"Про какое выступление вам бы хотелось узнать побольше?"
+        performances.append(
+            f'{perforamnce_id}. {performance.name}\n'
+            f'Время: {performance.time}\n\n'
+        )
+
+    text = f"У программы «{conference.name}» будут следующие выступления:\n\n" \
+           f"{''.join(performances)}\n" \
+           f"Про какое выступление вам бы хотелось узнать побольше?"
+
+    buttons = [(performance.name, callback_data(PERFORMANCE, performance.pk))
+               for performance in performances_list]
+    return text, inline_markup(
+        [*chunked(buttons, 2), [('Назад', callback_data(PROGRAMS))]]
+    )
+
+
+def render_performance(performance_id: int) -> tuple:
+    performance = get_performance(performance_id)
+    text = f"Описание программы: {performance.description}\n\n" \
+           f"Спикер программы: {performance.speaker or '—'}"
+    buttons = [
+        [('Назад', callback_data(CONFERENCE, performance.conference_id)),
+         MAIN_MENU_BUTTON],
+    ]
+    # Спикера у выступления может ещё не быть, тогда и спросить некого
+    if performance.speaker is not None:
+        buttons.insert(0, [('❔Задать вопрос спикеру',
+                            callback_data(ASK_SPEAKER, performance.pk))])
+    return text, inline_markup(buttons)
+
+
+def get_performance_with_speaker(performance_id: int):
+    performance = get_performance(performance_id)
+    if performance.speaker is None:
+        # Кнопка из старого сообщения, а спикера с тех пор убрали
+        raise KeyError(performance_id)
+    return performance
+
+
+def render_question_programs(object_id=None) -> tuple:
+    buttons = [(conference.name, callback_data(QUESTION_TIMES, conference.pk))
+               for conference in get_conferences()]
+    return "Спикеру какой программы у вас есть вопрос?", inline_markup(
+        [*chunked(buttons, 2), [MAIN_MENU_BUTTON]]
+    )
+
+
+def render_question_times(conference_id: int) -> tuple:
+    get_conference(conference_id)
+    buttons = [
+        (str(performance.time),
+         callback_data(QUESTION_SPEAKER, performance.pk))
+        for performance in get_performances_list(conference_id)
+        if performance.speaker is not None
+    ]
+    return "Когда было выступление?", inline_markup(
+        [*chunked(buttons, 2), [('Назад', callback_data(QUESTION_PROGRAMS))]]
+    )
+
+
+def render_question_speaker(performance_id: int) -> tuple:
+    performance = get_performance_with_speaker(performance_id)
+    text = f"На программе «{performance.conference.name}» в " \
+           f"{performance.time} выступал:\n\n"
+    return text, inline_markup([
+        [(performance.speaker.fullname,
+          callback_data(ASK_SPEAKER, performance.pk))],
+        [('Назад',
+          callback_data(QUESTION_TIMES, performance.conference_id))],
+    ])
+
+
+SCREENS = {
+    MAIN_MENU: render_main_menu,
+    PROGRAMS: render_programs,
+    CONFERENCE: render_conference,
+    PERFORMANCE: render_performance,
+    QUESTION_PROGRAMS: render_question_programs,
+    QUESTION_TIMES: render_question_times,
+    QUESTION_SPEAKER: render_question_speaker,
+}
+
+
+def performance_line(performance) -> str:
+    return f"{performance.time} {performance.name} " \
+           f"({performance.speaker or '—'})"
+
+
+def render_now(schedule: tuple) -> tuple:
+    if not schedule:
+        return "Сегодня выступлений нет.", inline_markup([[MAIN_MENU_BUTTON]])
+
+    programs = []
+    buttons = []
+    for conference, current, upcoming in schedule:
+        if current is not None:
+            now_text = performance_line(current)
+        elif upcoming is not None:
+            now_text = "выступления ещё не начались"
+        else:
+            now_text = "выступления закончились"
+        next_text = performance_line(upcoming) if upcoming else "—"
+        programs.append(
+            f"«{conference.name}»\n"
+            f"Сейчас: {now_text}\n"
+            f"Далее: {next_text}\n\n"
+        )
+        buttons.extend(
+            (performance.name, callback_data(PERFORMANCE, performance.pk))
+            for performance in (current, upcoming) if performance is not None
+        )
+
+    return f"Сегодня на программах:\n\n{''.join(programs)}", inline_markup([
+        *chunked(buttons, 2),
+        [('🔄 Обновить', callback_data(NOW)), MAIN_MENU_BUTTON],
+    ])
+
+
+def now_screen() -> tuple:
+    # Экран зависит от времени, поэтому в кэше он лежит под ключом из
+    # текущих и следующих выступлений, а не под действием кнопки
+    schedule = get_now_and_next(timezone.localtime())
+    key = (NOW, tuple(
+        (conference.pk, current and current.pk, upcoming and upcoming.pk)
+        for conference, current, upcoming in schedule
+    ))
+    return render_cache.get(key, lambda: render_now(schedule))
+
+
+def now_block(update):
+    text, reply_markup = now_screen()
+    outbox.submit(
+        update.message.chat_id,
+        update.message.reply_text,
+        text,
+        reply_markup=reply_markup
+    )
+
+
+def menu_screen(action: str, object_id: int = None) -> tuple:
+    if action == NOW:
+        return now_screen()
+    # Несуществующий ключ поднимает DoesNotExist ещё при рендеринге,
+    # поэтому в кэш попадают только настоящие экраны
+    render = SCREENS[action]
+    return render_cache.get(
+        (action, object_id),
+        lambda: render(object_id)
+    )
+
+
+def query_chat_id(query) -> int:
+    # У кнопок под сообщениями из инлайн-режима нет сообщения в чате бота
+    if query.message is not None:
+        return query.message.chat_id
+    return query.from_user.id
+
+
+def answer_query(query, text: str = None) -> None:
+    outbox.submit(
+        query_chat_id(query),
+        query.answer,
+        text,
+        rate_limited=False
+    )
+
+
+def warm_render_cache() -> None:
+    # Экраны, с которых начинает почти каждый слушатель. Первый вызов
+    # get_conferences заодно загружает программу и поисковый индекс
+    for action in (PROGRAMS, QUESTION_PROGRAMS):
+        menu_screen(action)
+    for conference in get_conferences():
+        menu_screen(CONFERENCE, conference.pk)
+        menu_screen(QUESTION_TIMES, conference.pk)
+    now_screen()
+    render_cache.get('inline_results', render_inline_results)
+
+
+def edit_screen(query, text: str, reply_markup: str) -> None:
+    outbox.submit(
+        query_chat_id(query),
+        query.edit_message_text,
+        text=text,
+        reply_markup=reply_markup,
+        rate_limited=False
+    )
+
+
+def render_search_results(query: str, performances: tuple) -> str:
+    if not performances:
+        return f"По запросу «{query}» ничего не нашлось. Попробуйте " \
+               f"другие слова или выберите выступление в программе."
+
+    results = []
+    for number, performance in enumerate(performances, start=1):
+        conference = performance.conference
+        results.append(
+            f"{number}. {performance.name}\n"
+            f"Программа: {conference.name if conference else '—'}, "
+            f"время: {performance.time}\n"
+            f"Спикер: {performance.speaker or '—'}\n\n"
+        )
+    return f"Найдено по запросу «{query}»:\n\n{''.join(results)}"
+
+
+def search_block(update, query: str):
+    message = update.message
+    if not query:
+        outbox.submit(
+            message.chat_id,
+            message.reply_text,
+            "Напишите, что ищете, например: /find Django",
+            reply_markup=START_MARKUP
+        )
+        return
+
+    performances = search_performances(query)
+    buttons = [[(performance.name, callback_data(PERFORMANCE, performance.pk))]
+               for performance in performances]
+    outbox.submit(
+        message.chat_id,
+        message.reply_text,
+        render_search_results(query, performances),
+        reply_markup=inline_markup([*buttons, [MAIN_MENU_BUTTON]])
+    )
+
+
+# Telegram показывает не больше 50 результатов за раз и сам кэширует
+# ответ на одинаковый запрос на INLINE_CACHE_TIME секунд
+INLINE_PAGE_SIZE = 50
+INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', 300))
+
+
+def render_performance_card(performance) -> str:
+    conference = performance.conference
+    return f"{performance.name}\n\n" \
+           f"Программа: {conference.name if conference else '—'}\n" \
+           f"Время: {performance.time}\n" \
+           f"Спикер: {performance.speaker or '—'}\n\n" \
+           f"{performance.description}"
+
+
+def render_inline_results() -> dict:
+    results = {}
+    for performance in get_all_performances():
+        conference = performance.conference
+        results[performance.pk] = InlineQueryResultArticle(
+            id=str(performance.pk),
+            title=performance.name,
+            description=f"{conference.name if conference else '—'}, "
+                        f"{performance.time}, {performance.speaker or '—'}",
+            input_message_content=InputTextMessageContent(
+                render_performance_card(performance)
+            )
+        )
+    return results
+
+
+def inline_results_page(query: str, offset: int) -> tuple:
+    results = render_cache.get('inline_results', render_inline_results)
+    if query:
+        performances = search_performances(
+            query,
+            limit=offset + INLINE_PAGE_SIZE + 1
+        )
+        page = [results[performance.pk]
+                for performance in performances[offset:]]
     else:
-        text = f"У программы «{user_choice}» будут следующие выступления:\n\n" \
-               f"{''.join(performances)}\n" \
-               f"Про какое выступление вам бы хотелось узнать побольше?"
+        page = list(itertools.islice(
+            results.values(),
+            offset,
+            offset + INLINE_PAGE_SIZE + 1
+        ))
+
+    next_offset = ''
+    if len(page) > INLINE_PAGE_SIZE:
+        next_offset = str(offset + INLINE_PAGE_SIZE)
+    return page[:INLINE_PAGE_SIZE], next_offset
+
+
+def question_title(cluster) -> str:
+    if cluster.askers == 1:
+        return f"#{cluster.primary.pk}"
+    return f"#{cluster.primary.pk} (спросили: {cluster.askers})"
+
+
+def question_preview(question) -> str:
+    if len(question.question) <= QUESTION_PREVIEW_LENGTH:
+        return question.question
+    return f"{question.question[:QUESTION_PREVIEW_LENGTH - 1]}…"
+
+
+def render_question_digest(clusters: list) -> str:
+    if len(clusters) == 1:
+        return f"Новый вопрос {question_title(clusters[0])}:\n\n" \
+               f"{question_preview(clusters[0].primary)}\n\n" \
+               f"Чтобы ответить, ответьте на это сообщение."
+
+    questions_text = [
+        f"{question_title(cluster)}: {question_preview(cluster.primary)}\n\n"
+        for cluster in clusters
+    ]
+    return f"Новые вопросы ({len(clusters)}):\n\n" \
+           f"{''.join(questions_text)}" \
+           f"Чтобы ответить, ответьте на это сообщение и начните ответ " \
+           f"с номера вопроса, например #{clusters[0].primary.pk}."
+
 
-    performances = [performance.name for performance in
-                    performances_list]
-    performances.append("Назад")
+def split_question_digests(clusters: list, size: int) -> list:
+    """Делит вопросы на подборки не больше ``size`` штук и одного сообщения.
 
-    return performances, text
+    Возвращает пары (кластеры подборки, текст подборки).
+    """
+    digests = []
+    digest, text = [], ''
+    for cluster in clusters:
+        longer_text = render_question_digest([*digest, cluster])
+        if digest and (len(digest) == size
+                       or len(longer_text) > MAX_MESSAGE_LENGTH):
+            digests.append((digest, text))
+            digest, text = [cluster], render_question_digest([cluster])
+        else:
+            digest, text = [*digest, cluster], longer_text
+    if digest:
+        digests.append((digest, text))
+    return digests
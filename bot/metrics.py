@@ -0,0 +1,274 @@
+import bisect
+import json
+import logging
+import os
+import threading
+import time
+
+from collections import Counter
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.db import connection
+from django.db.backends.signals import connection_created
+
+
+logger = logging.getLogger(__name__)
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+
+BUCKETS = (
+    0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05,
+    0.1, 0.25, 0.5, 1.0, 2.5, 5.0, float('inf')
+)
+
+
+class Histogram:
+    __slots__ = ('counts', 'sum', 'count')
+
+    def __init__(self):
+        self.counts = [0] * len(BUCKETS)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(BUCKETS, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Registry:
+    """Счётчики вызовов, гистограммы времени и число запросов к базе.
+
+    Метрики обработчиков, функций orm_commands и вызовов Bot API
+    различаются меткой ``kind``, а внутри неё - меткой ``name``.
+    События без длительности, например отброшенные флудом обновления,
+    только считаются.
+    """
+
+    def __init__(self, enabled: bool = METRICS_ENABLED):
+        self.enabled = enabled
+        self.histograms = {}
+        self.queries = Counter()
+        self.errors = Counter()
+        self.events = Counter()
+        self._lock = threading.Lock()
+
+    def observe(self, kind: str, name: str, duration: float,
+                queries: int = 0, failed: bool = False) -> None:
+        key = (kind, name)
+        with self._lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = Histogram()
+            histogram.observe(duration)
+            if queries:
+                self.queries[key] += queries
+            if failed:
+                self.errors[key] += 1
+
+    def count(self, kind: str, name: str, amount: int = 1) -> None:
+        with self._lock:
+            self.events[(kind, name)] += amount
+
+    def events_snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f'{kind}:{name}': count
+                for (kind, name), count in self.events.items()
+            }
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                f'{kind}:{name}': {
+                    'calls': histogram.count,
+                    'seconds': histogram.sum,
+                    'buckets': list(histogram.counts),
+                    'queries': self.queries[(kind, name)],
+                    'errors': self.errors[(kind, name)],
+                }
+                for (kind, name), histogram in self.histograms.items()
+            }
+
+    def render_prometheus(self) -> str:
+        lines = [
+            '# TYPE bot_call_duration_seconds histogram',
+        ]
+        with self._lock:
+            items = sorted(self.histograms.items())
+            queries = dict(self.queries)
+            errors = dict(self.errors)
+            events = dict(self.events)
+
+        for (kind, name), histogram in items:
+            labels = f'kind="{kind}",name="{name}"'
+            cumulative = 0
+            for bucket, count in zip(BUCKETS, histogram.counts):
+                cumulative += count
+                le = '+Inf' if bucket == float('inf') else bucket
+                lines.append(
+                    f'bot_call_duration_seconds_bucket{{{labels},le="{le}"}} '
+                    f'{cumulative}'
+                )
+            lines.append(
+                f'bot_call_duration_seconds_sum{{{labels}}} {histogram.sum}'
+            )
+            lines.append(
+                f'bot_call_duration_seconds_count{{{labels}}} '
+                f'{histogram.count}'
+            )
+
+        lines.append('# TYPE bot_db_queries_total counter')
+        for (kind, name), count in sorted(queries.items()):
+            lines.append(
+                f'bot_db_queries_total{{kind="{kind}",name="{name}"}} {count}'
+            )
+        lines.append('# TYPE bot_call_errors_total counter')
+        for (kind, name), count in sorted(errors.items()):
+            lines.append(
+                f'bot_call_errors_total{{kind="{kind}",name="{name}"}} {count}'
+            )
+        lines.append('# TYPE bot_events_total counter')
+        for (kind, name), count in sorted(events.items()):
+            lines.append(
+                f'bot_events_total{{kind="{kind}",name="{name}"}} {count}'
+            )
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+_local = threading.local()
+
+
+def count_query(execute, sql, params, many, context):
+    _local.queries = getattr(_local, 'queries', 0) + 1
+    return execute(sql, params, many, context)
+
+
+def install_query_counter(sender, connection, **kwargs) -> None:
+    if count_query not in connection.execute_wrappers:
+        connection.execute_wrappers.append(count_query)
+
+
+if METRICS_ENABLED:
+    connection_created.connect(install_query_counter)
+    if connection.connection is not None:
+        install_query_counter(sender=None, connection=connection)
+
+
+def instrument(kind: str):
+    def decorator(func):
+        if not METRICS_ENABLED:
+            return func
+
+        name = func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            if not registry.enabled:
+                return func(*args, **kwargs)
+            queries_before = getattr(_local, 'queries', 0)
+            started_at = time.perf_counter()
+            failed = False
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                failed = True
+                raise
+            finally:
+                registry.observe(
+                    kind,
+                    name,
+                    time.perf_counter() - started_at,
+                    queries=getattr(_local, 'queries', 0) - queries_before,
+                    failed=failed
+                )
+        return wrapper
+    return decorator
+
+
+def instrument_bot(bot) -> None:
+    if not METRICS_ENABLED:
+        return
+
+    request = bot.request
+    post = request.post
+
+    def timed_post(url, data, timeout=None):
+        if not registry.enabled:
+            return post(url, data, timeout=timeout)
+        method = url.rsplit('/', 1)[-1]
+        started_at = time.perf_counter()
+        failed = False
+        try:
+            return post(url, data, timeout=timeout)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            registry.observe(
+                'telegram',
+                method,
+                time.perf_counter() - started_at,
+                failed=failed
+            )
+
+    request.post = timed_post
+
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != '/metrics':
+            self.send_error(404)
+            return
+        body = registry.render_prometheus().encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain; version=0.0.4')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def dump_periodically(path: str, interval: float) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            with open(path, 'a', encoding='utf-8') as file:
+                file.write(json.dumps({
+                    'time': time.time(),
+                    'metrics': registry.snapshot(),
+                    'events': registry.events_snapshot(),
+                }, ensure_ascii=False) + '\n')
+        except OSError:
+            logger.exception('Failed to dump metrics to %s', path)
+
+
+def start_exporters() -> None:
+    if not METRICS_ENABLED:
+        return
+
+    port = os.getenv('METRICS_PORT')
+    if port:
+        server = ThreadingHTTPServer(
+            (os.getenv('METRICS_LISTEN', '127.0.0.1'), int(port)),
+            MetricsHandler
+        )
+        threading.Thread(
+            target=server.serve_forever,
+            name='metrics_http',
+            daemon=True
+        ).start()
+
+    jsonl_path = os.getenv('METRICS_JSONL_PATH')
+    if jsonl_path:
+        threading.Thread(
+            target=dump_periodically,
+            args=(jsonl_path, float(os.getenv('METRICS_DUMP_INTERVAL', 60))),
+            name='metrics_dump',
+            daemon=True
+        ).start()
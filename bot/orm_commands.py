@@ -1,99 +1,333 @@
+import datetime
+import logging
 import os
+import re
 
 import sys
 
+from collections import defaultdict
+from concurrent.futures import Future, ThreadPoolExecutor
 from os.path import dirname, abspath
+from typing import Optional
 
 sys.path.append(dirname(dirname(abspath(__file__))))
 
 import django
 
-from telegram import Update
-from telegram.ext import CallbackContext
+from django.db.models import Q
+from django.utils import timezone
 
 
 os.environ["DJANGO_SETTINGS_MODULE"] = 'bot_settings'
 django.setup()
 
 from admin_panel.Conference.models import (
+    BotUser,
     Conference,
     Performance,
     Speaker,
     Question
 )
+from metrics import instrument
+from schedule_cache import schedule_cache
 
 
-def get_programs_list() -> list:
-    programs = [conference.name for conference
-                in Conference.objects.all()]
-    return programs
+logger = logging.getLogger(__name__)
 
+# Запись в SQLite может ждать блокировку, поэтому обработчики бота
+# отдают её ограниченному пулу потоков и не ждут результата
+ORM_WORKERS = int(os.getenv('ORM_WORKERS', 4))
 
-def get_performances_list(context: CallbackContext, user_choice=None) -> list:
-    if user_choice:
-        performances = Performance.objects.filter(
-            conference__name=user_choice
-        )
-        return performances
+orm_executor = ThreadPoolExecutor(
+    max_workers=ORM_WORKERS,
+    thread_name_prefix='orm'
+)
+
+
+def _log_failure(future: Future) -> None:
+    exception = future.exception()
+    if exception is not None:
+        logger.error('Background ORM call failed', exc_info=exception)
+
+
+def run_in_background(func, *args, **kwargs) -> Future:
+    future = orm_executor.submit(func, *args, **kwargs)
+    future.add_done_callback(_log_failure)
+    return future
 
-    performances = Performance.objects.filter(
-        conference__name=context.user_data["performance"]
-    )
-    return performances
 
+def get_schedule_version() -> int:
+    return schedule_cache.get().version
 
-def get_performance(user_choice: str) -> Performance:
-    performance = Performance.objects.get(name=user_choice)
-    return performance
 
+@instrument('orm')
+def get_conferences() -> tuple:
+    return schedule_cache.get().conferences
 
-def get_performances_in_conference(update: Update):
-    conference = Conference.objects.get(
-        name=update.message.text
+
+@instrument('orm')
+def get_conference(conference_id: int) -> Conference:
+    try:
+        return schedule_cache.get().conferences_by_id[conference_id]
+    except KeyError:
+        raise Conference.DoesNotExist(conference_id)
+
+
+@instrument('orm')
+def get_performances_list(conference_id: int) -> tuple:
+    return schedule_cache.get().performances_by_conference.get(
+        conference_id,
+        ()
     )
-    performances = conference.performances.all()
-    return performances
 
 
-def get_performance_by_time(time: str, performance_name: str) -> Performance:
-    performance = Performance.objects.get(
-        time=time,
-        conference__name=performance_name
+@instrument('orm')
+def get_all_performances() -> tuple:
+    return schedule_cache.get().performances
+
+
+@instrument('orm')
+def get_performance(performance_id: int) -> Performance:
+    try:
+        return schedule_cache.get().performances_by_id[performance_id]
+    except KeyError:
+        raise Performance.DoesNotExist(performance_id)
+
+
+@instrument('orm')
+def get_now_and_next(moment: datetime.datetime) -> tuple:
+    """Текущее и следующее выступление каждой программы на дату ``moment``."""
+    snapshot = schedule_cache.get()
+    return tuple(
+        (conference, *snapshot.now_and_next(conference.pk, moment.time()))
+        for conference in snapshot.conferences_by_date.get(moment.date(), ())
     )
-    return performance
 
 
+@instrument('orm')
 def get_speaker_telegram_id(speaker_fullname: str) -> str:
-    speaker = Speaker.objects.get(fullname=speaker_fullname)
+    try:
+        speaker = schedule_cache.get().speakers_by_fullname[speaker_fullname]
+    except KeyError:
+        raise Speaker.DoesNotExist(speaker_fullname)
     return speaker.telegram_id
 
 
+@instrument('orm')
 def get_speaker_by_telegam_id(user_id: str) -> Speaker:
-    speaker = Speaker.objects.get(telegram_id=user_id)
-    return speaker
+    try:
+        return schedule_cache.get().speakers_by_telegram_id[int(user_id)]
+    except KeyError:
+        raise Speaker.DoesNotExist(user_id)
 
 
-def save_question(by_user: str, question: str, speaker_id: str) -> None:
-    speaker = get_speaker_by_telegam_id(user_id=speaker_id)
-    Question.objects.create(
-        telegram_user_id=by_user,
-        question=question,
-        speaker=speaker
+@instrument('orm')
+def save_questions(questions: list) -> None:
+    speakers = schedule_cache.get().speakers_by_telegram_id
+    Question.bulk_create_questions([
+        Question(
+            telegram_user_id=question['by_user'],
+            question=question['question'],
+            speaker=speakers[question['speaker_id']]
+        )
+        for question in questions
+        if question['speaker_id'] in speakers
+    ])
+
+
+@instrument('orm')
+def get_pending_questions() -> dict:
+    pending_questions = defaultdict(list)
+    questions = Question.objects.filter(
+        status=Question.PENDING
+    ).select_related('speaker').order_by('pk')
+    for question in questions:
+        pending_questions[question.speaker.telegram_id].append(question)
+    return pending_questions
+
+
+@instrument('orm')
+def get_open_questions(speaker_ids) -> dict:
+    """Отправленные спикерам сегодня вопросы, на которые нет ответа.
+
+    Вопросы прошлых дней к новым не присоединяются: спикер их уже
+    не увидит, а выборка росла бы с каждым митапом.
+    """
+    open_questions = defaultdict(list)
+    day_started_at = timezone.localtime().replace(
+        hour=0, minute=0, second=0, microsecond=0
+    )
+    questions = Question.objects.filter(
+        speaker__telegram_id__in=speaker_ids,
+        status=Question.DELIVERED,
+        answered_at__isnull=True,
+        delivered_at__gte=day_started_at
+    ).select_related('speaker').order_by('pk')
+    for question in questions:
+        open_questions[question.speaker.telegram_id].append(question)
+    return open_questions
+
+
+@instrument('orm')
+def merge_questions(clusters: list) -> None:
+    duplicates = []
+    for cluster in clusters:
+        for question in cluster.duplicates:
+            question.duplicate_of = cluster.primary
+            question.status = Question.MERGED
+            duplicates.append(question)
+    Question.objects.bulk_update(
+        duplicates,
+        ['duplicate_of', 'status'],
+        batch_size=500
+    )
+
+
+@instrument('orm')
+def mark_questions_delivered(questions: list, message_id: int) -> None:
+    Question.objects.filter(
+        pk__in=[question.pk for question in questions]
+    ).update(
+        status=Question.DELIVERED,
+        delivered_at=timezone.now(),
+        forwarded_message_id=message_id
+    )
+
+
+@instrument('orm')
+def mark_questions_failed(questions: list) -> None:
+    question_ids = [question.pk for question in questions]
+    Question.objects.filter(pk__in=question_ids).update(
+        status=Question.FAILED
+    )
+    # Похожие вопросы снова ждут отправки сами по себе, иначе они
+    # остались бы привязаны к вопросу, который спикер не получил
+    Question.objects.filter(duplicate_of_id__in=question_ids).update(
+        status=Question.PENDING,
+        duplicate_of=None
     )
 
 
-def get_user_answer_id(speaker_id: str,
-                       question_text: str) -> str:
+@instrument('orm')
+def get_answered_question(speaker_id: str, message_id: int,
+                          answer_text: str = None,
+                          question_text: str = None) -> Optional[Question]:
     speaker = get_speaker_by_telegam_id(user_id=speaker_id)
-    question = Question.objects.get(
-        speaker=speaker,
+    questions = Question.objects.filter(speaker=speaker).only(
+        'pk', 'telegram_user_id'
+    )
+    digest_questions = list(questions.filter(forwarded_message_id=message_id))
+    if len(digest_questions) == 1:
+        return digest_questions[0]
+    if digest_questions:
+        # В одной подборке несколько вопросов: спикер указывает номер
+        # вопроса в начале ответа, например «#12 ...»
+        question_number = re.match(r'\s*#(\d+)', answer_text or '')
+        if question_number is None:
+            return None
+        for question in digest_questions:
+            if question.pk == int(question_number.group(1)):
+                return question
+        return None
+
+    # Вопросы, сохранённые до появления forwarded_message_id,
+    # по-прежнему ищем по тексту
+    if question_text is None:
+        raise Question.DoesNotExist(message_id)
+    return questions.filter(
+        forwarded_message_id__isnull=True,
+        duplicate_of__isnull=True,
+        question_hash=Question.hash_text(question_text),
         question=question_text
+    ).latest('pk')
+
+
+@instrument('orm')
+def get_answer_recipients(question_id: int) -> list:
+    """Вопрос и похожие на него: ответ уходит авторам всех этих вопросов."""
+    return list(
+        Question.objects.filter(
+            Q(pk=question_id) | Q(duplicate_of_id=question_id)
+        ).only('pk', 'telegram_user_id', 'answered_at').order_by('pk')
+    )
+
+
+@instrument('orm')
+def save_answer_receipts(receipts: list, blocked_user_ids=()) -> None:
+    """Сохраняет квитанции рассылки одного ответа одним bulk_update.
+
+    ``receipts`` - кортежи ``(вопросы слушателя, ID сообщения с ответом,
+    время доставки, текст ошибки)``.
+    """
+    answered_at = timezone.now()
+    questions = []
+    for user_questions, message_id, delivered_at, error in receipts:
+        for question in user_questions:
+            question.answered_at = question.answered_at or answered_at
+            question.answer_message_id = message_id
+            question.answer_delivered_at = delivered_at
+            question.answer_error = error[:255]
+            questions.append(question)
+
+    Question.objects.bulk_update(
+        questions,
+        ['answered_at', 'answer_message_id', 'answer_delivered_at',
+         'answer_error'],
+        batch_size=500
+    )
+    if blocked_user_ids:
+        BotUser.objects.filter(telegram_id__in=blocked_user_ids).update(
+            is_blocked=True
+        )
+        # Следующее сообщение такого слушателя снимет отметку
+        known_user_ids.difference_update(blocked_user_ids)
+
+
+@instrument('orm')
+def get_speakers_ids() -> frozenset:
+    return schedule_cache.get().speaker_ids
+
+
+@instrument('orm')
+def search_performances(query: str, limit: int = 10) -> tuple:
+    return schedule_cache.get().search_index.search(query, limit=limit)
+
+
+@instrument('orm')
+def is_speaker(user_id: int) -> bool:
+    return user_id in schedule_cache.get().speaker_ids
+
+
+# ID всех, кто писал боту, держим в памяти: в базу попадает только
+# первое обновление от каждого нового пользователя. Заблокировавших бота
+# здесь нет, и первое обновление от них снимает отметку о блокировке
+known_user_ids = set()
+
+
+@instrument('orm')
+def load_known_user_ids() -> None:
+    known_user_ids.update(
+        BotUser.objects.filter(is_blocked=False).values_list(
+            'telegram_id',
+            flat=True
+        )
+    )
+
+
+@instrument('orm')
+def register_user(telegram_id: int, first_name: str, username: str) -> None:
+    user, created = BotUser.objects.get_or_create(
+        telegram_id=telegram_id,
+        defaults={'first_name': first_name, 'username': username or ''}
     )
-    return question.telegram_user_id
+    if not created and user.is_blocked:
+        # Пользователь разблокировал бота и снова получает рассылки
+        BotUser.objects.filter(pk=user.pk).update(is_blocked=False)
 
 
-def get_speakers_ids() -> list:
-    speakers_ids = [speaker.telegram_id for speaker
-                    in Speaker.objects.all()]
-    return speakers_ids
+def remember_user(telegram_id: int, first_name: str, username: str) -> None:
+    if telegram_id in known_user_ids:
+        return
+    known_user_ids.add(telegram_id)
+    run_in_background(register_user, telegram_id, first_name, username)
 
@@ -0,0 +1,293 @@
+import heapq
+import itertools
+import logging
+import os
+import queue
+import threading
+import time
+
+from collections import deque
+from concurrent.futures import Future
+
+from telegram.error import BadRequest, NetworkError, RetryAfter, Unauthorized
+
+from admin_panel.Conference.ratelimit import (
+    CHAT_MESSAGES_PER_SECOND,
+    GLOBAL_MESSAGES_PER_SECOND,
+    TokenBucket
+)
+from metrics import registry
+
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', 8))
+# 0 снимает ограничение, например в нагрузочном тесте. Лимит действует
+# на бота целиком, поэтому процессы из supervisor.py делят его поровну
+OUTBOX_RATE = float(
+    os.getenv('OUTBOX_RATE', GLOBAL_MESSAGES_PER_SECOND)
+) / int(os.getenv('BOT_PROCESSES', 1))
+OUTBOX_CHAT_RATE = float(
+    os.getenv('OUTBOX_CHAT_RATE', CHAT_MESSAGES_PER_SECOND)
+)
+# Telegram допускает короткие всплески сообщений в один чат
+OUTBOX_CHAT_BURST = float(os.getenv('OUTBOX_CHAT_BURST', 3))
+
+MAX_RETRIES = 5
+# Как часто забывать ограничители чатов, которые давно ничего не получали
+PRUNE_INTERVAL = 60.0
+
+_STOP = object()
+_sequence = itertools.count()
+
+
+class OutgoingCall:
+    __slots__ = ('future', 'method', 'args', 'kwargs', 'rate_limited',
+                 'enqueued_at', 'attempts')
+
+    def __init__(self, method, args, kwargs, rate_limited: bool):
+        self.future = Future()
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.rate_limited = rate_limited
+        self.enqueued_at = time.perf_counter()
+        self.attempts = 0
+
+    @property
+    def name(self) -> str:
+        return getattr(self.method, '__name__', 'call')
+
+
+class Shard:
+    """Очередь одного потока отправки.
+
+    Чат всегда попадает в один и тот же поток, поэтому сообщения в него
+    уходят в порядке постановки. Пока чат ждёт своего лимита или
+    повтора после ошибки, поток отправляет сообщения в другие чаты.
+    """
+
+    def __init__(self):
+        self.inbox = queue.SimpleQueue()
+        self.chats = {}
+        self.due = []
+        self.buckets = {}
+        self.stopping = False
+
+    def schedule(self, chat_id: int, at: float) -> None:
+        heapq.heappush(self.due, (at, next(_sequence), chat_id))
+
+
+class Outbox:
+    """Исходящие вызовы Bot API из обработчиков.
+
+    Обработчик только ставит вызов в очередь и сразу возвращается, а
+    время ответа Telegram уходит на ``workers`` потоков отправки с общим
+    пулом соединений бота. Новые сообщения ограничены общим темпом
+    ``rate`` и темпом ``chat_rate`` на чат, ответ RetryAfter
+    приостанавливает отправку всех потоков на указанное Telegram время.
+    """
+
+    def __init__(self, workers: int = OUTBOX_WORKERS,
+                 rate: float = OUTBOX_RATE,
+                 chat_rate: float = OUTBOX_CHAT_RATE,
+                 chat_burst: float = OUTBOX_CHAT_BURST,
+                 clock=time.monotonic):
+        self.workers = workers
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.clock = clock
+        self._bucket = TokenBucket(rate=rate, clock=clock) if rate else None
+        self._shards = [Shard() for _ in range(workers)]
+        self._threads = []
+        self._resume_at = 0.0
+        self._unfinished = 0
+        self._idle = threading.Condition()
+
+    def start(self) -> None:
+        if self._threads:
+            return
+        for number, shard in enumerate(self._shards):
+            thread = threading.Thread(
+                target=self._run,
+                args=(shard,),
+                name=f'outbox_{number}',
+                daemon=True
+            )
+            thread.start()
+            self._threads.append(thread)
+
+    def stop(self, timeout: float = None) -> None:
+        """Дожидается отправки уже поставленных вызовов и гасит потоки."""
+        for shard in self._shards:
+            shard.inbox.put((None, _STOP))
+        for thread in self._threads:
+            thread.join(timeout)
+        self._threads = []
+
+    def submit(self, chat_id: int, method, /, *args,
+               rate_limited: bool = True, **kwargs) -> Future:
+        """Ставит вызов ``method(*args, **kwargs)`` в очередь чата.
+
+        Лимиты действуют только на новые сообщения: ответы на нажатия
+        кнопок и правки сообщений ставятся с ``rate_limited=False``
+        и лишь сохраняют порядок относительно остальных вызовов в чат.
+        """
+        call = OutgoingCall(method, args, kwargs, rate_limited)
+        with self._idle:
+            self._unfinished += 1
+        self._shards[hash(chat_id) % self.workers].inbox.put((chat_id, call))
+        return call.future
+
+    def join(self, timeout: float = None) -> bool:
+        with self._idle:
+            return self._idle.wait_for(
+                lambda: not self._unfinished,
+                timeout=timeout
+            )
+
+    def _run(self, shard: Shard) -> None:
+        last_pruned_at = self.clock()
+        while not shard.stopping or shard.chats:
+            timeout = None
+            if shard.due:
+                timeout = max(0.0, shard.due[0][0] - self.clock())
+            try:
+                item = shard.inbox.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+            while item is not None:
+                self._accept(shard, *item)
+                try:
+                    item = shard.inbox.get_nowait()
+                except queue.Empty:
+                    item = None
+
+            now = self.clock()
+            while shard.due and shard.due[0][0] <= now:
+                _, _, chat_id = heapq.heappop(shard.due)
+                self._process(shard, chat_id)
+                now = self.clock()
+
+            if now - last_pruned_at > PRUNE_INTERVAL:
+                self._prune(shard)
+                last_pruned_at = now
+
+    def _accept(self, shard: Shard, chat_id: int, call) -> None:
+        if call is _STOP:
+            shard.stopping = True
+            return
+        calls = shard.chats.get(chat_id)
+        if calls is None:
+            shard.chats[chat_id] = deque([call])
+            shard.schedule(chat_id, self.clock())
+        else:
+            calls.append(call)
+
+    def _wait(self, shard: Shard, chat_id: int, call) -> float:
+        wait = self._resume_at - self.clock()
+        if wait > 0 or not call.rate_limited:
+            return wait
+
+        bucket = None
+        if self.chat_rate:
+            bucket = shard.buckets.get(chat_id)
+            if bucket is None:
+                bucket = shard.buckets[chat_id] = TokenBucket(
+                    rate=self.chat_rate,
+                    capacity=self.chat_burst,
+                    clock=self.clock
+                )
+            wait = bucket.try_acquire()
+            if wait:
+                return wait
+        if self._bucket is not None:
+            wait = self._bucket.try_acquire()
+            if wait and bucket is not None:
+                bucket.release()
+        return wait
+
+    def _process(self, shard: Shard, chat_id: int) -> None:
+        calls = shard.chats[chat_id]
+        call = calls[0]
+
+        wait = self._wait(shard, chat_id, call)
+        if wait > 0:
+            shard.schedule(chat_id, self.clock() + wait)
+            return
+
+        retry_in = self._send(call)
+        if retry_in is not None:
+            shard.schedule(chat_id, self.clock() + retry_in)
+            return
+
+        calls.popleft()
+        if calls:
+            shard.schedule(chat_id, self.clock())
+        else:
+            del shard.chats[chat_id]
+        with self._idle:
+            self._unfinished -= 1
+            if not self._unfinished:
+                self._idle.notify_all()
+
+    def _send(self, call: OutgoingCall):
+        """Выполняет вызов и возвращает, через сколько секунд его повторить."""
+        call.attempts += 1
+        try:
+            result = call.method(*call.args, **call.kwargs)
+        except RetryAfter as error:
+            if call.attempts < MAX_RETRIES:
+                logger.warning('Flood control, pausing outbox for %s s',
+                               error.retry_after)
+                self._resume_at = max(
+                    self._resume_at,
+                    self.clock() + error.retry_after
+                )
+                return error.retry_after
+            self._finish(call, error=error)
+        except BadRequest as error:
+            # Повторное нажатие той же кнопки не меняет сообщение
+            if 'not modified' in str(error):
+                self._finish(call)
+            else:
+                logger.warning('%s rejected: %s', call.name, error)
+                self._finish(call, error=error)
+        except Unauthorized as error:
+            # Пользователь заблокировал бота
+            self._finish(call, error=error)
+        except NetworkError as error:
+            if call.attempts < MAX_RETRIES:
+                return 2 ** (call.attempts - 1)
+            logger.warning('%s failed: %s', call.name, error)
+            self._finish(call, error=error)
+        except Exception as error:
+            logger.exception('%s failed', call.name)
+            self._finish(call, error=error)
+        else:
+            self._finish(call, result=result)
+        return None
+
+    @staticmethod
+    def _finish(call: OutgoingCall, result=None, error=None) -> None:
+        if registry.enabled:
+            registry.observe(
+                'outbox',
+                call.name,
+                time.perf_counter() - call.enqueued_at,
+                failed=error is not None
+            )
+        if error is None:
+            call.future.set_result(result)
+        else:
+            call.future.set_exception(error)
+
+    @staticmethod
+    def _prune(shard: Shard) -> None:
+        shard.buckets = {
+            chat_id: bucket for chat_id, bucket in shard.buckets.items()
+            if chat_id in shard.chats or not bucket.is_full()
+        }
+
+
+outbox = Outbox()
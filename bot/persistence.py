@@ -0,0 +1,224 @@
+import json
+import logging
+import os
+import threading
+
+from collections import defaultdict
+
+from django.db import transaction
+from telegram.ext import BasePersistence, ConversationHandler
+from telegram.ext.utils.promise import Promise
+
+from admin_panel.Conference.models import BotState
+
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL = float(os.getenv('BOT_PERSISTENCE_FLUSH_INTERVAL', 1))
+
+USER_DATA = 'user_data'
+
+_PENDING = object()
+
+
+class InMemoryStore:
+    """Хранилище с подмножеством интерфейса Redis для хэшей.
+
+    Используется как локальная замена Redis в разработке и бенчмарках.
+    """
+
+    def __init__(self):
+        self._hashes = defaultdict(dict)
+        self._lock = threading.Lock()
+
+    def hgetall(self, name: str) -> dict:
+        with self._lock:
+            return dict(self._hashes.get(name, {}))
+
+    def hset(self, name: str, mapping: dict) -> int:
+        with self._lock:
+            self._hashes[name].update(mapping)
+        return len(mapping)
+
+    def hdel(self, name: str, *keys: str) -> int:
+        with self._lock:
+            hash_ = self._hashes.get(name, {})
+            return sum(hash_.pop(key, None) is not None for key in keys)
+
+
+class DjangoStore:
+    """Хэши в таблице BotState той же базы, что и у админки."""
+
+    def hgetall(self, name: str) -> dict:
+        return dict(
+            BotState.objects.filter(namespace=name).values_list('key', 'value')
+        )
+
+    def hset(self, name: str, mapping: dict) -> int:
+        with transaction.atomic():
+            BotState.objects.filter(
+                namespace=name,
+                key__in=list(mapping)
+            ).delete()
+            BotState.objects.bulk_create(
+                BotState(namespace=name, key=key, value=value)
+                for key, value in mapping.items()
+            )
+        return len(mapping)
+
+    def hdel(self, name: str, *keys: str) -> int:
+        deleted, _ = BotState.objects.filter(
+            namespace=name,
+            key__in=keys
+        ).delete()
+        return deleted
+
+
+def create_store():
+    backend = os.getenv('BOT_PERSISTENCE', 'django')
+    if backend == 'django':
+        return DjangoStore()
+    if backend == 'memory':
+        return InMemoryStore()
+    if backend == 'redis':
+        import redis
+        return redis.Redis.from_url(
+            os.getenv('REDIS_URL', 'redis://localhost:6379/0'),
+            decode_responses=True
+        )
+    raise ValueError(f'Unknown BOT_PERSISTENCE backend: {backend}')
+
+
+def resolve_state(state):
+    # С run_async ConversationHandler отдаёт состояние как пару
+    # (старое состояние, Promise), пока обработчик ещё выполняется
+    while isinstance(state, tuple) and len(state) == 2 \
+            and isinstance(state[1], Promise):
+        old_state, promise = state
+        if not promise.done.is_set():
+            return _PENDING
+        result = promise.result()
+        state = old_state if result is None else result
+    return state
+
+
+class WriteBehindPersistence(BasePersistence):
+    """Персистентность состояний диалогов и user_data с отложенной записью.
+
+    Изменения копятся в памяти и раз в ``flush_interval`` секунд пишутся
+    в хранилище одной пачкой на каждый хэш, а не запросом на каждое
+    сообщение.
+    """
+
+    def __init__(self, store=None, flush_interval: float = FLUSH_INTERVAL):
+        super().__init__(
+            store_user_data=True,
+            store_chat_data=False,
+            store_bot_data=False
+        )
+        self.store = store if store is not None else create_store()
+        self.flush_interval = flush_interval
+        self._pending = defaultdict(dict)
+        self._stored_user_ids = set()
+        self._lock = threading.Lock()
+        self._stopped = threading.Event()
+        self._flusher = threading.Thread(
+            target=self._flush_periodically,
+            name='persistence_flusher',
+            daemon=True
+        )
+        self._flusher.start()
+
+    def get_user_data(self):
+        user_data = defaultdict(dict)
+        for user_id, data in self.store.hgetall(USER_DATA).items():
+            user_data[int(user_id)] = json.loads(data)
+        self._stored_user_ids.update(user_data)
+        return user_data
+
+    def get_chat_data(self):
+        return defaultdict(dict)
+
+    def get_bot_data(self):
+        return {}
+
+    def get_conversations(self, name: str) -> dict:
+        return {
+            tuple(json.loads(key)): json.loads(state)
+            for key, state
+            in self.store.hgetall(self._conversations_name(name)).items()
+        }
+
+    def update_conversation(self, name: str, key: tuple, new_state) -> None:
+        with self._lock:
+            self._pending[self._conversations_name(name)][
+                json.dumps(list(key))
+            ] = new_state
+
+    def update_user_data(self, user_id: int, data: dict) -> None:
+        # Большинство пользователей никогда не заполняет user_data,
+        # пустые словари в хранилище не пишем
+        if not data and user_id not in self._stored_user_ids:
+            return
+        with self._lock:
+            self._pending[USER_DATA][str(user_id)] = dict(data) or None
+            self._stored_user_ids.add(user_id)
+
+    def update_chat_data(self, chat_id: int, data: dict) -> None:
+        pass
+
+    def update_bot_data(self, data: dict) -> None:
+        pass
+
+    def flush(self) -> None:
+        with self._lock:
+            pending, self._pending = self._pending, defaultdict(dict)
+
+        postponed = defaultdict(dict)
+        written = set()
+        try:
+            for name, values in pending.items():
+                mapping = {}
+                deleted = []
+                for key, value in values.items():
+                    value = resolve_state(value)
+                    if value is _PENDING:
+                        postponed[name][key] = values[key]
+                    elif value is None or value == ConversationHandler.END:
+                        deleted.append(key)
+                    else:
+                        mapping[key] = json.dumps(value)
+                if mapping:
+                    self.store.hset(name, mapping=mapping)
+                if deleted:
+                    self.store.hdel(name, *deleted)
+                written.add(name)
+        except Exception:
+            # Хранилище недоступно: незаписанная пачка вернётся в очередь
+            # и уйдёт со следующим сбросом
+            for name, values in pending.items():
+                if name not in written:
+                    postponed[name].update(values)
+            raise
+        finally:
+            if postponed:
+                # Значения, изменённые за время записи, новее отложенных
+                with self._lock:
+                    for name, values in postponed.items():
+                        for key, value in values.items():
+                            self._pending[name].setdefault(key, value)
+
+    def stop(self) -> None:
+        self._stopped.set()
+        self.flush()
+
+    def _flush_periodically(self) -> None:
+        while not self._stopped.wait(self.flush_interval):
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Failed to flush bot state')
+
+    @staticmethod
+    def _conversations_name(name: str) -> str:
+        return f'conversations:{name}'
@@ -0,0 +1,146 @@
+import random
+import re
+import zlib
+
+from collections import defaultdict
+from dataclasses import dataclass, field
+from typing import Iterable, List, Optional
+
+
+WORD_RE = re.compile(r'\w+')
+
+NUM_HASHES = 64
+# 16 полос по 4 значения: пары с похожестью от 0.8 почти всегда
+# попадают в общую корзину хотя бы одной полосы
+BANDS = 16
+ROWS = NUM_HASHES // BANDS
+# Вопросы по одному шаблону часто отличаются единственным словом:
+# "что вы думаете про asyncio" и "... про Rust" совпадают на 4 слова из 6.
+# Порог 0.8 склеивает такие пары только в вопросах от девяти слов, а
+# переформулировки с другой пунктуацией и регистром совпадают целиком
+SIMILARITY_THRESHOLD = 0.8
+
+_PRIME = (1 << 61) - 1
+_random = random.Random(20220801)
+_PERMUTATIONS = [
+    (_random.randrange(1, _PRIME), _random.randrange(0, _PRIME))
+    for _ in range(NUM_HASHES)
+]
+
+
+def normalize(text: str) -> str:
+    return ' '.join(WORD_RE.findall(text.lower().replace('ё', 'е')))
+
+
+def shingles(text: str) -> frozenset:
+    """Множество слов вопроса.
+
+    Сравниваются слова, а не буквенные триграммы: у триграмм вопросы
+    "какую версию Python..." и "какую версию Django..." похожи на 0.7,
+    хотя спрашивают о разном.
+    """
+    # У вопроса из одной пунктуации пустое множество, а MinHash нужно
+    # хотя бы одно значение
+    return frozenset(normalize(text).split()) or frozenset([''])
+
+
+def minhash(shingle_set: frozenset) -> tuple:
+    hashes = [zlib.crc32(shingle.encode('utf-8')) for shingle in shingle_set]
+    return tuple(
+        min((a * value + b) % _PRIME for value in hashes)
+        for a, b in _PERMUTATIONS
+    )
+
+
+def jaccard(first: frozenset, second: frozenset) -> float:
+    if not first or not second:
+        return 0.0
+    return len(first & second) / len(first | second)
+
+
+@dataclass
+class Cluster:
+    primary: object
+    shingles: frozenset
+    duplicates: List[object] = field(default_factory=list)
+
+    @property
+    def size(self) -> int:
+        return 1 + len(self.duplicates)
+
+    @property
+    def askers(self) -> int:
+        """Сколько разных слушателей задали вопросы кластера."""
+        return len({
+            question.telegram_user_id
+            for question in (self.primary, *self.duplicates)
+        })
+
+
+class QuestionIndex:
+    """LSH-индекс вопросов одного спикера по MinHash-подписям.
+
+    Подпись режется на полосы, и кандидатами в дубликаты считаются только
+    вопросы с совпавшей полосой, поэтому новый вопрос сравнивается
+    с горсткой похожих, а не со всеми вопросами спикера.
+    """
+
+    def __init__(self, threshold: float = SIMILARITY_THRESHOLD):
+        self.threshold = threshold
+        self.clusters = []
+        self._buckets = defaultdict(list)
+
+    def find(self, shingle_set: frozenset,
+             signature: tuple) -> Optional[Cluster]:
+        best, best_similarity = None, self.threshold
+        seen = set()
+        for band in self._bands(signature):
+            for cluster in self._buckets.get(band, ()):
+                if id(cluster) in seen:
+                    continue
+                seen.add(id(cluster))
+                similarity = jaccard(shingle_set, cluster.shingles)
+                if similarity >= best_similarity:
+                    best, best_similarity = cluster, similarity
+        return best
+
+    def add(self, question, text: str, merge: bool = True) -> Cluster:
+        """Добавляет вопрос в похожий кластер или начинает новый."""
+        shingle_set = shingles(text)
+        signature = minhash(shingle_set)
+        cluster = self.find(shingle_set, signature) if merge else None
+        if cluster is not None:
+            cluster.duplicates.append(question)
+            return cluster
+
+        cluster = Cluster(primary=question, shingles=shingle_set)
+        self.clusters.append(cluster)
+        for band in self._bands(signature):
+            self._buckets[band].append(cluster)
+        return cluster
+
+    @staticmethod
+    def _bands(signature: tuple) -> Iterable[tuple]:
+        for band in range(BANDS):
+            yield band, signature[band * ROWS:(band + 1) * ROWS]
+
+
+def cluster_questions(questions: Iterable, open_questions: Iterable = (),
+                      threshold: float = SIMILARITY_THRESHOLD) -> list:
+    """Группирует новые вопросы спикера с похожими.
+
+    ``open_questions`` - уже отправленные спикеру вопросы без ответа: новый
+    похожий вопрос присоединяется к ним и второй раз спикеру не уходит.
+    Возвращает кластеры, в которых есть хотя бы один новый вопрос.
+    """
+    index = QuestionIndex(threshold=threshold)
+    for question in open_questions:
+        index.add(question, question.question, merge=False)
+    existing = len(index.clusters)
+    for question in questions:
+        index.add(question, question.question)
+
+    return [
+        cluster for number, cluster in enumerate(index.clusters)
+        if number >= existing or cluster.duplicates
+    ]
@@ -0,0 +1,142 @@
+import logging
+import os
+import queue
+
+from telegram.error import BadRequest, TelegramError, Unauthorized
+from telegram.ext import CallbackContext
+
+# orm_commands настраивает sys.path и Django, поэтому импортируется первым
+from orm_commands import (
+    get_open_questions,
+    get_pending_questions,
+    mark_questions_delivered,
+    mark_questions_failed,
+    merge_questions,
+    save_questions
+)
+from menu_blocks import split_question_digests
+from metrics import instrument
+from outbox import outbox
+from question_clusters import cluster_questions
+
+
+logger = logging.getLogger(__name__)
+
+DIGEST_INTERVAL = float(os.getenv('QUESTION_DIGEST_INTERVAL', 30))
+# Вопросы копятся в памяти процесса, поэтому сохраняются в базу чаще,
+# чем уходят подборки: при падении процесса теряются секунды, а не минута
+SAVE_INTERVAL = float(os.getenv('QUESTION_SAVE_INTERVAL', 2))
+DIGEST_SIZE = int(os.getenv('QUESTION_DIGEST_SIZE', 10))
+
+
+class QuestionInbox:
+    """Очередь вопросов спикерам с доставкой подборками.
+
+    Обработчик только кладёт вопрос в очередь. Раз в ``SAVE_INTERVAL``
+    секунд фоновая задача сохраняет накопленные вопросы одним bulk_create,
+    а раз в ``DIGEST_INTERVAL`` секунд другая задача отправляет каждому спикеру подборки не больше ``digest_size`` вопросов
+    и не длиннее одного сообщения. Похожие вопросы склеиваются: спикер
+    получает один из них с числом спросивших, сначала самые популярные,
+    а похожие на уже отправленные вопросы без ответа к нему больше
+    не приходят.
+    """
+
+    def __init__(self, digest_size: int = DIGEST_SIZE):
+        self.digest_size = digest_size
+        self._queue = queue.SimpleQueue()
+
+    def put(self, by_user: int, question: str, speaker_id: int) -> None:
+        self._queue.put({
+            'by_user': by_user,
+            'question': question,
+            'speaker_id': speaker_id,
+        })
+
+    def drain(self) -> list:
+        questions = []
+        while True:
+            try:
+                questions.append(self._queue.get_nowait())
+            except queue.Empty:
+                return questions
+
+    @instrument('job')
+    def save(self, context: CallbackContext = None) -> None:
+        questions = self.drain()
+        if not questions:
+            return
+        try:
+            save_questions(questions)
+        except Exception:
+            # Вопросы не теряются: их сохранит следующий запуск задачи
+            for question in questions:
+                self._queue.put(question)
+            raise
+
+    def stop(self) -> None:
+        """Сохраняет вопросы, принятые после последнего запуска задачи."""
+        try:
+            self.save()
+        except Exception:
+            logger.exception('Questions were not saved on shutdown')
+
+    @instrument('job')
+    def deliver(self, context: CallbackContext) -> None:
+        self.save()
+
+        # Подборки уходят через общую очередь отправки, а задача ждёт
+        # результатов, чтобы отметить доставку в базе
+        pending_questions = get_pending_questions()
+        if not pending_questions:
+            return
+        open_questions = get_open_questions(list(pending_questions))
+
+        sent = []
+        merged = []
+        for speaker_id, speaker_questions in pending_questions.items():
+            clusters = cluster_questions(
+                speaker_questions,
+                open_questions.get(speaker_id, ())
+            )
+            merged.extend(cluster for cluster in clusters if cluster.duplicates)
+            new_clusters = sorted(
+                (cluster for cluster in clusters
+                 if cluster.primary.status == cluster.primary.PENDING),
+                key=lambda cluster: (-cluster.askers, cluster.primary.pk)
+            )
+            for clusters_digest, text in split_question_digests(
+                    new_clusters, self.digest_size):
+                digest = [cluster.primary for cluster in clusters_digest]
+                sent.append((speaker_id, digest, outbox.submit(
+                    speaker_id,
+                    context.bot.send_message,
+                    chat_id=speaker_id,
+                    text=text
+                )))
+        if merged:
+            merge_questions(merged)
+
+        for speaker_id, digest, future in sent:
+            try:
+                message = future.result()
+            except Unauthorized:
+                # Спикер не начал диалог с ботом или заблокировал его
+                logger.warning('Cannot deliver questions to %s', speaker_id)
+                mark_questions_failed(digest)
+            except BadRequest as error:
+                if 'chat not found' not in str(error).lower():
+                    # Например, слишком длинное сообщение: вопросы остаются
+                    # в очереди, а не пропадают навсегда
+                    logger.exception('Question digest to %s postponed',
+                                     speaker_id)
+                    continue
+                logger.warning('Cannot deliver questions to %s', speaker_id)
+                mark_questions_failed(digest)
+            except TelegramError:
+                logger.exception('Question digest to %s postponed',
+                                 speaker_id)
+            else:
+                mark_questions_delivered(digest, message.message_id)
+
+
+question_inbox = QuestionInbox()
@@ -0,0 +1,195 @@
+import bisect
+import datetime
+import os
+import threading
+import time
+
+from collections import defaultdict
+from dataclasses import dataclass
+from types import MappingProxyType
+from typing import FrozenSet, Mapping, Optional, Tuple
+
+from django.db.models.signals import post_delete, post_save
+
+from admin_panel.Conference.models import (
+    Conference,
+    Performance,
+    ScheduleVersion,
+    Speaker
+)
+from search_index import SearchIndex
+
+
+VERSION_CHECK_INTERVAL = float(
+    os.getenv('SCHEDULE_VERSION_CHECK_INTERVAL', 5)
+)
+# У выступления есть только время начала, поэтому последнее выступление
+# программы считается идущим столько минут
+LAST_PERFORMANCE_DURATION = datetime.timedelta(
+    minutes=int(os.getenv('LAST_PERFORMANCE_MINUTES', 60))
+)
+
+
+@dataclass(frozen=True)
+class ScheduleSnapshot:
+    version: int
+    conferences: Tuple[Conference, ...]
+    performances: Tuple[Performance, ...]
+    conferences_by_id: Mapping[int, Conference]
+    performances_by_conference: Mapping[int, Tuple[Performance, ...]]
+    performance_times: Mapping[int, Tuple[datetime.time, ...]]
+    conferences_by_date: Mapping[datetime.date, Tuple[Conference, ...]]
+    performances_by_id: Mapping[int, Performance]
+    speakers_by_fullname: Mapping[str, Speaker]
+    speakers_by_telegram_id: Mapping[int, Speaker]
+    speaker_ids: FrozenSet[int]
+    search_index: SearchIndex
+
+    @classmethod
+    def load(cls, version: int) -> 'ScheduleSnapshot':
+        conferences = tuple(Conference.objects.order_by('date', 'name'))
+        speakers = tuple(Speaker.objects.all())
+        performances = tuple(
+            Performance.objects.select_related(
+                'speaker',
+                'conference'
+            ).order_by('conference__date', 'conference__name', 'time', 'pk')
+        )
+
+        conferences_by_date = defaultdict(list)
+        performances_by_conference = {}
+        for conference in conferences:
+            conferences_by_date[conference.date].append(conference)
+            performances_by_conference[conference.pk] = []
+        for performance in performances:
+            if performance.conference_id is None:
+                continue
+            performances_by_conference[performance.conference_id].append(
+                performance
+            )
+
+        return cls(
+            version=version,
+            conferences=conferences,
+            performances=performances,
+            conferences_by_id=MappingProxyType(
+                {conference.pk: conference for conference in conferences}
+            ),
+            performances_by_conference=MappingProxyType({
+                conference_id: tuple(conference_performances)
+                for conference_id, conference_performances
+                in performances_by_conference.items()
+            }),
+            # Выступления программы уже отсортированы по времени, так что
+            # поиск текущего выступления - это bisect по этому кортежу
+            performance_times=MappingProxyType({
+                conference_id: tuple(
+                    performance.time
+                    for performance in conference_performances
+                )
+                for conference_id, conference_performances
+                in performances_by_conference.items()
+            }),
+            conferences_by_date=MappingProxyType({
+                date: tuple(date_conferences)
+                for date, date_conferences in conferences_by_date.items()
+            }),
+            performances_by_id=MappingProxyType(
+                {performance.pk: performance for performance in performances}
+            ),
+            speakers_by_fullname=MappingProxyType(
+                {speaker.fullname: speaker for speaker in speakers}
+            ),
+            speakers_by_telegram_id=MappingProxyType(
+                {speaker.telegram_id: speaker for speaker in speakers}
+            ),
+            speaker_ids=frozenset(speaker.telegram_id for speaker in speakers),
+            search_index=SearchIndex(performances),
+        )
+
+    def now_and_next(self, conference_id: int,
+                     moment: datetime.time) -> tuple:
+        """Выступление программы, которое идёт в ``moment``, и следующее."""
+        performances = self.performances_by_conference.get(conference_id, ())
+        position = bisect.bisect_right(
+            self.performance_times.get(conference_id, ()),
+            moment
+        )
+        current = performances[position - 1] if position else None
+        upcoming = performances[position] \
+            if position < len(performances) else None
+
+        if current is not None and upcoming is None:
+            started = datetime.datetime.combine(datetime.date.min,
+                                                current.time)
+            now = datetime.datetime.combine(datetime.date.min, moment)
+            if now - started >= LAST_PERFORMANCE_DURATION:
+                current = None
+        return current, upcoming
+
+
+class ScheduleCache:
+    """Read-through кэш программы, который перестраивается при смене версии.
+
+    Версию в базе пишет админка (см. Conference/signals.py), кэш сверяется
+    с ней не чаще раза в ``check_interval`` секунд, поэтому между проверками
+    запросы к программе вообще не доходят до базы.
+    """
+
+    def __init__(self, check_interval: float = VERSION_CHECK_INTERVAL):
+        self.check_interval = check_interval
+        self.hits = 0
+        self.misses = 0
+        self._snapshot: Optional[ScheduleSnapshot] = None
+        self._checked_at = 0.0
+        self._lock = threading.Lock()
+
+    def get(self) -> ScheduleSnapshot:
+        snapshot = self._snapshot
+        if snapshot is not None and \
+                time.monotonic() - self._checked_at < self.check_interval:
+            self.hits += 1
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            now = time.monotonic()
+            if snapshot is not None and now - self._checked_at < self.check_interval:
+                self.hits += 1
+                return snapshot
+
+            version = ScheduleVersion.get_version()
+            self._checked_at = now
+            if snapshot is not None and snapshot.version == version:
+                self.hits += 1
+                return snapshot
+
+            self.misses += 1
+            self._snapshot = ScheduleSnapshot.load(version=version)
+            return self._snapshot
+
+    def invalidate(self, **kwargs) -> None:
+        self._snapshot = None
+
+    def stats(self) -> dict:
+        snapshot = self._snapshot
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'version': snapshot.version if snapshot else None,
+        }
+
+
+schedule_cache = ScheduleCache()
+
+for model in (Conference, Performance, Speaker):
+    post_save.connect(
+        schedule_cache.invalidate,
+        sender=model,
+        dispatch_uid=f'schedule_cache_{model.__name__}_save'
+    )
+    post_delete.connect(
+        schedule_cache.invalidate,
+        sender=model,
+        dispatch_uid=f'schedule_cache_{model.__name__}_delete'
+    )
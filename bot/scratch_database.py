@@ -0,0 +1,39 @@
+import atexit
+import os
+import shutil
+import tempfile
+
+
+# Процессы из supervisor.py наследуют окружение и открывают ту же базу
+SCRATCH_ENV = 'MEETUP_SCRATCH_SQLITE_PATH'
+
+
+def use_scratch_database() -> str:
+    """Направляет Django во временную SQLite-базу вместо рабочей.
+
+    Нагрузочный тест и бенчмарки создают и удаляют пользователей, вопросы
+    и программу, поэтому рабочую базу они не трогают. Вызывается до
+    django.setup(), база удаляется при выходе создавшего её процесса.
+    """
+    path = os.environ.get(SCRATCH_ENV)
+    if path is None:
+        directory = tempfile.mkdtemp(prefix='meetup_scratch_')
+        atexit.register(shutil.rmtree, directory, ignore_errors=True)
+        path = os.environ[SCRATCH_ENV] = os.path.join(directory, 'db.sqlite3')
+    os.environ['DB_ENGINE'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = path
+    return path
+
+
+def migrate_scratch_database() -> None:
+    from django.conf import settings
+    from django.core.management import call_command
+
+    path = os.environ.get(SCRATCH_ENV)
+    database = settings.DATABASES['default']
+    if path is None or database['ENGINE'] != 'django.db.backends.sqlite3' \
+            or str(database['NAME']) != path:
+        raise SystemExit(
+            'Django настроен на рабочую базу, замер на ней не запускается'
+        )
+    call_command('migrate', verbosity=0)
@@ -0,0 +1,151 @@
+import bisect
+import heapq
+import math
+import re
+
+from collections import defaultdict
+from typing import Iterable, Tuple
+
+from admin_panel.Conference.models import Performance
+
+
+TOKEN_RE = re.compile(r'\w+')
+
+# Совпадение в названии выступления важнее совпадения в описании
+FIELD_WEIGHTS = (
+    ('name', 3.0),
+    ('speaker_fullname', 2.0),
+    ('speaker_speciality', 1.0),
+    ('description', 1.0),
+)
+
+MIN_PREFIX_LENGTH = 3
+MAX_PREFIX_TERMS = 64
+PREFIX_PENALTY = 0.8
+COVERAGE_BONUS = 1_000_000.0
+
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower().replace('ё', 'е'))
+
+
+def performance_fields(performance: Performance) -> dict:
+    speaker = performance.speaker
+    return {
+        'name': performance.name,
+        'speaker_fullname': speaker.fullname if speaker else '',
+        'speaker_speciality': speaker.speciality if speaker else '',
+        'description': performance.description,
+    }
+
+
+class SearchIndex:
+    """Инвертированный индекс выступлений для поиска из бота.
+
+    Строится один раз на версию программы вместе со снимком в
+    schedule_cache. Для каждого слова заранее посчитан вес выступления
+    с учётом поля и IDF, поэтому поиск - это несколько обращений
+    к словарю и выбор лучших результатов.
+    """
+
+    def __init__(self, performances: Iterable[Performance]):
+        self.performances = tuple(performances)
+
+        term_weights = defaultdict(lambda: defaultdict(float))
+        for number, performance in enumerate(self.performances):
+            fields = performance_fields(performance)
+            for field, weight in FIELD_WEIGHTS:
+                for token in tokenize(fields[field]):
+                    term_weights[token][number] += weight
+
+        total = len(self.performances)
+        # Для каждого слова выступления отсортированы по убыванию веса:
+        # поиск идёт по спискам сверху и останавливается, как только
+        # оставшиеся выступления уже не могут попасть в лучшие
+        self._postings = {}
+        self._ranked = {}
+        for term, weights in term_weights.items():
+            idf = math.log(1 + total / len(weights))
+            ranked = sorted(
+                ((number, weight * idf) for number, weight in weights.items()),
+                key=lambda posting: posting[1],
+                reverse=True
+            )
+            self._postings[term] = dict(ranked)
+            self._ranked[term] = tuple(ranked)
+        self._terms = sorted(self._postings)
+
+    def _expand(self, token: str) -> list:
+        if len(token) < MIN_PREFIX_LENGTH:
+            return []
+        start = bisect.bisect_left(self._terms, token)
+        terms = []
+        for term in self._terms[start:start + MAX_PREFIX_TERMS + 1]:
+            if not term.startswith(token):
+                break
+            if term != token:
+                terms.append(term)
+        return terms
+
+    def _token_terms(self, token: str) -> list:
+        terms = []
+        if token in self._postings:
+            terms.append((self._ranked[token], self._postings[token], 1.0))
+        for term in self._expand(token):
+            terms.append(
+                (self._ranked[term], self._postings[term], PREFIX_PENALTY)
+            )
+        return terms
+
+    @staticmethod
+    def _score(number: int, tokens: list) -> float:
+        total = 0.0
+        for terms in tokens:
+            best = 0.0
+            for _, postings, factor in terms:
+                score = postings.get(number, 0.0) * factor
+                if score > best:
+                    best = score
+            # Сначала выступления, где нашлись все слова запроса
+            if best:
+                total += COVERAGE_BONUS + best
+        return total
+
+    def search(self, query: str, limit: int = 10) -> Tuple[Performance, ...]:
+        tokens = [self._token_terms(token) for token in set(tokenize(query))]
+        tokens = [terms for terms in tokens if terms]
+
+        best = []
+        seen = set()
+        depth = 0
+        while True:
+            threshold = 0.0
+            exhausted = True
+            for terms in tokens:
+                token_best = 0.0
+                for ranked, _, factor in terms:
+                    if depth >= len(ranked):
+                        continue
+                    exhausted = False
+                    number, score = ranked[depth]
+                    if score * factor > token_best:
+                        token_best = score * factor
+                    if number in seen:
+                        continue
+                    seen.add(number)
+                    item = (self._score(number, tokens), -number)
+                    if len(best) < limit:
+                        heapq.heappush(best, item)
+                    elif item > best[0]:
+                        heapq.heapreplace(best, item)
+                if token_best:
+                    threshold += COVERAGE_BONUS + token_best
+
+            depth += 1
+            if exhausted or len(best) == limit and best[0][0] >= threshold:
+                break
+
+        return tuple(
+            self.performances[-number]
+            for _, number in sorted(best, reverse=True)
+        )
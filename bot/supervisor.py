@@ -0,0 +1,271 @@
+import argparse
+import logging
+import multiprocessing
+import os
+import signal
+import sys
+import threading
+import time
+
+from dotenv import load_dotenv
+from telegram import Bot, Update
+from telegram.error import NetworkError, RetryAfter
+from telegram.ext import Defaults, TypeHandler
+from telegram.utils.request import Request
+
+from fake_telegram import create_fake_bot
+
+
+logging.basicConfig(
+    format='%(asctime)s - %(processName)s - %(name)s - %(levelname)s - '
+           '%(message)s',
+    level=logging.INFO
+)
+
+logger = logging.getLogger(__name__)
+
+POLL_TIMEOUT = 30
+CHECK_INTERVAL = 1.0
+STOP_TIMEOUT = 30.0
+
+# Поля обновления, в которых Telegram присылает отправителя
+UPDATE_FIELDS = (
+    'message',
+    'edited_message',
+    'callback_query',
+    'inline_query',
+    'chosen_inline_result',
+    'channel_post',
+    'edited_channel_post',
+    'shipping_query',
+    'pre_checkout_query',
+    'poll_answer',
+    'my_chat_member',
+    'chat_member',
+)
+
+
+def routing_key(data: dict) -> int:
+    """ID пользователя (или чата), по которому обновление идёт в процесс.
+
+    Состояние ConversationHandler хранится по пользователю, поэтому все
+    его обновления должны попадать в один и тот же процесс.
+    """
+    for field in UPDATE_FIELDS:
+        payload = data.get(field)
+        if payload is None:
+            continue
+        sender = payload.get('from') or payload.get('user')
+        if sender is not None:
+            return sender['id']
+        chat = payload.get('chat')
+        if chat is not None:
+            return chat['id']
+    return data['update_id']
+
+
+def run_worker(number: int, inbox, processed, ready,
+               fake_latency: float = None) -> None:
+    # Django и бот загружаются уже в дочернем процессе: супервизору они
+    # не нужны, а каждый процесс должен открыть свои соединения с базой
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    # Каждый процесс отдаёт свои метрики на своём порту и в свой файл
+    metrics_port = os.getenv('METRICS_PORT')
+    if metrics_port:
+        os.environ['METRICS_PORT'] = str(int(metrics_port) + number)
+    metrics_path = os.getenv('METRICS_JSONL_PATH')
+    if metrics_path:
+        os.environ['METRICS_JSONL_PATH'] = f'{metrics_path}.{number}'
+
+    from bot import create_updater, warm_up
+    from metrics import start_exporters
+    from orm_commands import run_in_background
+    from outbox import outbox
+    from question_inbox import question_inbox
+
+    if fake_latency is None:
+        updater = create_updater(deliver_digests=number == 0)
+    else:
+        updater = create_updater(
+            bot=create_fake_bot(
+                defaults=Defaults(run_async=False),
+                latency=fake_latency
+            ),
+            deliver_digests=number == 0
+        )
+    dispatcher = updater.dispatcher
+
+    def count_update(update, context):
+        processed.value += 1
+
+    # Последняя группа: обновление считается, когда его обработали все
+    # остальные обработчики
+    dispatcher.add_handler(
+        TypeHandler(Update, count_update, run_async=False),
+        group=1_000
+    )
+    dispatcher_thread = threading.Thread(
+        target=dispatcher.start,
+        name='dispatcher',
+        daemon=True
+    )
+    dispatcher_thread.start()
+    updater.job_queue.start()
+    start_exporters()
+    run_in_background(warm_up).add_done_callback(lambda future: ready.set())
+
+    while True:
+        data = inbox.get()
+        if data is None:
+            break
+        dispatcher.update_queue.put(Update.de_json(data, updater.bot))
+
+    dispatcher.stop()
+    dispatcher_thread.join()
+    updater.job_queue.stop()
+    question_inbox.stop()
+    outbox.stop(timeout=STOP_TIMEOUT)
+    dispatcher.persistence.stop()
+
+
+class Supervisor:
+    """Запускает ``workers`` процессов бота и раздаёт им обновления.
+
+    Обновления одного пользователя всегда уходят в один процесс, так что
+    состояние диалога и очередь его сообщений остаются в этом процессе.
+    Упавший процесс перезапускается, состояния диалогов он читает из
+    персистентности. Подборки вопросов рассылает только процесс с номером 0.
+    """
+
+    def __init__(self, workers: int, fake_latency: float = None):
+        self.workers = workers
+        self.fake_latency = fake_latency
+        self.restarts = 0
+        self._context = multiprocessing.get_context('spawn')
+        self._inboxes = [self._context.Queue() for _ in range(workers)]
+        self._processed = [
+            self._context.RawValue('q', 0) for _ in range(workers)
+        ]
+        self._ready = [self._context.Event() for _ in range(workers)]
+        self._processes = [None] * workers
+        self._stopping = threading.Event()
+
+    def _spawn(self, number: int) -> None:
+        process = self._context.Process(
+            target=run_worker,
+            args=(
+                number,
+                self._inboxes[number],
+                self._processed[number],
+                self._ready[number],
+                self.fake_latency,
+            ),
+            name=f'bot_worker_{number}',
+            daemon=True
+        )
+        process.start()
+        self._processes[number] = process
+
+    def start(self) -> None:
+        # Дочерние процессы наследуют окружение, по нему outbox делит
+        # общий темп отправки между процессами
+        os.environ['BOT_PROCESSES'] = str(self.workers)
+        for number in range(self.workers):
+            self._spawn(number)
+        threading.Thread(
+            target=self._watch,
+            name='supervisor_watch',
+            daemon=True
+        ).start()
+
+    def wait_ready(self, timeout: float = None) -> bool:
+        return all(ready.wait(timeout) for ready in self._ready)
+
+    def dispatch(self, data: dict) -> None:
+        self._inboxes[routing_key(data) % self.workers].put(data)
+
+    def processed(self) -> int:
+        return sum(counter.value for counter in self._processed)
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(CHECK_INTERVAL):
+            for number, process in enumerate(self._processes):
+                if process.is_alive() or self._stopping.is_set():
+                    continue
+                logger.error('Worker %s exited with code %s, restarting',
+                             number, process.exitcode)
+                # Упавший процесс мог оставить блокировку очереди занятой,
+                # поэтому новый процесс получает новую очередь, а ещё не
+                # разобранные обновления его пользователей теряются
+                inbox = self._inboxes[number]
+                inbox.cancel_join_thread()
+                inbox.close()
+                self._inboxes[number] = self._context.Queue()
+                self._ready[number].clear()
+                self.restarts += 1
+                self._spawn(number)
+
+    def stop(self, timeout: float = STOP_TIMEOUT) -> None:
+        self._stopping.set()
+        for inbox in self._inboxes:
+            inbox.put(None)
+        deadline = time.monotonic() + timeout
+        for process in self._processes:
+            process.join(max(0.0, deadline - time.monotonic()))
+            if process.is_alive():
+                process.terminate()
+
+
+def poll_updates(supervisor: Supervisor, token: str) -> None:
+    bot = Bot(token, request=Request(read_timeout=POLL_TIMEOUT + 10))
+    bot.delete_webhook()
+    url = f'{bot.base_url}/getUpdates'
+
+    offset = 0
+    while True:
+        try:
+            # Сырые словари уходят в процессы без разбора в объекты Update
+            updates = bot.request.post(
+                url,
+                {'offset': offset, 'timeout': POLL_TIMEOUT},
+                timeout=POLL_TIMEOUT + 10
+            )
+        except RetryAfter as error:
+            time.sleep(error.retry_after)
+            continue
+        except NetworkError:
+            logger.warning('getUpdates failed, retrying', exc_info=True)
+            time.sleep(CHECK_INTERVAL)
+            continue
+
+        for data in updates:
+            offset = data['update_id'] + 1
+            supervisor.dispatch(data)
+
+
+def main() -> None:
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(
+        description='Бот в нескольких процессах с общим приёмом обновлений'
+    )
+    parser.add_argument(
+        '--workers',
+        type=int,
+        default=int(os.getenv('BOT_PROCESSES', os.cpu_count() or 1))
+    )
+    args = parser.parse_args()
+
+    supervisor = Supervisor(workers=args.workers)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    supervisor.start()
+    try:
+        poll_updates(supervisor, os.environ['TELEGRAM_BOT_TOKEN'])
+    except (KeyboardInterrupt, SystemExit):
+        pass
+    finally:
+        supervisor.stop()
+
+
+if __name__ == '__main__':
+    main()
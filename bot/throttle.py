@@ -0,0 +1,60 @@
+import os
+
+from telegram import Update
+from telegram.ext import CallbackContext, DispatcherHandlerStop
+
+from menu_blocks import answer_query
+from orm_commands import is_speaker
+from metrics import registry
+from outbox import outbox
+from user_rate_limiter import UserRateLimiter
+
+
+# 0 снимает ограничение, например в нагрузочном тесте. Человек, который
+# быстро листает меню, укладывается в THROTTLE_BURST обновлений подряд
+THROTTLE_RATE = float(os.getenv('THROTTLE_RATE', 2))
+THROTTLE_BURST = float(os.getenv('THROTTLE_BURST', 20))
+THROTTLE_MAX_USERS = int(os.getenv('THROTTLE_MAX_USERS', 100_000))
+
+THROTTLED_TEXT = 'Слишком много сообщений подряд, подождите немного.'
+
+limiter = UserRateLimiter(
+    rate=THROTTLE_RATE,
+    capacity=THROTTLE_BURST,
+    max_users=THROTTLE_MAX_USERS
+)
+
+
+def throttle_update(update: Update, context: CallbackContext) -> None:
+    """Отбрасывает обновления пользователя сверх его лимита.
+
+    Выполняется в потоке диспетчера раньше всех обработчиков, поэтому
+    флуд не доходит ни до базы, ни до пула обработчиков, ни до Bot API.
+    """
+    user = update.effective_user
+    if not THROTTLE_RATE or user is None:
+        return
+    if limiter.allow(user.id):
+        return
+    # Спикер может быстро отвечать на много вопросов подряд
+    if is_speaker(user.id):
+        return
+
+    if registry.enabled:
+        registry.count('throttle', 'dropped')
+    if limiter.should_warn(user.id):
+        warn(update)
+    raise DispatcherHandlerStop()
+
+
+def warn(update: Update) -> None:
+    if registry.enabled:
+        registry.count('throttle', 'warned')
+    if update.callback_query is not None:
+        answer_query(update.callback_query, THROTTLED_TEXT)
+    elif update.effective_chat is not None:
+        outbox.submit(
+            update.effective_chat.id,
+            update.effective_chat.send_message,
+            THROTTLED_TEXT
+        )
@@ -0,0 +1,62 @@
+import time
+
+from collections import OrderedDict
+
+
+class UserRateLimiter:
+    """Ведро токенов на каждого пользователя с ограниченной памятью.
+
+    Ведро хранится как список ``[токены, время обновления, предупреждён]``
+    в OrderedDict по давности обращения: проверка и вытеснение самого
+    давнего пользователя при переполнении стоят O(1), а памяти нужно не
+    больше ``max_users`` вёдер. Вытесняется тот, кто дольше всех молчал, и
+    его ведро к этому времени обычно уже полное. Блокировки нет: limiter
+    вызывается из одного потока.
+    """
+
+    def __init__(self, rate: float, capacity: float, max_users: int,
+                 clock=time.monotonic):
+        self.rate = rate
+        self.capacity = capacity
+        self.max_users = max_users
+        self.clock = clock
+        self.evicted = 0
+        self._buckets = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+    def allow(self, user_id: int) -> bool:
+        now = self.clock()
+        bucket = self._buckets.get(user_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_users:
+                self._buckets.popitem(last=False)
+                self.evicted += 1
+            self._buckets[user_id] = [self.capacity - 1, now, False]
+            return True
+
+        self._buckets.move_to_end(user_id)
+        tokens = bucket[0] + (now - bucket[1]) * self.rate
+        if tokens > self.capacity:
+            tokens = self.capacity
+        bucket[1] = now
+        if tokens >= 1:
+            bucket[0] = tokens - 1
+            bucket[2] = False
+            return True
+        bucket[0] = tokens
+        return False
+
+    def should_warn(self, user_id: int) -> bool:
+        """Предупреждать ли пользователя, которому только что отказали.
+
+        Предупреждение уходит одно на серию отброшенных обновлений: флаг
+        сбрасывает первое пропущенное обновление, а вместе с вытесненным
+        ведром забывается и он.
+        """
+        bucket = self._buckets.get(user_id)
+        if bucket is None or bucket[2]:
+            return False
+        bucket[2] = True
+        return True
@@ -1,5 +1,12 @@
 from admin_panel.Meetup.settings import *
 
-INSTALLED_APPS[INSTALLED_APPS.index('Conference')] = 'admin_panel.Conference'
+# Боту нужны только модели Conference и база: админка, авторизация,
+# сессии и шаблоны лишь замедляли бы каждый перезапуск
+INSTALLED_APPS = ['admin_panel.Conference']
+MIDDLEWARE = []
+TEMPLATES = []
+AUTH_PASSWORD_VALIDATORS = []
+ROOT_URLCONF = None
+WSGI_APPLICATION = None
 
 USING_TG_BOT_SETTINGS = True